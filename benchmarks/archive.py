@@ -0,0 +1,103 @@
+"""Database size and lookup latency before and after archiving old rows.
+
+Generated rows, spread evenly over the last --days days, go through the
+rows repo into a fresh database file with an archive attached. The rows
+older than --older-than-days are archived, both files are vacuumed and
+measured, and get_by_id is timed for random hot and archived rows, as is
+a page of rows that includes archived ones.
+
+    PYTHONPATH=. python benchmarks/archive.py --rows 1000000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from config import settings
+from data_collection.archive import create_archive_tables
+from data_collection.migrations import migrate
+from data_collection.models import Row, TableConfig
+from data_collection.unit_of_work import create_db_engine, SqlModelUnitOfWork
+from generate import rows, table_config
+
+PAGE_SIZE = 100
+INSERT_BATCH_SIZE = 10_000
+
+
+def vacuum(engine) -> None:
+    with engine.connect() as connection:
+        for schema in ("main", "archive"):
+            connection.exec_driver_sql(f"PRAGMA {schema}.wal_checkpoint(TRUNCATE)")
+            connection.exec_driver_sql(f"VACUUM {schema}")
+
+
+def mean_ms(function, arguments) -> float:
+    start = time.perf_counter()
+    for argument in arguments:
+        function(argument)
+    return (time.perf_counter() - start) / len(arguments) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=3650)
+    parser.add_argument("--older-than-days", type=int, default=365)
+    parser.add_argument("--segment-rows", type=int, default=settings.archive_segment_rows)
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "hot.db")
+        archive_path = os.path.join(directory, "archive.db")
+        engine = create_db_engine(settings.copy(update={"db_path": db_path, "archive_path": archive_path}))
+        migrate(engine)
+        create_archive_tables(engine)
+        now = datetime.utcnow()
+        step = timedelta(days=args.days) / args.rows
+        with SqlModelUnitOfWork(engine, archive=True) as uow:
+            config = uow.table_configs.add(TableConfig(**table_config("all")))
+            uow.commit()
+            generated = list(rows(config.id, "all", args.rows, args.seed))
+            for offset in range(0, args.rows, INSERT_BATCH_SIZE):
+                batch = generated[offset:offset + INSERT_BATCH_SIZE]
+                uow.rows.add_many([
+                    Row(**row, created_at=now - (args.rows - offset - i) * step)
+                    for i, row in enumerate(batch)
+                ])
+                uow.commit()
+        vacuum(engine)
+        result = {"rows": args.rows, "db_size_mib_before": os.path.getsize(db_path) / 2 ** 20}
+
+        rng = random.Random(args.seed)
+        sample = rng.sample(range(1, args.rows + 1), args.lookups)
+        with SqlModelUnitOfWork(engine, archive=True) as uow:
+            result["get_by_id_ms_before"] = mean_ms(uow.rows.get_by_id, sample)
+            start = time.perf_counter()
+            archived = uow.rows.archive(
+                now - timedelta(days=args.older_than_days), segment_rows=args.segment_rows
+            )
+            result["archived_rows"] = archived
+            result["archive_rows_per_second"] = archived / (time.perf_counter() - start)
+        vacuum(engine)
+        result["db_size_mib_after"] = os.path.getsize(db_path) / 2 ** 20
+        result["archive_size_mib"] = os.path.getsize(archive_path) / 2 ** 20
+
+        with SqlModelUnitOfWork(engine, archive=True) as uow:
+            hot = [row_id for row_id in sample if row_id > archived]
+            cold = [row_id for row_id in sample if row_id <= archived]
+            result["get_by_id_ms_hot"] = mean_ms(uow.rows.get_by_id, hot)
+            result["get_by_id_ms_archived"] = mean_ms(uow.rows.get_by_id, cold)
+            result["page_ms_archived"] = mean_ms(
+                lambda after: uow.rows.page(PAGE_SIZE, after, include_archived=True), cold[:100]
+            )
+        engine.dispose()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
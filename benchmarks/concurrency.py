@@ -0,0 +1,138 @@
+"""Latency of the API under many concurrent clients.
+
+Starts the app under uvicorn against a scratch database and hammers it over
+HTTP. Most clients fetch single rows while some create rows (a commit and
+an fsync each) and a few page through large listings, which shows whether
+slow requests hold up everyone else. Requests answered 503 by admission
+control (see main.py) are counted as shed rather than timed; set
+admission_control=false in the environment to compare without it.
+
+    PYTHONPATH=. python benchmarks/concurrency.py --clients 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(client: httpx.AsyncClient) -> None:
+    for _ in range(100):
+        try:
+            await client.get("/openapi.json")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def run(args, base_url: str) -> dict:
+    limits = httpx.Limits(max_connections=args.clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        await wait_until_up(client)
+        response = await client.post(
+            "/table-configs",
+            json={"name": "FarmingPracticeConfig", "config_fields": {"columns": {}}},
+        )
+        table_config_id = response.json()["id"]
+        response = await client.post(
+            "/rows/bulk",
+            json=[{"table_config_id": table_config_id, "data": {}}] * args.rows,
+        )
+        ids = response.json()["ids"]
+        row = {"table_config_id": table_config_id, "data": {}}
+
+        latencies: dict[str, list[float]] = {"get": [], "list": [], "create": []}
+        shed = {kind: 0 for kind in latencies}
+        remaining = args.requests
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                dice = random.random()
+                start = time.perf_counter()
+                if dice < args.list_ratio:
+                    kind = "list"
+                    response = await client.get(f"/rows?limit={args.list_size}")
+                elif dice < args.list_ratio + args.create_ratio:
+                    kind = "create"
+                    response = await client.post("/rows", json=row)
+                else:
+                    kind = "get"
+                    response = await client.get(f"/rows/{random.choice(ids)}")
+                if response.status_code == 503:
+                    shed[kind] += 1
+                    continue
+                latencies[kind].append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.clients)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "clients": args.clients,
+        "requests": args.requests,
+        "requests_per_second": args.requests / elapsed,
+        **{
+            kind: {
+                "count": len(samples),
+                "shed": shed[kind],
+                "p50_ms": statistics.median(samples) * 1000,
+                "p99_ms": percentile(samples, 0.99) * 1000,
+            }
+            for kind, samples in latencies.items()
+            if samples
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--list-ratio", type=float, default=0.02)
+    parser.add_argument("--list-size", type=int, default=500)
+    parser.add_argument("--create-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        env = {**os.environ, "db_path": os.path.join(directory, "bench.db")}
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+             "--log-level", "warning", "--timeout-keep-alive", "300"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            result = asyncio.run(run(args, f"http://127.0.0.1:{port}"))
+        finally:
+            server.terminate()
+            server.wait()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Synthetic table configs, views and rows for benchmarks.
+
+Columns are those of the readme's two example tables. A config takes one
+of the column mixes below, and its rows are random but valid for it, so
+they go through row validation like real data would. The same seed always
+gives the same data.
+
+    PYTHONPATH=. python benchmarks/generate.py --table-config-id 1 --rows 10000 > rows.ndjson
+"""
+import argparse
+import json
+import random
+import string
+import sys
+from typing import Callable, Iterator
+
+from data_collection.constants import TableConfigName, TableViewName
+from data_collection.storage import OBJECT, STORAGE_MODES
+
+CROPS = ["corn", "wheat", "barley", "hops", "soy", "canola"]
+WORDS = ["no", "till", "cover", "crop", "late", "rain", "field", "wet", "dry", "north"]
+
+
+def comment(rng: random.Random):
+    return " ".join(rng.choices(WORDS, k=rng.randint(1, 12)))
+
+
+def account_id(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_uppercase, k=2)) + f"{rng.randrange(10 ** 6):06d}"
+
+
+# column name: (config spec, value for a row or None to leave it out)
+COLUMNS: dict[str, tuple[dict, Callable[[random.Random], object]]] = {
+    "year": (
+        {"type": "int", "required": True, "ge": 1900, "le": 2100, "indexed": True},
+        lambda rng: rng.randint(2000, 2023),
+    ),
+    "crop_type": (
+        {"type": "str", "choices": CROPS, "indexed": True},
+        lambda rng: rng.choice(CROPS),
+    ),
+    "tillage_depth": (
+        {"type": "float", "ge": 0, "lt": 10},
+        lambda rng: round(rng.uniform(0, 9.99), 2) if rng.random() < 0.8 else None,
+    ),
+    "comments": (
+        {"type": "str"},
+        lambda rng: comment(rng) if rng.random() < 0.3 else None,
+    ),
+    "is_tilled": ({"type": "bool"}, lambda rng: rng.random() < 0.5),
+    "external_account_id": (
+        {"type": "str", "regex": "[A-Z]{2}[0-9]{6}"},
+        account_id,
+    ),
+}
+MIXES = {
+    "practices": ["year", "crop_type", "tillage_depth", "comments"],
+    "accounts": ["year", "is_tilled", "external_account_id", "tillage_depth"],
+    "all": list(COLUMNS),
+}
+VIEW_SPECS = {
+    "tillage_depth": {"display_type": "FLOAT_SLIDER"},
+    "external_account_id": {"validation_regex": "[A-Z]{2}[0-9]+"},
+}
+
+
+def table_config(mix: str, storage: str = OBJECT) -> dict:
+    # TableConfig.name is unique and its enum has one member, so a
+    # database holds a single config
+    columns = MIXES[mix]
+    # the dashboard summaries: per year, and crops per year
+    summaries = [["year"]] + ([["year", "crop_type"]] if "crop_type" in columns else [])
+    return {
+        "name": TableConfigName.FARMING_PRACTICE_CONFIG,
+        "config_fields": {
+            "columns": {name: COLUMNS[name][0] for name in columns},
+            "summaries": summaries,
+            "storage": storage,
+        },
+    }
+
+
+def table_views(table_config_id: int, mix: str, count: int) -> list[dict]:
+    names = list(TableViewName)
+    if count > len(names):
+        raise ValueError(f"at most {len(names)} views, one per TableViewName")
+    columns = MIXES[mix]
+    return [
+        {
+            "name": names[i],
+            "table_config_id": table_config_id,
+            "view_fields": {
+                "num_rows": 5 + i,
+                "column_order": columns[i:] + columns[:i],
+                "columns": {name: VIEW_SPECS.get(name, {}) for name in columns},
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def rows(table_config_id: int, mix: str, count: int, seed: int = 0) -> Iterator[dict]:
+    rng = random.Random(seed)
+    columns = [(name, COLUMNS[name][1]) for name in MIXES[mix]]
+    for _ in range(count):
+        data = {}
+        for name, value in columns:
+            data[name] = value(rng)
+            if data[name] is None:
+                del data[name]
+        yield {"table_config_id": table_config_id, "data": data}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic rows as NDJSON.")
+    parser.add_argument("--table-config-id", type=int, required=True)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--mix", choices=MIXES, default="all")
+    parser.add_argument("--storage", choices=STORAGE_MODES, default=OBJECT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--config", action="store_true", help="write the config instead")
+    args = parser.parse_args()
+    if args.config:
+        json.dump(table_config(args.mix, args.storage), sys.stdout)
+        sys.stdout.write("\n")
+        return
+    for row in rows(args.table_config_id, args.mix, args.rows, args.seed):
+        sys.stdout.write(json.dumps(row) + "\n")
+
+
+if __name__ == "__main__":
+    main()
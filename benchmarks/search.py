@@ -0,0 +1,89 @@
+"""Insert cost and query latency of the rows' full-text index.
+
+Generated rows go through the rows repo into a fresh database file, which
+indexes their str columns as they're added; the file is vacuumed and the
+index's share of it measured with dbstat. Then searches are timed for the
+first page and a deep one: a word in a single row (an account id), a prefix
+in a few hundred, and words from the comments' small vocabulary, which
+match a large part of the table and so have every match ranked.
+
+    PYTHONPATH=. python benchmarks/search.py --rows 1000000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import timeit
+
+from sqlalchemy import text
+
+from config import settings
+from data_collection.migrations import migrate
+from data_collection.models import Row, TableConfig
+from data_collection.unit_of_work import create_db_engine, SqlModelUnitOfWork
+from generate import rows, table_config
+
+PAGE_SIZE = 20
+DEEP_OFFSET = 1000
+INSERT_BATCH_SIZE = 10_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "search.db")
+        engine = create_db_engine(settings.copy(update={"db_path": db_path}))
+        migrate(engine)
+        with SqlModelUnitOfWork(engine) as uow:
+            config = uow.table_configs.add(TableConfig(**table_config("all")))
+            uow.commit()
+            generated = list(rows(config.id, "all", args.rows, args.seed))
+            start = time.perf_counter()
+            for offset in range(0, args.rows, INSERT_BATCH_SIZE):
+                batch = generated[offset:offset + INSERT_BATCH_SIZE]
+                uow.rows.add_many([Row(**row) for row in batch])
+                uow.commit()
+            insert_seconds = time.perf_counter() - start
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+            connection.exec_driver_sql("VACUUM")
+            index_bytes = connection.execute(
+                text("SELECT sum(pgsize) FROM dbstat WHERE name GLOB 'row_fts*'")
+            ).scalar()
+
+        account = random.Random(args.seed).choice(generated)["data"]["external_account_id"]
+        queries = {
+            "one_match": account,
+            "prefix": account[:3] + "*",
+            "common_word": "rain",
+            "common_words": "late rain field",
+        }
+        result = {
+            "rows": args.rows,
+            "insert_rows_per_second": args.rows / insert_seconds,
+            "db_size_mib": os.path.getsize(db_path) / 2 ** 20,
+            "index_size_mib": index_bytes / 2 ** 20,
+        }
+        for name, query in queries.items():
+            with SqlModelUnitOfWork(engine) as uow:
+                result[f"{name}_matches"] = len(uow.rows.search(query, args.rows))
+                for page, offset in (("first", 0), ("deep", DEEP_OFFSET)):
+                    seconds = min(timeit.repeat(
+                        lambda: uow.rows.search(query, PAGE_SIZE + 1, offset, config.id),
+                        number=1,
+                        repeat=args.repeat,
+                    ))
+                    result[f"{name}_{page}_page_ms"] = seconds * 1000
+        engine.dispose()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
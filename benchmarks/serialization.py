@@ -0,0 +1,76 @@
+"""Cost per entity of turning a list response into bytes.
+
+Compares what FastAPI does for a handler returning entities with a
+response_model (validate against the model, jsonable_encoder, json.dumps)
+with EntityResponse, with and without orjson, for each entity type.
+
+    PYTHONPATH=. python benchmarks/serialization.py --count 1000
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import parse_obj_as
+
+from data_collection import serialization
+from data_collection.models import RenderedTableView, Row, TableConfig, TableView, User
+from generate import MIXES, rows, table_config, table_views
+
+
+def entities(count: int) -> dict[str, list]:
+    now = datetime.utcnow()
+    config = table_config("all")
+    view = table_views(1, "all", 1)[0]
+    return {
+        "User": [User(id=i, name=f"user {i}") for i in range(count)],
+        "TableConfig": [TableConfig(id=i, created_at=now, **config) for i in range(count)],
+        "TableView": [TableView(id=i, created_at=now, **view) for i in range(count)],
+        "RenderedTableView": [
+            RenderedTableView(
+                table_view_id=i,
+                table_config_id=1,
+                num_rows=5,
+                columns=[{"name": name, "type": "str"} for name in MIXES["all"]],
+            )
+            for i in range(count)
+        ],
+        "Row": [
+            Row(id=i, created_at=now, **row) for i, row in enumerate(rows(1, "all", count))
+        ],
+    }
+
+
+def fastapi_body(model, content) -> bytes:
+    return JSONResponse(jsonable_encoder(parse_obj_as(list[model], content))).body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=1000, help="entities per response")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    orjson = serialization.orjson
+    results = {}
+    for name, content in entities(args.count).items():
+        model = type(content[0])
+        paths = {
+            "fastapi": lambda: fastapi_body(model, content),
+            "json": lambda: serialization.dumps_json(content),
+        }
+        if orjson is not None:
+            paths["orjson"] = lambda: serialization.dumps(content)
+        expected = paths["fastapi"]()
+        results[name] = {}
+        for path, render in paths.items():
+            assert render() == expected, f"{name}: {path} output differs"
+            seconds = min(timeit.repeat(render, number=1, repeat=args.repeat))
+            results[name][f"{path}_us_per_entity"] = seconds / args.count * 1e6
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
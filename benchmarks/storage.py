@@ -0,0 +1,103 @@
+"""File size and scan speed of Row.data stored as objects and positionally.
+
+For each storage mode the same generated rows go through the rows repo
+into a fresh database file. The file is vacuumed and measured, then four
+scans over every row are timed: paging through the rows as entities (which
+includes turning positional rows back into objects), a CSV export, a
+filter on an unindexed column and an aggregation the summaries can't
+answer.
+
+    PYTHONPATH=. python benchmarks/storage.py --rows 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import timeit
+
+from sqlalchemy import text
+
+from config import settings
+from data_collection.aggregation import parse_aggregation
+from data_collection.export import export_rows, ExportFormat
+from data_collection.migrations import migrate
+from data_collection.models import Row, TableConfig
+from data_collection.row_filters import parse_row_filters
+from data_collection.unit_of_work import create_db_engine, SqlModelUnitOfWork
+from generate import rows, STORAGE_MODES, table_config
+
+PAGE_SIZE = 1000
+INSERT_BATCH_SIZE = 10_000
+
+
+def page_through(uow, table_config_id: int, row_filters=()) -> int:
+    count, after = 0, None
+    while True:
+        page = uow.rows.page(PAGE_SIZE, after, table_config_id=table_config_id, filters=row_filters)
+        count += len(page)
+        if len(page) < PAGE_SIZE:
+            return count
+        after = page[-1].id
+
+
+def measure(storage: str, args, directory: str) -> dict:
+    db_path = os.path.join(directory, f"{storage}.db")
+    engine = create_db_engine(settings.copy(update={"db_path": db_path}))
+    migrate(engine)
+    with SqlModelUnitOfWork(engine) as uow:
+        config = uow.table_configs.add(TableConfig(**table_config(args.mix, storage)))
+        uow.commit()
+        generated = list(rows(config.id, args.mix, args.rows, args.seed))
+        start = time.perf_counter()
+        for offset in range(0, args.rows, INSERT_BATCH_SIZE):
+            batch = generated[offset:offset + INSERT_BATCH_SIZE]
+            uow.rows.add_many([Row(**row) for row in batch])
+            uow.commit()
+        insert_seconds = time.perf_counter() - start
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        connection.exec_driver_sql("VACUUM")
+        data_bytes = connection.execute(text("SELECT avg(length(data)) FROM row")).scalar()
+
+    row_filters = parse_row_filters(config, ["tillage_depth:gt:5"])
+    aggregation = parse_aggregation(config, ["is_tilled"], ["avg:tillage_depth"], [])
+    scans = {
+        "page": lambda uow: page_through(uow, config.id),
+        "export_csv": lambda uow: sum(
+            1 for _ in export_rows(
+                config, uow.rows.export_batches(config, settings.export_batch_size), ExportFormat.CSV
+            )
+        ),
+        "filter": lambda uow: page_through(uow, config.id, row_filters),
+        "aggregate": lambda uow: uow.rows.aggregate(config, aggregation),
+    }
+    result = {
+        "db_size_mib": os.path.getsize(db_path) / 2 ** 20,
+        "data_bytes_per_row": data_bytes,
+        "insert_rows_per_second": args.rows / insert_seconds,
+    }
+    for name, scan in scans.items():
+        with SqlModelUnitOfWork(engine) as uow:
+            seconds = min(timeit.repeat(lambda: scan(uow), number=1, repeat=args.repeat))
+        result[f"{name}_rows_per_second"] = args.rows / seconds
+    engine.dispose()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    # the mixes with the columns the scans filter and group on
+    parser.add_argument("--mix", choices=["accounts", "all"], default="all")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {storage: measure(storage, args, directory) for storage in STORAGE_MODES}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
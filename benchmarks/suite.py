@@ -0,0 +1,187 @@
+"""Throughput and latency of the main API paths at several table sizes.
+
+For each size the app runs in-process, in a fresh worker process and on a
+fresh database file, and is driven through Starlette's TestClient over
+rows from generate.py: bulk inserts up to the size, then single creates,
+gets, list pages, filtered list pages and deletes at random ids. Results,
+including each worker's peak RSS, are written as JSON; pass an earlier
+result file as --baseline to print how this run compares.
+
+    PYTHONPATH=. python benchmarks/suite.py --sizes 10000 100000 --output after.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+from concurrency import percentile
+from generate import MIXES, rows, STORAGE_MODES, table_config, table_views
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def summarize(samples: list[float], items: int = 0) -> dict:
+    elapsed = sum(samples)
+    summary = {
+        "count": len(samples),
+        "per_second": len(samples) / elapsed,
+        "p50_ms": statistics.median(samples) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+    }
+    if items:
+        summary["items_per_second"] = items / elapsed
+    return summary
+
+
+def timed(samples: list[float], request, *args, expected: int = 200, **kwargs):
+    start = time.perf_counter()
+    response = request(*args, **kwargs)
+    samples.append(time.perf_counter() - start)
+    if response.status_code != expected:
+        raise RuntimeError(f"{response.request.url}: {response.status_code} {response.text[:200]}")
+    return response
+
+
+def run_size(size: int, args: dict) -> dict:
+    # imported here so that the app and its settings load in the worker
+    from fastapi.testclient import TestClient
+
+    from config import settings
+
+    with tempfile.TemporaryDirectory() as directory:
+        settings.db_path = os.path.join(directory, "bench.db")
+        import main
+
+        rng = random.Random(args["seed"])
+        latencies = {
+            name: [] for name in ("bulk", "create", "get", "list", "filter", "delete")
+        }
+        with TestClient(main.app) as client:
+            response = client.post(
+                "/table-configs", json=table_config(args["mix"], args["storage"])
+            )
+            table_config_id = response.json()["id"]
+            for table_view in table_views(table_config_id, args["mix"], args["views"]):
+                client.post("/table-views", json=table_view).raise_for_status()
+
+            generated = rows(table_config_id, args["mix"], size, args["seed"])
+            ids = []
+            while len(ids) < size:
+                batch = list(itertools.islice(generated, args["bulk_size"]))
+                response = timed(latencies["bulk"], client.post, "/rows/bulk", json=batch, expected=201)
+                ids.extend(response.json()["ids"])
+
+            requests = args["requests"]
+            for row in rows(table_config_id, args["mix"], requests, args["seed"] + 1):
+                timed(latencies["create"], client.post, "/rows", json=row, expected=201)
+            for row_id in rng.choices(ids, k=requests):
+                timed(latencies["get"], client.get, f"/rows/{row_id}")
+            for row_id in rng.choices(ids, k=max(1, requests // 10)):
+                params = {"table_config_id": table_config_id, "after": row_id, "limit": 100}
+                timed(latencies["list"], client.get, "/rows", params=params)
+            row_filter = "crop_type:eq:corn" if "crop_type" in MIXES[args["mix"]] else "year:eq:2020"
+            for row_id in rng.choices(ids, k=max(1, requests // 10)):
+                params = {
+                    "table_config_id": table_config_id,
+                    "after": row_id,
+                    "limit": 100,
+                    "filter": row_filter,
+                }
+                timed(latencies["filter"], client.get, "/rows", params=params)
+            for row_id in rng.sample(ids, k=requests):
+                timed(latencies["delete"], client.delete, f"/rows/{row_id}", expected=204)
+
+        result = {
+            "rows": size,
+            **{
+                name: summarize(samples, size if name == "bulk" else 0)
+                for name, samples in latencies.items()
+            },
+            # ru_maxrss is in KiB on Linux
+            "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "db_size_mib": os.path.getsize(settings.db_path) / 2 ** 20,
+        }
+    return result
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """Print each metric of this run as a multiple of the baseline's."""
+    before = {size["rows"]: size for size in baseline["sizes"]}
+    for size in results["sizes"]:
+        if size["rows"] not in before:
+            continue
+        print(f"rows={size['rows']} vs {baseline['revision']}")
+        for name, summary in size.items():
+            if not isinstance(summary, dict):
+                continue
+            old = before[size["rows"]].get(name)
+            if not old:
+                continue
+            ratios = ", ".join(
+                f"{metric} x{value / old[metric]:.2f}"
+                for metric, value in summary.items()
+                if metric != "count" and old.get(metric)
+            )
+            print(f"  {name:8} {ratios}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--requests", type=int, default=1000, help="single-row requests per path")
+    parser.add_argument("--bulk-size", type=int, default=5000, help="rows per bulk request")
+    parser.add_argument("--mix", choices=MIXES, default="all")
+    parser.add_argument("--storage", choices=STORAGE_MODES, default=STORAGE_MODES[0])
+    parser.add_argument("--views", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file for the JSON results, standard output by default")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    args = parser.parse_args()
+
+    results = {
+        "revision": git_revision(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+        "sizes": [],
+    }
+    for size in args.sizes:
+        # a new process per size, so peak RSS and caches are its own
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            results["sizes"].append(pool.submit(run_size, size, vars(args)).result())
+        print(f"rows={size} done", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,61 @@
+from typing import Optional
+
 from pydantic import BaseSettings
 
 
 class Settings(BaseSettings):
+    # "sqlite", or "memory" for the in-memory store in data_collection.memory
+    storage_backend: str = "sqlite"
     db_path: str = "database.db"
+    db_echo: bool = False
+    # SQLite tuning, applied to every new connection
+    db_journal_mode: str = "wal"
+    db_synchronous: str = "normal"
+    db_busy_timeout_ms: int = 5000
+    db_cache_size_kib: int = 64 * 1024
+    db_mmap_size: int = 256 * 1024 * 1024
+    # connections kept open per worker process, plus overflow under load
+    db_pool_size: int = 8
+    db_max_overflow: int = 8
+    db_pool_timeout: float = 30
+    # migrate the schema at startup; with several workers, run
+    # python -m data_collection.migrations once instead and turn this off
+    db_migrate: bool = True
+    # TableConfigs and TableViews kept in memory per worker process, each
+    entity_cache_size: int = 1024
+    # rows deleted per transaction by filtered and cascading deletes
+    delete_chunk_size: int = 5000
+    # rows fetched, encoded and sent per step of an export
+    export_batch_size: int = 10_000
+    # uploads are spooled here until imported; the system temp dir if unset
+    import_dir: Optional[str] = None
+    # rows validated and inserted per transaction of an import
+    import_batch_size: int = 5000
+    # imports run at once per worker process; SQLite has a single writer
+    import_workers: int = 1
+    # the SQLite file old rows are moved to (see data_collection.archive),
+    # rows per compressed segment there, and the age in days at which
+    # python -m data_collection.archive moves rows by default; unset, there
+    # is no archive
+    archive_path: Optional[str] = None
+    archive_segment_rows: int = 1000
+    archive_after_days: Optional[int] = None
+    # requests holding a unit of work at once per worker process, reads and
+    # writes apart; together they should stay under the threadpool's 40
+    # threads, and SQLite has a single writer
+    admission_control: bool = True
+    admission_read_limit: int = 32
+    admission_write_limit: int = 4
+    # requests that may wait their turn, and for how long, before the rest
+    # are answered 503 with a Retry-After of admission_retry_after seconds
+    admission_read_queue: int = 256
+    admission_write_queue: int = 64
+    admission_timeout: float = 5
+    admission_retry_after: int = 1
+    # the in-memory store's log and snapshots; nothing is kept if unset
+    memory_dir: Optional[str] = None
+    # writes logged before the in-memory store is snapshotted again
+    memory_snapshot_every: int = 100_000
 
 
 settings = Settings()
@@ -0,0 +1,115 @@
+"""Admission control for requests that use the database.
+
+Past a point, more requests at once only make each of them slower: SQLite
+takes one writer at a time, and a worker has a fixed number of threadpool
+threads for sync handlers. Reads and writes each go through a Gate. Up to
+``limit`` requests hold a unit of work at once, up to ``queue_size`` more
+wait their turn in arrival order for at most ``timeout`` seconds, and the
+rest are turned away at once with AdmissionRejected. That way a spike gets
+quick 503s instead of every request timing out.
+
+Requests wait on the event loop rather than on a threadpool thread, and
+gates are only used from the event loop, so they take no lock.
+"""
+import asyncio
+import time
+from collections import deque
+from threading import Lock
+
+from data_collection.constants import AccessKind, RejectReason
+from data_collection.exceptions import AdmissionRejected
+from data_collection.metrics import format_labels, Histogram
+
+WAIT_SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Gate:
+    def __init__(self, limit: int, queue_size: int, timeout: float) -> None:
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.rejected = {reason: 0 for reason in RejectReason}
+
+    async def acquire(self) -> float:
+        """Wait for a slot; returns the seconds waited."""
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return 0.0
+        if len(self.waiters) >= self.queue_size:
+            self.rejected[RejectReason.QUEUE_FULL] += 1
+            raise AdmissionRejected(RejectReason.QUEUE_FULL)
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected[RejectReason.TIMEOUT] += 1
+            raise AdmissionRejected(RejectReason.TIMEOUT) from None
+        except BaseException:
+            # cancelled, e.g. by the client going away, as a slot was handed over
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            if future in self.waiters:
+                self.waiters.remove(future)
+        return time.perf_counter() - start
+
+    def release(self) -> None:
+        # the slot goes straight to the longest waiter, so requests that
+        # arrive meanwhile can't jump the queue
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class Admission:
+    def __init__(self, gates: dict[AccessKind, Gate]) -> None:
+        self.gates = gates
+        # observed on the event loop, rendered on a threadpool thread
+        self.lock = Lock()
+        self.wait_seconds = Histogram(WAIT_SECONDS_BUCKETS)
+
+    async def acquire(self, kind: AccessKind) -> None:
+        seconds = await self.gates[kind].acquire()
+        with self.lock:
+            self.wait_seconds.observe((kind.value,), seconds)
+
+    def release(self, kind: AccessKind) -> None:
+        self.gates[kind].release()
+
+    def render(self) -> str:
+        gates = sorted((kind.value, gate) for kind, gate in self.gates.items())
+
+        def gauge(name: str, help: str, value) -> list[str]:
+            return [
+                f"# HELP {name} {help}",
+                f"# TYPE {name} gauge",
+                *(f'{name}{{kind="{kind}"}} {value(gate)}' for kind, gate in gates),
+            ]
+
+        with self.lock:
+            wait_seconds = self.wait_seconds.render("admission_wait_seconds", ("kind",))
+        lines = [
+            *gauge("admission_in_flight", "Requests holding a unit of work.", lambda gate: gate.active),
+            *gauge("admission_limit", "Requests allowed to hold a unit of work.", lambda gate: gate.limit),
+            *gauge("admission_queue_depth", "Requests waiting their turn.", lambda gate: len(gate.waiters)),
+            *gauge("admission_queue_size", "Requests allowed to wait.", lambda gate: gate.queue_size),
+            "# HELP admission_rejected_total Requests answered 503, by reason.",
+            "# TYPE admission_rejected_total counter",
+            *(
+                f"admission_rejected_total{{{format_labels(('kind', 'reason'), (kind, reason.value))}}} {count}"
+                for kind, gate in gates
+                for reason, count in gate.rejected.items()
+            ),
+            "# HELP admission_wait_seconds Time admitted requests waited for their turn.",
+            "# TYPE admission_wait_seconds histogram",
+            *wait_seconds,
+        ]
+        return "\n".join(lines) + "\n"
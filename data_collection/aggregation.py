@@ -0,0 +1,241 @@
+"""Group-by aggregates over values inside Row.data.
+
+Any aggregation of a config's rows can be computed in SQLite by grouping
+on ``json_extract`` of the group columns. For the groupings a config
+declares in ``config_fields["summaries"]``, plus the whole config, running
+totals are kept in RowAggregate instead: one record per group and numeric
+column with the number of non-null values and their total, plus one per
+group (column "") with its row count. They are upserted in the same
+transaction as the rows they count, so reading count, sum or avg for such a
+grouping costs O(groups) however many rows there are. min and max can't be
+kept up to date through deletes this way and always run in SQLite.
+"""
+import json
+from collections import defaultdict
+from typing import Iterable, NamedTuple, Union
+
+from sqlalchemy import delete, func, text
+from sqlalchemy.engine import Connection
+from sqlmodel import select, Session
+
+from data_collection.exceptions import InvalidAggregation, InvalidTableConfig
+from data_collection.models import RowAggregate, TableConfig
+from data_collection.row_filters import data_value, IDENTIFIER, row_filter_criteria, RowFilter
+from data_collection.storage import data_path
+
+FUNCTIONS = {"sum": func.sum, "avg": func.avg, "min": func.min, "max": func.max}
+MATERIALIZED_FUNCTIONS = ("count", "sum", "avg")
+NUMERIC_TYPES = ("int", "float")
+ROW_COUNT = ""
+# as text because SQLAlchemy compiles on_conflict_do_update() afresh for
+# every execution, which costs more than the upsert itself
+UPSERT_SUMMARY = text(
+    'INSERT INTO rowaggregate (table_config_id, grouping, group_key, "column", count, total) '
+    "VALUES (:table_config_id, :grouping, :group_key, :column, :count, :total) "
+    'ON CONFLICT (table_config_id, grouping, group_key, "column") '
+    "DO UPDATE SET count = count + excluded.count, total = total + excluded.total"
+)
+
+
+class Metric(NamedTuple):
+    function: str
+    column: str
+
+    @property
+    def name(self) -> str:
+        return self.function if self.function == "count" else f"{self.function}_{self.column}"
+
+
+class Aggregation(NamedTuple):
+    group_by: tuple[str, ...]
+    metrics: list[Metric]
+    filters: list[RowFilter]
+
+
+def summary_groupings(table_config: TableConfig) -> list[tuple[str, ...]]:
+    """The groupings kept up to date for a config, the whole config first."""
+    columns = table_config.config_fields.get("columns", {})
+    summaries = table_config.config_fields.get("summaries", [])
+    if not isinstance(summaries, list):
+        raise InvalidTableConfig("config_fields.summaries must be a list of column lists")
+    groupings = [()]
+    for summary in summaries:
+        if not isinstance(summary, list) or not all(name in columns for name in summary):
+            raise InvalidTableConfig(f"summaries: {summary!r} is not a list of columns")
+        if tuple(summary) not in groupings:
+            groupings.append(tuple(summary))
+    return groupings
+
+
+def numeric_columns(table_config: TableConfig) -> list[str]:
+    columns = table_config.config_fields.get("columns", {})
+    return [name for name, spec in columns.items() if spec.get("type") in NUMERIC_TYPES]
+
+
+def grouping_name(group_by: tuple[str, ...]) -> str:
+    return ",".join(group_by)
+
+
+def parse_aggregation(
+    table_config: TableConfig,
+    group_by: list[str],
+    metrics: list[str],
+    filters: list[RowFilter],
+) -> Aggregation:
+    """Check group columns and parse ``count`` or ``function:column`` metrics."""
+    columns = table_config.config_fields.get("columns", {})
+    for name in group_by:
+        if name not in columns or not IDENTIFIER.fullmatch(name):
+            raise InvalidAggregation(f"{name}: unknown column")
+    parsed = []
+    for raw_metric in metrics or ["count"]:
+        if raw_metric == "count":
+            parsed.append(Metric("count", ROW_COUNT))
+            continue
+        function, _, column = raw_metric.partition(":")
+        if function not in FUNCTIONS:
+            raise InvalidAggregation(
+                f"{raw_metric!r}: metric must be count or one of {list(FUNCTIONS)}:column"
+            )
+        if column not in columns or not IDENTIFIER.fullmatch(column):
+            raise InvalidAggregation(f"{column}: unknown column")
+        if columns[column].get("type") not in NUMERIC_TYPES:
+            raise InvalidAggregation(f"{column}: {function} requires a numeric column")
+        parsed.append(Metric(function, column))
+    return Aggregation(tuple(group_by), parsed, filters)
+
+
+def is_materialized(table_config: TableConfig, aggregation: Aggregation) -> bool:
+    return (
+        not aggregation.filters
+        and aggregation.group_by in summary_groupings(table_config)
+        and all(metric.function in MATERIALIZED_FUNCTIONS for metric in aggregation.metrics)
+    )
+
+
+def group_value(table_config: TableConfig, column: str, value):
+    # json_extract returns JSON booleans as 1 and 0
+    if value is not None and table_config.config_fields["columns"][column].get("type") == "bool":
+        return bool(value)
+    return value
+
+
+def aggregate_rows(session: Session, table_config: TableConfig, aggregation: Aggregation) -> list[dict]:
+    group_values = [data_value(data_path(table_config, column)) for column in aggregation.group_by]
+    metric_values = [
+        func.count() if metric.function == "count"
+        else FUNCTIONS[metric.function](data_value(data_path(table_config, metric.column)))
+        for metric in aggregation.metrics
+    ]
+    statement = (
+        select(*group_values, *metric_values)
+        .where(*row_filter_criteria(table_config.id, aggregation.filters))
+        .group_by(*group_values)
+        .order_by(*group_values)
+    )
+    width = len(group_values)
+    groups = []
+    for record in session.execute(statement):
+        if not group_values and record[0] == 0:
+            # an aggregate without GROUP BY has a record even for no rows
+            break
+        group = {
+            column: group_value(table_config, column, value)
+            for column, value in zip(aggregation.group_by, record)
+        }
+        group.update(
+            (metric.name, value) for metric, value in zip(aggregation.metrics, record[width:])
+        )
+        groups.append(group)
+    return groups
+
+
+def read_summaries(session: Session, table_config: TableConfig, aggregation: Aggregation) -> list[dict]:
+    statement = select(RowAggregate).where(
+        RowAggregate.table_config_id == table_config.id,
+        RowAggregate.grouping == grouping_name(aggregation.group_by),
+    )
+    totals: dict[str, dict[str, RowAggregate]] = defaultdict(dict)
+    for aggregate in session.execute(statement).scalars():
+        totals[aggregate.group_key][aggregate.column] = aggregate
+    session.expunge_all()
+    types = {name: spec.get("type") for name, spec in table_config.config_fields["columns"].items()}
+    groups = []
+    for group_key, columns in totals.items():
+        if not columns[ROW_COUNT].count:
+            continue
+        group = dict(zip(aggregation.group_by, json.loads(group_key)))
+        for metric in aggregation.metrics:
+            aggregate = columns.get(metric.column)
+            if metric.function == "count":
+                value = aggregate.count
+            elif aggregate is None or not aggregate.count:
+                value = None
+            elif metric.function == "sum":
+                value = int(aggregate.total) if types[metric.column] == "int" else aggregate.total
+            else:
+                value = aggregate.total / aggregate.count
+            group[metric.name] = value
+        groups.append(group)
+    # the order aggregate_rows gives: NULLs first, then by value
+    groups.sort(key=lambda group: [
+        (group[column] is not None, group[column]) for column in aggregation.group_by
+    ])
+    return groups
+
+
+def summary_deltas(table_config: TableConfig, rows: Iterable[dict], sign: int) -> list[dict]:
+    """RowAggregate changes for adding (sign 1) or removing (-1) rows' data."""
+    groupings = summary_groupings(table_config)
+    numeric = numeric_columns(table_config)
+    # per grouping and group: row count, then count and total per numeric
+    # column; group keys are only encoded once per group at the end
+    totals: list[dict[tuple, list]] = [{} for _ in groupings]
+    width = 1 + 2 * len(numeric)
+    for data in rows:
+        values = [data.get(column) for column in numeric]
+        for group_by, groups in zip(groupings, totals):
+            group = tuple([data.get(column) for column in group_by])
+            total = groups.get(group)
+            if total is None:
+                total = groups[group] = [0] * width
+            total[0] += 1
+            for i, value in enumerate(values):
+                if value is not None:
+                    total[1 + 2 * i] += 1
+                    total[2 + 2 * i] += value
+    deltas = []
+    for group_by, groups in zip(groupings, totals):
+        grouping = grouping_name(group_by)
+        for group, total in groups.items():
+            group_key = json.dumps(list(group))
+            counts = [(ROW_COUNT, total[0], 0)] + [
+                (column, total[1 + 2 * i], total[2 + 2 * i]) for i, column in enumerate(numeric)
+            ]
+            deltas.extend(
+                {
+                    "table_config_id": table_config.id,
+                    "grouping": grouping,
+                    "group_key": group_key,
+                    "column": column,
+                    "count": sign * count,
+                    "total": sign * value_total,
+                }
+                for column, count, value_total in counts
+                if count
+            )
+    return deltas
+
+
+def update_summaries(
+    session: Union[Session, Connection], table_config: TableConfig, rows: Iterable[dict], sign: int
+) -> None:
+    deltas = summary_deltas(table_config, rows, sign)
+    if not deltas:
+        return
+    # totals that drop to zero are kept, as the group is likely to come back
+    session.execute(UPSERT_SUMMARY, deltas)
+
+
+def delete_summaries(session: Session, table_config_id: int) -> None:
+    session.execute(delete(RowAggregate).where(RowAggregate.table_config_id == table_config_id))
@@ -0,0 +1,271 @@
+"""Archival of rows into a compressed, separate SQLite file.
+
+With ``archive_path`` set, every connection attaches that file as the
+``archive`` schema. Archiving moves rows there out of the ``row`` table,
+a config's rows at a time: each ``archive_segment_rows`` of them, in id
+order, become one segment, a zlib-compressed JSON array of ``[id,
+created_at, data]`` with data as it was stored. ``archived_row`` maps
+every archived row's id to its segment, so finding one costs an index
+lookup and inflating a single segment, whatever the archive's size.
+
+Archived rows leave the summaries and the search index as they leave the
+hot table, but they are no more deleted than before: ``get_by_id``,
+lookups and the change feed still find them, and pages and exports
+include them when asked. A deleted archived row only loses its
+``archived_row`` entry; a segment goes once none of its rows are left.
+
+WAL mode makes commits atomic per database file, not across attached
+files. The job therefore commits each segment before it deletes the rows
+from the hot table. A crash in between leaves rows in both places: reads
+prefer the hot copy, and the next run only deletes it.
+
+    PYTHONPATH=. python -m data_collection.archive --older-than-days 730 --table-config-id 3
+"""
+import argparse
+import logging
+import zlib
+from datetime import datetime, timedelta
+from typing import Iterator, Optional, Sequence
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    delete,
+    func,
+    Index,
+    insert,
+    Integer,
+    LargeBinary,
+    MetaData,
+    select,
+    Table,
+)  # noqa: E133
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlmodel import Session
+
+from data_collection.models import Row
+from data_collection.serialization import dumps
+
+try:
+    from orjson import loads
+except ImportError:  # pragma: no cover
+    from json import loads
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = "archive"
+metadata = MetaData(schema=SCHEMA)
+row_segment = Table(
+    "row_segment",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("table_config_id", Integer, nullable=False, index=True),
+    Column("archived_at", DateTime, nullable=False),
+    Column("rows", LargeBinary, nullable=False),
+)
+archived_row = Table(
+    "archived_row",
+    metadata,
+    # the row's own id
+    Column("id", Integer, primary_key=True),
+    Column("table_config_id", Integer, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("segment_id", Integer, nullable=False, index=True),
+    Index("ix_archived_row_table_config_id_id", "table_config_id", "id"),
+)
+
+
+def create_archive_tables(engine: Engine) -> None:
+    with engine.begin() as connection:
+        metadata.create_all(connection)
+
+
+def encode_segment(rows: Sequence[Row]) -> bytes:
+    return zlib.compress(dumps([[row.id, row.created_at.isoformat(), row.data] for row in rows]))
+
+
+def decode_segment(table_config_id: int, blob: bytes, row_ids: Optional[set[int]] = None) -> list[Row]:
+    """A segment's rows, or those of them in row_ids: building a Row costs
+    far more than inflating the segment."""
+    rows = []
+    for row_id, created_at, data in loads(zlib.decompress(blob)):
+        if row_ids is not None and row_id not in row_ids:
+            continue
+        row = Row(id=row_id, created_at=datetime.fromisoformat(created_at), table_config_id=table_config_id)
+        # as stored, which for positional configs is a list the model won't take
+        set_committed_value(row, "data", data)
+        rows.append(row)
+    return rows
+
+
+def write_segment(session: Session, table_config_id: int, rows: Sequence[Row]) -> None:
+    """Archive rows of one config as one segment; they stay in the hot table."""
+    segment_id = session.execute(
+        insert(row_segment).values(
+            table_config_id=table_config_id,
+            archived_at=datetime.utcnow(),
+            rows=encode_segment(rows),
+        )
+    ).inserted_primary_key[0]
+    session.execute(
+        insert(archived_row),
+        [
+            {
+                "id": row.id,
+                "table_config_id": table_config_id,
+                "created_at": row.created_at,
+                "segment_id": segment_id,
+            }
+            for row in rows
+        ],
+    )
+
+
+def get_archived(session: Session, row_ids: Sequence[int]) -> dict[int, Row]:
+    """The archived rows among row_ids, with data as stored."""
+    if not row_ids:
+        return {}
+    ids = set(row_ids)
+    segment_ids = select(archived_row.c.segment_id.distinct()).where(archived_row.c.id.in_(ids))
+    segments = session.execute(
+        select(row_segment.c.table_config_id, row_segment.c.rows)
+        .where(row_segment.c.id.in_(segment_ids))
+        .order_by(row_segment.c.id)
+    )
+    return {
+        row.id: row
+        for table_config_id, blob in segments
+        for row in decode_segment(table_config_id, blob, ids)
+    }
+
+
+def archived_id_criteria(table_config_id: Optional[int], created_before: Optional[datetime]) -> list:
+    criteria = []
+    if table_config_id is not None:
+        criteria.append(archived_row.c.table_config_id == table_config_id)
+    if created_before is not None:
+        criteria.append(archived_row.c.created_at < created_before)
+    return criteria
+
+
+def page_archived(
+    session: Session, limit: int, after: Optional[int] = None, table_config_id: Optional[int] = None
+) -> list[Row]:
+    statement = select(archived_row.c.id).where(*archived_id_criteria(table_config_id, None))
+    if after is not None:
+        statement = statement.where(archived_row.c.id > after)
+    row_ids = session.execute(statement.order_by(archived_row.c.id).limit(limit)).scalars().all()
+    rows = get_archived(session, row_ids)
+    return [rows[row_id] for row_id in row_ids if row_id in rows]
+
+
+def archived_batches(session: Session, table_config_id: int, batch_size: int) -> Iterator[list[Row]]:
+    """A config's archived rows in id order, batch_size at a time."""
+    after = None
+    while True:
+        rows = page_archived(session, batch_size, after, table_config_id)
+        if not rows:
+            return
+        yield rows
+        after = rows[-1].id
+
+
+def archived_ids_where(
+    session: Session,
+    table_config_id: Optional[int] = None,
+    created_before: Optional[datetime] = None,
+    after: int = 0,
+    limit: Optional[int] = None,
+) -> list[int]:
+    statement = (
+        select(archived_row.c.id)
+        .where(archived_row.c.id > after, *archived_id_criteria(table_config_id, created_before))
+        .order_by(archived_row.c.id)
+        .limit(limit)
+    )
+    return session.execute(statement).scalars().all()
+
+
+def archived_ids(session: Session, row_ids: Sequence[int]) -> set[int]:
+    statement = select(archived_row.c.id).where(archived_row.c.id.in_(set(row_ids)))
+    return set(session.execute(statement).scalars())
+
+
+def delete_archived(session: Session, row_ids: Sequence[int]) -> list[int]:
+    """Forget archived rows; returns the ids that were archived."""
+    if not row_ids:
+        return []
+    ids = set(row_ids)
+    found = session.execute(
+        select(archived_row.c.id, archived_row.c.segment_id).where(archived_row.c.id.in_(ids))
+    ).all()
+    if not found:
+        return []
+    session.execute(delete(archived_row).where(archived_row.c.id.in_(ids)))
+    segment_ids = {segment_id for _, segment_id in found}
+    session.execute(
+        delete(row_segment).where(
+            row_segment.c.id.in_(segment_ids),
+            ~select(archived_row.c.id)
+            .where(archived_row.c.segment_id == row_segment.c.id)
+            .exists(),
+        )
+    )
+    return [row_id for row_id, _ in found]
+
+
+def has_archived_rows(session: Session, table_config_id: int) -> bool:
+    statement = select(archived_row.c.id).where(archived_row.c.table_config_id == table_config_id)
+    return session.execute(statement.limit(1)).first() is not None
+
+
+def last_archived_id(session: Session) -> Optional[int]:
+    """The highest archived id if it's above every hot one, which SQLite would
+    otherwise hand out again."""
+    hot_max = select(func.coalesce(func.max(Row.id), 0)).scalar_subquery()
+    return session.execute(
+        select(func.max(archived_row.c.id)).where(archived_row.c.id > hot_max)
+    ).scalar()
+
+
+def main(argv=None) -> None:
+    from config import settings
+    from data_collection.unit_of_work import create_db_engine, SqlModelUnitOfWork
+
+    parser = argparse.ArgumentParser(description="Move old rows into the archive.")
+    parser.add_argument(
+        "--older-than-days",
+        type=int,
+        default=settings.archive_after_days,
+        help="archive rows created longer ago than this (default: archive_after_days)",
+    )
+    parser.add_argument(
+        "--table-config-id",
+        type=int,
+        action="append",
+        default=[],
+        help="archive every row of this retired config; may be repeated",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if settings.archive_path is None:
+        parser.error("archive_path is not set")
+    if args.older_than_days is None and not args.table_config_id:
+        parser.error("nothing to archive: give --older-than-days or --table-config-id")
+
+    created_before = None
+    if args.older_than_days is not None:
+        created_before = datetime.utcnow() - timedelta(days=args.older_than_days)
+    engine = create_db_engine()
+    create_archive_tables(engine)
+    with SqlModelUnitOfWork(engine, archive=True) as uow:
+        archived = uow.rows.archive(
+            created_before, args.table_config_id, segment_rows=settings.archive_segment_rows
+        )
+    logger.info("archived %s rows", archived)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
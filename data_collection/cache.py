@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, Iterable, Optional, Protocol
+
+from sqlalchemy import event, text
+from sqlmodel import Session
+
+from data_collection.constants import ChangedEntity
+
+LATEST_CATALOG_CHANGE = text(
+    "SELECT max(seq) FROM change WHERE entity IN (:table_config, :table_view)"
+).bindparams(table_config=ChangedEntity.TABLE_CONFIG.value, table_view=ChangedEntity.TABLE_VIEW.value)
+
+
+class EntityCache:
+    """A bounded, thread-safe LRU cache in front of a repo lookup.
+
+    Concurrent misses for the same key share a single load. Invalidating a
+    key also discards any load still in flight for it, so a value read
+    before a delete was committed can't be stored after it.
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._loading: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            future = self._loading.get(key)
+            if future is not None:
+                waiting = True
+            else:
+                waiting = False
+                future = self._loading[key] = Future()
+        if waiting:
+            return future.result()
+        try:
+            value = load()
+        except BaseException as e:
+            with self._lock:
+                if self._loading.get(key) is future:
+                    del self._loading[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+                self._entries[key] = value
+                if len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+            self._loading.pop(key, None)
+
+    def invalidate_on_commit(self, session: Session, key: Hashable) -> None:
+        # other connections keep seeing the old value until the session
+        # commits, and may load it back in the meantime
+        self.invalidate(key)
+        event.listen(session, "after_commit", lambda session: self.invalidate(key), once=True)
+
+    def invalidate_on_rollback(self, session: Session, key: Hashable) -> None:
+        # an entity added in the session may be read, and cached, before
+        # the session commits; if it never does, its id can be handed out
+        # again
+        event.listen(session, "after_rollback", lambda session: self.invalidate(key), once=True)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._loading.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class Clearable(Protocol):
+    def clear(self) -> None:
+        ...
+
+
+class CatalogWatch:
+    """Clears a worker process's caches of TableConfigs and TableViews, and
+    of what is built from them, when any process has changed one.
+
+    The caches are invalidated by the process that commits a change, but
+    the other workers only learn of it here. Every add and delete of a
+    config or view records a Change with a higher seq, so the latest of
+    those seqs versions them all; units of work read it as they start,
+    which scans the few Change records of configs and views in the index.
+    """
+
+    def __init__(self, caches: Iterable[Clearable]) -> None:
+        self.caches = list(caches)
+        self._seq: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def check(self, session: Session) -> None:
+        seq = session.execute(LATEST_CATALOG_CHANGE).scalar() or 0
+        with self._lock:
+            # seqs only grow; a unit of work that read an older one is behind
+            if self._seq is not None and seq <= self._seq:
+                return
+            self._seq = seq
+            for cache in self.caches:
+                cache.clear()
@@ -0,0 +1,39 @@
+"""The change feed: which rows, configs and views changed since a cursor.
+
+Every add and delete through the repos records the entity in the Change
+table, in the same transaction. There is one record per entity, holding
+its latest change: recording a change replaces the record with one with a
+higher seq, so a deletion turns the entity's record into a tombstone. A
+client that keeps the seq of the last change it saw asks for the changes
+after it, which costs O(changes since then) rather than O(all data), and
+gets each changed entity once, as it is now.
+
+SQLite has a single writer and seqs are handed out inside the write
+transaction, so changes become visible in seq order: a reader never sees
+a seq after one that is committed later.
+"""
+from typing import Iterable
+
+from sqlalchemy import text
+from sqlmodel import Session
+
+from data_collection.constants import ChangedEntity
+
+RECORD_CHANGE = text(
+    "INSERT OR REPLACE INTO change (entity, entity_id, deleted) "
+    "VALUES (:entity, :entity_id, :deleted)"
+)
+
+
+def record_changes(
+    session: Session,
+    entity: ChangedEntity,
+    entity_ids: Iterable[int],
+    deleted: bool = False,
+) -> None:
+    parameters = [
+        {"entity": entity.value, "entity_id": entity_id, "deleted": deleted}
+        for entity_id in entity_ids
+    ]
+    if parameters:
+        session.execute(RECORD_CHANGE, parameters)
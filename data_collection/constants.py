@@ -10,3 +10,50 @@ class TableConfigName(str, Enum):
 class TableViewName(str, Enum):
     FARMING_PRACTICE_TYPICAL_VIEW = "FarmingPracticeTypicalView"
     FARMING_PRACTICE_OFFERING_VIEW = "FarmingPracticeOfferingView"
+
+
+@unique
+class ImportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+
+@unique
+class ImportStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+@unique
+class ChangedEntity(str, Enum):
+    ROW = "row"
+    TABLE_CONFIG = "table_config"
+    TABLE_VIEW = "table_view"
+
+
+@unique
+class BatchOp(str, Enum):
+    CREATE = "create"
+    DELETE = "delete"
+
+
+@unique
+class BatchEntity(str, Enum):
+    USER = "user"
+    TABLE_CONFIG = "table_config"
+    TABLE_VIEW = "table_view"
+    ROW = "row"
+
+
+@unique
+class AccessKind(str, Enum):
+    READ = "read"
+    WRITE = "write"
+
+
+@unique
+class RejectReason(str, Enum):
+    QUEUE_FULL = "queue_full"
+    TIMEOUT = "timeout"
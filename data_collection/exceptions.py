@@ -1,2 +1,56 @@
 class EntityNotFound(Exception):
     pass
+
+
+class EntityInUse(Exception):
+    pass
+
+
+class InvalidTableConfig(Exception):
+    pass
+
+
+class InvalidTableView(Exception):
+    pass
+
+
+class InvalidRows(Exception):
+    def __init__(self, errors: list[dict]) -> None:
+        super().__init__(errors)
+        self.errors = errors
+
+
+class InvalidRowFilter(Exception):
+    pass
+
+
+class ExportUnavailable(Exception):
+    pass
+
+
+class InvalidAggregation(Exception):
+    pass
+
+
+class InvalidImport(Exception):
+    pass
+
+
+class SchemaVersionMismatch(Exception):
+    pass
+
+
+class StoreInUse(Exception):
+    pass
+
+
+class InvalidSearch(Exception):
+    pass
+
+
+class SearchUnavailable(Exception):
+    pass
+
+
+class AdmissionRejected(Exception):
+    pass
@@ -0,0 +1,219 @@
+"""Streaming export of a table config's rows as CSV, NDJSON or Parquet.
+
+Row.data is flattened into one typed column per entry of the config's
+``columns`` inside SQLite (``json_extract`` plus a cast), so Python only
+sees plain tuples. Rows are fetched from a cursor ``batch_size`` at a time
+and each batch is encoded and handed on before the next is read; memory is
+bounded by the batch, not the table.
+
+    PYTHONPATH=. python -m data_collection.export 3 --format parquet -o rows.parquet
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from enum import Enum, unique
+from typing import Callable, Iterable, Iterator, Sequence
+
+from sqlalchemy import Boolean, cast, Float, func, Integer, literal, String, type_coerce
+from sqlmodel import select
+
+from config import settings
+from data_collection.exceptions import ExportUnavailable
+from data_collection.models import Row, TableConfig
+from data_collection.storage import data_path
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+# JSON booleans come out of json_extract as 1 and 0; SQLAlchemy's Boolean
+# turns them back into bools without an explicit cast
+SQL_TYPES = {"int": Integer, "float": Float, "str": String, "bool": Boolean}
+# the same casts, for rows decoded in Python
+PYTHON_TYPES = {"int": int, "float": float, "str": str, "bool": bool}
+
+
+@unique
+class ExportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+    PARQUET = "parquet"
+
+
+MEDIA_TYPES = {
+    ExportFormat.CSV: "text/csv",
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.PARQUET: "application/vnd.apache.parquet",
+}
+
+
+def export_columns(table_config: TableConfig) -> list[tuple[str, str]]:
+    """The exported (name, type) pairs: the row id, then the config's columns."""
+    columns = table_config.config_fields.get("columns", {})
+    return [("id", "int")] + [(name, spec.get("type")) for name, spec in columns.items()]
+
+
+def export_converters(table_config: TableConfig) -> list[tuple[str, Callable]]:
+    return [(name, PYTHON_TYPES[type_name]) for name, type_name in export_columns(table_config)[1:]]
+
+
+def export_values(converters: list[tuple[str, Callable]], row_id: int, data: dict) -> tuple:
+    """The tuple export_select gives for a row decoded in Python."""
+    values = [row_id]
+    for name, convert in converters:
+        value = data.get(name)
+        values.append(None if value is None else convert(value))
+    return tuple(values)
+
+
+def column_value(table_config: TableConfig, name: str, type_name: str):
+    # the path is bound, not inlined
+    value = func.json_extract(Row.data, literal(data_path(table_config, name)))
+    if type_name == "bool":
+        return type_coerce(value, Boolean).label(name)
+    return cast(value, SQL_TYPES[type_name]).label(name)
+
+
+def export_select(table_config: TableConfig):
+    values = [
+        column_value(table_config, name, type_name)
+        for name, type_name in export_columns(table_config)[1:]
+    ]
+    return (
+        select(Row.id, *values)
+        .where(Row.table_config_id == table_config.id)
+        .order_by(Row.id)
+    )
+
+
+def check_format(export_format: ExportFormat) -> None:
+    if export_format == ExportFormat.PARQUET and pyarrow is None:
+        raise ExportUnavailable("parquet export requires pyarrow to be installed")
+
+
+def encode_csv(columns: list[tuple[str, str]], batches: Iterable[Sequence[tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def encode_ndjson(columns: list[tuple[str, str]], batches: Iterable[Sequence[tuple]]) -> Iterator[bytes]:
+    names = [name for name, _ in columns]
+    for batch in batches:
+        lines = [json.dumps(dict(zip(names, row))) for row in batch]
+        lines.append("")
+        yield "\n".join(lines).encode()
+
+
+class ChunkSink:
+    """A write-only file for ParquetWriter that hands back what was written."""
+
+    closed = False
+
+    def __init__(self) -> None:
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self.chunks.append(chunk)
+        self.position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def encode_parquet(columns: list[tuple[str, str]], batches: Iterable[Sequence[tuple]]) -> Iterator[bytes]:
+    arrow_types = {
+        "int": pyarrow.int64(),
+        "float": pyarrow.float64(),
+        "str": pyarrow.string(),
+        "bool": pyarrow.bool_(),
+    }
+    schema = pyarrow.schema([(name, arrow_types[type_name]) for name, type_name in columns])
+    sink = ChunkSink()
+    # one row group per batch
+    with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+        for batch in batches:
+            arrays = [
+                pyarrow.array(values, type=field.type)
+                for values, field in zip(zip(*batch), schema)
+            ]
+            writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+ENCODERS = {
+    ExportFormat.CSV: encode_csv,
+    ExportFormat.NDJSON: encode_ndjson,
+    ExportFormat.PARQUET: encode_parquet,
+}
+
+
+def export_rows(
+    table_config: TableConfig,
+    batches: Iterable[Sequence[tuple]],
+    export_format: ExportFormat,
+) -> Iterator[bytes]:
+    """Encode batches of export_select tuples, yielding one chunk per batch."""
+    check_format(export_format)
+    for chunk in ENCODERS[export_format](export_columns(table_config), batches):
+        if chunk:
+            yield chunk
+
+
+def main(argv=None) -> None:
+    from data_collection.migrations import check
+    from data_collection.unit_of_work import create_db_engine, SqlModelUnitOfWork
+
+    parser = argparse.ArgumentParser(description="Export a table config's rows.")
+    parser.add_argument("table_config_id", type=int)
+    parser.add_argument("--format", type=ExportFormat, default=ExportFormat.CSV)
+    parser.add_argument("--batch-size", type=int, default=settings.export_batch_size)
+    parser.add_argument("-o", "--output", help="file to write, standard output by default")
+    parser.add_argument(
+        "--include-archived", action="store_true", help="also export rows moved to the archive"
+    )
+    args = parser.parse_args(argv)
+    check_format(args.format)
+
+    engine = create_db_engine()
+    check(engine)
+    with SqlModelUnitOfWork(engine, archive=settings.archive_path is not None) as context:
+        table_config = context.table_configs.get_by_id(args.table_config_id)
+        batches = context.rows.export_batches(table_config, args.batch_size, args.include_archived)
+        output = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            for chunk in export_rows(table_config, batches, args.format):
+                output.write(chunk)
+        finally:
+            if args.output:
+                output.close()
+
+
+if __name__ == "__main__":
+    main()
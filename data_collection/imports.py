@@ -0,0 +1,217 @@
+"""Background imports of CSV and NDJSON files into a table config's rows.
+
+An upload is spooled to a file and recorded as an ImportJob; an
+ImportWorker thread then reads the file as a stream, ``batch_size``
+records at a time, validates each record against the config like
+``POST /rows/bulk`` would and inserts the valid ones through a unit of
+work. The job is updated after every batch with the rows processed,
+inserted and rejected, the first errors and the throughput so far, so
+clients can poll it. Records are flat, in the shape the export writes: a
+CSV header or JSON keys naming the config's columns. An ``id`` is ignored,
+and empty or null values count as missing.
+
+Once its job is recorded, an upload's file is named after the job, so that
+jobs a crash or restart left pending or running can be failed at startup
+and their files removed (fail_interrupted_imports).
+"""
+import csv
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterator, IO, Optional
+
+from data_collection.constants import ImportFormat, ImportStatus
+from data_collection.exceptions import InvalidImport
+from data_collection.models import Row, TableConfig
+from data_collection.unit_of_work import UnitOfWork
+from data_collection.validation import RowValidatorCache
+
+logger = logging.getLogger(__name__)
+
+MAX_IMPORT_ERRORS = 100
+BOOLEANS = {"true": True, "false": False, "1": True, "0": False}
+# a record's line number, its data, and (column, msg) problems found parsing it
+Record = tuple[int, dict, list[tuple[Optional[str], str]]]
+
+
+def parse_csv_value(type_name: str, raw: str):
+    if type_name == "int":
+        return int(raw)
+    if type_name == "float":
+        return float(raw)
+    if type_name == "bool":
+        return BOOLEANS[raw.lower()]
+    return raw
+
+
+def read_csv(file: IO[str], table_config: TableConfig) -> Iterator[Record]:
+    columns = table_config.config_fields.get("columns", {})
+    reader = csv.DictReader(file)
+    if reader.fieldnames is None:
+        return
+    for record in reader:
+        data, errors = {}, []
+        for name, raw in record.items():
+            if name is None:
+                errors.append((None, "more values than the header has columns"))
+            elif name == "id" or raw is None or raw == "":
+                continue
+            elif name not in columns:
+                # left for the validator to report
+                data[name] = raw
+            else:
+                type_name = columns[name].get("type")
+                try:
+                    data[name] = parse_csv_value(type_name, raw)
+                except (KeyError, ValueError):
+                    errors.append((name, f"value is not a valid {type_name}"))
+        yield reader.line_num, data, errors
+
+
+def read_ndjson(file: IO[str], table_config: TableConfig) -> Iterator[Record]:
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, {}, [(None, "line is not valid JSON")]
+            continue
+        if not isinstance(record, dict):
+            yield line_number, {}, [(None, "line is not a JSON object")]
+            continue
+        data = {name: value for name, value in record.items() if name != "id" and value is not None}
+        yield line_number, data, []
+
+
+def spool_path(directory: Optional[str], import_job_id: int) -> str:
+    """Where a job's upload waits to be imported; the system temp dir if unset."""
+    return os.path.join(directory or tempfile.gettempdir(), f"import-{import_job_id}")
+
+
+def fail_interrupted_imports(uow: UnitOfWork, directory: Optional[str]) -> int:
+    """Fail the jobs left pending or running and remove their uploads.
+
+    Only safe while no other process may be running imports, i.e. before
+    any worker has started; returns the number of jobs failed.
+    """
+    with uow as context:
+        jobs = context.import_jobs.find_active()
+        for job in jobs:
+            job.status = ImportStatus.FAILED
+            job.error = "interrupted by a restart"
+            job.finished_at = datetime.utcnow()
+            context.import_jobs.update(job)
+        context.commit()
+    for job in jobs:
+        logger.warning("import job %s was interrupted", job.id)
+        try:
+            os.remove(spool_path(directory, job.id))
+        except FileNotFoundError:
+            pass
+    return len(jobs)
+
+
+READERS = {ImportFormat.CSV: read_csv, ImportFormat.NDJSON: read_ndjson}
+
+
+def import_format(media_type: str) -> ImportFormat:
+    """The format an upload's Content-Type names."""
+    media_type = media_type.split(";")[0].strip().lower()
+    if media_type in ("text/csv", "application/csv"):
+        return ImportFormat.CSV
+    if media_type in ("application/x-ndjson", "application/ndjson"):
+        return ImportFormat.NDJSON
+    raise InvalidImport(f"{media_type or 'no Content-Type'}: upload text/csv or application/x-ndjson")
+
+
+def import_rows(
+    uow: UnitOfWork,
+    row_validators: RowValidatorCache,
+    import_job_id: int,
+    path: str,
+    batch_size: int,
+) -> None:
+    """Run an import job to completion, recording its progress as it goes."""
+    with uow as context:
+        job = context.import_jobs.get_by_id(import_job_id)
+        job.status = ImportStatus.RUNNING
+        job.started_at = datetime.utcnow()
+        context.import_jobs.update(job)
+        context.commit()
+        start = time.perf_counter()
+
+        def record_progress():
+            # committed with the batch it counts
+            job.rows_per_second = job.rows_processed / max(time.perf_counter() - start, 1e-9)
+            context.import_jobs.update(job)
+            context.commit()
+
+        try:
+            table_config = context.table_configs.get_by_id(job.table_config_id)
+            validator = row_validators.get(context, job.table_config_id)
+            with open(path, newline="", encoding="utf-8") as file:
+                records = READERS[job.format](file, table_config)
+                while batch := list(itertools.islice(records, batch_size)):
+                    rows = []
+                    for line_number, data, errors in batch:
+                        # configs with a natural key have their rows upserted
+                        errors = errors or validator.errors(data, upsert=bool(validator.key))
+                        if errors:
+                            job.rows_failed += 1
+                            room = MAX_IMPORT_ERRORS - len(job.errors)
+                            job.errors = job.errors + [
+                                {"line": line_number, "column": column, "msg": msg}
+                                for column, msg in errors[:max(room, 0)]
+                            ]
+                        else:
+                            rows.append(Row(table_config_id=job.table_config_id, data=data))
+                    if rows and validator.key:
+                        context.rows.upsert_many(rows)
+                    elif rows:
+                        context.rows.add_many(rows)
+                    job.rows_processed += len(batch)
+                    job.rows_inserted += len(rows)
+                    record_progress()
+            job.status = ImportStatus.SUCCEEDED
+        except Exception as e:
+            # batches inserted before the failure stay inserted
+            logger.exception("import job %s failed", import_job_id)
+            context.rollback()
+            job.status = ImportStatus.FAILED
+            job.error = str(e) or type(e).__name__
+        finally:
+            job.finished_at = datetime.utcnow()
+            record_progress()
+            os.remove(path)
+
+
+class ImportWorker:
+    """Runs import jobs on a small thread pool of its own, so that long
+    imports don't take threads from the ones handling requests."""
+
+    def __init__(
+        self,
+        uow_factory: Callable[[], UnitOfWork],
+        row_validators: RowValidatorCache,
+        workers: int = 1,
+        batch_size: int = 5000,
+    ) -> None:
+        self.uow_factory = uow_factory
+        self.row_validators = row_validators
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import")
+
+    def submit(self, import_job_id: int, path: str) -> Future:
+        return self.executor.submit(
+            import_rows, self.uow_factory(), self.row_validators, import_job_id, path, self.batch_size
+        )
+
+    def shutdown(self) -> None:
+        # lets running and queued imports finish
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,798 @@
+"""An in-memory storage engine, persisted through an append-only log.
+
+Every table is a dict of field dicts keyed by primary key, next to the
+secondary indexes the repos look entities up by: configs and views by
+name, rows and views by table_config_id, rows by natural key, and changes
+by entity. Ids are kept in ascending order per table and per config's
+rows, so pages seek past a cursor like the SQL repos' keyset pagination
+does.
+
+A MemorySession takes the store's lock with its first write and holds it
+until it commits or rolls back, like SQLite's single writer, and reads take
+it for as long as they run; a session only ever sees committed data, or
+its own writes. Writes are applied to the tables as they are made and
+undone on rollback. A commit appends the transaction's writes to
+``log.jsonl`` in the store's directory as one line, which is replayed at
+startup, a torn last line included, so a crash loses at most the
+transaction being written. Once ``snapshot_every`` writes have been logged,
+the tables are written to ``snapshot.jsonl`` and the log starts over.
+Replaying a log over the snapshot taken after it gives the same tables, so
+a crash between the two steps is harmless.
+
+The log is flushed to the OS on every commit but only fsynced with the
+snapshots: a process crash loses nothing committed, a power cut may. One
+process owns a directory at a time; the store locks it. There are no
+expression indexes or materialized summaries: filters scan a config's rows
+and aggregates are always computed.
+"""
+import fcntl
+import math
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime
+from enum import Enum
+from typing import Callable, Iterable, Iterator, Optional, Sequence
+
+from sqlalchemy import inspect
+
+from data_collection.aggregation import Aggregation
+from data_collection.constants import ChangedEntity
+from data_collection.exceptions import (
+    EntityInUse,
+    EntityNotFound,
+    SearchUnavailable,
+    StoreInUse,
+)  # noqa: E133
+from data_collection.export import export_converters, export_values
+from data_collection.models import (
+    Change,
+    ImportJob,
+    RenderedTableView,
+    Row,
+    TableConfig,
+    TableView,
+    User,
+)
+from data_collection.natural_keys import natural_key_columns, row_key
+from data_collection.rendering import render_table_view
+from data_collection.repos import ACTIVE_IMPORT_STATUSES, created_first, DELETE_CHUNK_SIZE
+from data_collection.row_filters import matches, RowFilter
+from data_collection.serialization import dumps, entity_fields
+
+try:
+    from orjson import loads
+except ImportError:  # pragma: no cover
+    from json import loads
+
+MODELS = {
+    "user": User,
+    "table_config": TableConfig,
+    "table_view": TableView,
+    "rendered_table_view": RenderedTableView,
+    "row": Row,
+    "import_job": ImportJob,
+    "change": Change,
+}
+
+
+def load(model, fields: dict):
+    """A detached entity holding fields, without validating them again.
+
+    This is how the ORM builds entities it reads from the database. The
+    entity shares its JSON values with the store, so callers must replace
+    them rather than change them in place, as they already do.
+    """
+    entity = inspect(model).class_manager.new_instance()
+    entity.__dict__.update(fields)
+    object.__setattr__(entity, "__fields_set__", set(fields))
+    return entity
+
+
+def field_decoders(model) -> dict[str, Callable]:
+    """What turns each of a model's fields back from JSON, where it isn't JSON."""
+    decoders = {}
+    for name, field in model.__fields__.items():
+        if not isinstance(field.type_, type):
+            continue
+        if issubclass(field.type_, datetime):
+            decoders[name] = datetime.fromisoformat
+        elif issubclass(field.type_, Enum):
+            decoders[name] = field.type_
+    return decoders
+
+
+class IdIndex:
+    """Ids in ascending order, for seeking to the first one after a cursor.
+
+    Removed ids stay in the list and are skipped by checking ``live``, until
+    they make up half of it and it is rebuilt.
+    """
+
+    def __init__(self, live: dict) -> None:
+        self.live = live
+        self.ids: list[int] = []
+        self.removed = 0
+
+    def add(self, id: int) -> None:
+        ids = self.ids
+        if not ids or id > ids[-1]:
+            ids.append(id)
+            return
+        position = bisect_left(ids, id)
+        if position < len(ids) and ids[position] == id:
+            # removed, then restored before the list was rebuilt
+            self.removed -= 1
+        else:
+            ids.insert(position, id)
+
+    def remove(self, id: int) -> None:
+        self.removed += 1
+        if self.removed > 1024 and 2 * self.removed > len(self.ids):
+            self.ids = [id for id in self.ids if id in self.live]
+            self.removed = 0
+
+    def after(self, after: Optional[int] = None) -> Iterator[int]:
+        ids, live = self.ids, self.live
+        start = 0 if after is None else bisect_right(ids, after)
+        for position in range(start, len(ids)):
+            id = ids[position]
+            if id in live:
+                yield id
+
+    def __bool__(self) -> bool:
+        return any(True for _ in self.after())
+
+
+class Table:
+    def __init__(self, model) -> None:
+        self.model = model
+        self.key = inspect(model).primary_key[0].name
+        self.decoders = field_decoders(model)
+        self.records: dict[int, dict] = {}
+        self.ids = IdIndex(self.records)
+        self.last_id = 0
+
+
+class MemoryStore:
+    """The tables of an in-memory database, shared by its sessions."""
+
+    def __init__(self, directory: Optional[str] = None, snapshot_every: int = 100_000) -> None:
+        self.lock = threading.RLock()
+        self.tables = {name: Table(model) for name, model in MODELS.items()}
+        rows = self.tables["row"].records
+        self.names: dict[str, dict[str, int]] = {"table_config": {}, "table_view": {}}
+        self.rows_by_table_config: dict[int, IdIndex] = defaultdict(lambda: IdIndex(rows))
+        self.views_by_table_config: dict[int, set[int]] = defaultdict(set)
+        # each config's natural key columns, and its rows by key; like SQLite's
+        # unique index, it leaves out rows missing a key column
+        self.key_columns: dict[int, list[str]] = {}
+        self.rows_by_key: dict[int, dict[tuple, int]] = defaultdict(dict)
+        self.change_seqs: dict[tuple[ChangedEntity, int], int] = {}
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.logged = 0
+        self.log = None
+        if directory is not None:
+            self.open()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock_file = open(self.path("lock"), "w")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            raise StoreInUse(f"{self.directory} is in use by another process")
+        if os.path.exists(self.path("snapshot.jsonl")):
+            with open(self.path("snapshot.jsonl"), "rb") as file:
+                for line in file:
+                    name, fields = loads(line)
+                    self.put(name, self.decode(name, fields))
+        end = 0
+        if os.path.exists(self.path("log.jsonl")):
+            with open(self.path("log.jsonl"), "rb") as file:
+                for line in file:
+                    try:
+                        writes = loads(line)
+                    except ValueError:
+                        # the transaction being written when the process died
+                        break
+                    self.apply(writes)
+                    end += len(line)
+                    self.logged += len(writes)
+        self.log = open(self.path("log.jsonl"), "ab")
+        self.log.truncate(end)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.lock_file.close()
+                self.log = None
+
+    def decode(self, name: str, fields: dict) -> dict:
+        # the fields were valid when they were written; validating them again
+        # would take most of the time a replay does
+        for field, decode in self.tables[name].decoders.items():
+            if fields[field] is not None:
+                fields[field] = decode(fields[field])
+        return fields
+
+    def apply(self, writes: list) -> None:
+        for operation, name, value in writes:
+            if operation == "put":
+                self.put(name, self.decode(name, value))
+            else:
+                self.remove(name, value)
+
+    def next_id(self, name: str) -> int:
+        table = self.tables[name]
+        table.last_id += 1
+        return table.last_id
+
+    def get(self, name: str, key: int) -> Optional[dict]:
+        return self.tables[name].records.get(key)
+
+    def put(self, name: str, fields: dict) -> Optional[dict]:
+        """Insert or replace a record; returns the one it replaced."""
+        table = self.tables[name]
+        key = fields[table.key]
+        previous = table.records.get(key)
+        if previous is not None:
+            self.unindex(name, previous)
+        else:
+            table.ids.add(key)
+        table.records[key] = fields
+        table.last_id = max(table.last_id, key)
+        self.index(name, fields)
+        return previous
+
+    def remove(self, name: str, key: int) -> Optional[dict]:
+        table = self.tables[name]
+        previous = table.records.pop(key, None)
+        if previous is not None:
+            table.ids.remove(key)
+            self.unindex(name, previous)
+        return previous
+
+    def index(self, name: str, fields: dict) -> None:
+        if name in self.names:
+            self.names[name][fields["name"]] = fields["id"]
+        if name == "row":
+            self.rows_by_table_config[fields["table_config_id"]].add(fields["id"])
+            key = self.row_key(fields)
+            if key is not None:
+                self.rows_by_key[fields["table_config_id"]][key] = fields["id"]
+        elif name == "table_config":
+            self.key_columns[fields["id"]] = natural_key_columns(load(TableConfig, fields))
+        elif name == "table_view":
+            self.views_by_table_config[fields["table_config_id"]].add(fields["id"])
+        elif name == "change":
+            self.change_seqs[fields["entity"], fields["entity_id"]] = fields["seq"]
+
+    def unindex(self, name: str, fields: dict) -> None:
+        if name in self.names:
+            self.names[name].pop(fields["name"], None)
+        if name == "row":
+            self.rows_by_table_config[fields["table_config_id"]].remove(fields["id"])
+            key = self.row_key(fields)
+            if key is not None:
+                self.rows_by_key[fields["table_config_id"]].pop(key, None)
+        elif name == "table_config":
+            self.key_columns.pop(fields["id"], None)
+            self.rows_by_key.pop(fields["id"], None)
+        elif name == "table_view":
+            self.views_by_table_config[fields["table_config_id"]].discard(fields["id"])
+        elif name == "change":
+            self.change_seqs.pop((fields["entity"], fields["entity_id"]), None)
+
+    def row_key(self, fields: dict) -> Optional[tuple]:
+        columns = self.key_columns.get(fields["table_config_id"])
+        if not columns:
+            return None
+        key = row_key(columns, fields["data"])
+        return None if None in key else key
+
+    def commit(self, writes: list) -> None:
+        if self.log is None or not writes:
+            return
+        self.log.write(dumps(writes) + b"\n")
+        self.log.flush()
+        self.logged += len(writes)
+        if self.logged >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self) -> None:
+        """Write every table to the snapshot, then start the log over."""
+        with self.lock:
+            temporary = self.path("snapshot.jsonl.tmp")
+            with open(temporary, "wb") as file:
+                for name, table in self.tables.items():
+                    for fields in table.records.values():
+                        file.write(dumps([name, fields]) + b"\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, self.path("snapshot.jsonl"))
+            self.log.truncate(0)
+            self.logged = 0
+
+
+class MemorySession:
+    """A transaction against a MemoryStore; not to be shared between threads."""
+
+    def __init__(self, store: MemoryStore) -> None:
+        self.store = store
+        self.writing = False
+        self.writes: list = []
+        self.undo: list[tuple[str, int, Optional[dict]]] = []
+
+    def begin(self) -> None:
+        if not self.writing:
+            self.store.lock.acquire()
+            self.writing = True
+
+    def put(self, name: str, fields: dict) -> None:
+        self.begin()
+        previous = self.store.put(name, fields)
+        self.undo.append((name, fields[self.store.tables[name].key], previous))
+        self.writes.append(("put", name, fields))
+
+    def remove(self, name: str, key: int) -> Optional[dict]:
+        self.begin()
+        previous = self.store.remove(name, key)
+        if previous is not None:
+            self.undo.append((name, key, previous))
+            self.writes.append(("remove", name, key))
+        return previous
+
+    def record_changes(
+        self,
+        entity: ChangedEntity,
+        entity_ids: Iterable[int],
+        deleted: bool = False,
+    ) -> None:
+        # the entity's earlier change is replaced, as INSERT OR REPLACE does
+        for entity_id in entity_ids:
+            seq = self.store.change_seqs.get((entity, entity_id))
+            if seq is not None:
+                self.remove("change", seq)
+            self.put("change", {
+                "seq": self.store.next_id("change"),
+                "entity": entity,
+                "entity_id": entity_id,
+                "deleted": deleted,
+            })
+
+    def commit(self) -> None:
+        if not self.writing:
+            return
+        try:
+            self.store.commit(self.writes)
+        finally:
+            self.end()
+
+    def rollback(self) -> None:
+        if not self.writing:
+            return
+        try:
+            for name, key, previous in reversed(self.undo):
+                if previous is None:
+                    self.store.remove(name, key)
+                else:
+                    self.store.put(name, previous)
+        finally:
+            self.end()
+
+    def end(self) -> None:
+        self.writes, self.undo = [], []
+        self.writing = False
+        self.store.lock.release()
+
+    def get(self, name: str, key: int, message: str):
+        with self.store.lock:
+            fields = self.store.get(name, key)
+        if fields is None:
+            raise EntityNotFound(message)
+        return load(MODELS[name], fields)
+
+    def get_many(self, name: str, keys: Sequence[int]) -> dict:
+        model = MODELS[name]
+        with self.store.lock:
+            records = self.store.tables[name].records
+            return {key: load(model, records[key]) for key in set(keys) if key in records}
+
+    def scan(self, name: str, ids: Iterable[int], limit: Optional[int] = None, where=None) -> list:
+        """Entities of the given ids, optionally filtered, at most limit of them."""
+        model = MODELS[name]
+        records = self.store.tables[name].records
+        results = []
+        with self.store.lock:
+            for key in ids:
+                fields = records[key]
+                if where is None or where(fields):
+                    results.append(load(model, fields))
+                    if limit is not None and len(results) >= limit:
+                        break
+        return results
+
+    def page(self, name: str, limit: int, after: Optional[int] = None) -> list:
+        return self.scan(name, self.store.tables[name].ids.after(after), limit)
+
+    def all(self, name: str) -> list:
+        return self.scan(name, self.store.tables[name].ids.after())
+
+    def add(self, name: str, entity):
+        fields = entity_fields(entity)
+        fields[self.store.tables[name].key] = self.store.next_id(name)
+        self.put(name, fields)
+        return fields
+
+    def check_name(self, name: str, entity) -> None:
+        # the unique constraint on name
+        if entity.name in self.store.names[name]:
+            raise EntityInUse(
+                f"{entity.name.value} is the name of {type(entity).__name__} "
+                f"{self.store.names[name][entity.name]}"
+            )
+
+
+class MemoryTableConfigsRepo:
+    def __init__(self, session: MemorySession) -> None:
+        self.session = session
+
+    def add(self, table_config: TableConfig) -> TableConfig:
+        self.session.begin()
+        self.session.check_name("table_config", table_config)
+        fields = self.session.add("table_config", table_config)
+        self.session.record_changes(ChangedEntity.TABLE_CONFIG, [fields["id"]])
+        return load(TableConfig, fields)
+
+    def check_deletable(self, table_config_id: int, cascade: bool = False) -> None:
+        store = self.session.store
+        if any(
+            fields["table_config_id"] == table_config_id and fields["status"] in ACTIVE_IMPORT_STATUSES
+            for fields in store.tables["import_job"].records.values()
+        ):
+            raise EntityInUse("table_config_id has an import in progress")
+        if cascade:
+            return
+        if store.views_by_table_config.get(table_config_id):
+            raise EntityInUse("table_config_id is used by TableViews")
+        if store.rows_by_table_config.get(table_config_id):
+            raise EntityInUse("table_config_id is used by Rows")
+
+    def delete(self, table_config_id: int) -> None:
+        self.session.begin()
+        self.check_deletable(table_config_id)
+        store = self.session.store
+        import_jobs = [
+            fields for fields in store.tables["import_job"].records.values()
+            if fields["table_config_id"] == table_config_id
+        ]
+        if self.session.remove("table_config", table_config_id) is None:
+            raise EntityNotFound("table_config_id not found")
+        self.session.record_changes(ChangedEntity.TABLE_CONFIG, [table_config_id], deleted=True)
+        for fields in import_jobs:
+            self.session.remove("import_job", fields["id"])
+        renders = [
+            fields["table_view_id"]
+            for fields in store.tables["rendered_table_view"].records.values()
+            if fields["table_config_id"] == table_config_id
+        ]
+        for table_view_id in renders:
+            self.session.remove("rendered_table_view", table_view_id)
+
+    def get_by_id(self, table_config_id: int) -> TableConfig:
+        return self.session.get("table_config", table_config_id, "table_config_id not found")
+
+    def get_many(self, table_config_ids: Sequence[int]) -> dict[int, TableConfig]:
+        return self.session.get_many("table_config", table_config_ids)
+
+    def find_by_name(self, name: str) -> TableConfig:
+        with self.session.store.lock:
+            table_config_id = self.session.store.names["table_config"].get(name)
+        if table_config_id is None:
+            raise EntityNotFound("name not found")
+        return self.get_by_id(table_config_id)
+
+    def all(self) -> list[TableConfig]:
+        return self.session.all("table_config")
+
+    def page(self, limit: int, after: Optional[int] = None) -> list[TableConfig]:
+        return self.session.page("table_config", limit, after)
+
+
+class MemoryTableViewsRepo:
+    def __init__(self, session: MemorySession) -> None:
+        self.session = session
+
+    def add(self, table_view: TableView) -> TableView:
+        self.session.begin()
+        table_config = self.session.get(
+            "table_config", table_view.table_config_id, "table_config_id not found"
+        )
+        # rendered up front so that an invalid view is rejected before insert
+        rendered = render_table_view(table_view, table_config)
+        self.session.check_name("table_view", table_view)
+        fields = self.session.add("table_view", table_view)
+        rendered.table_view_id = fields["id"]
+        self.session.put("rendered_table_view", entity_fields(rendered))
+        self.session.record_changes(ChangedEntity.TABLE_VIEW, [fields["id"]])
+        return load(TableView, fields)
+
+    def delete(self, table_view_id: int) -> None:
+        if self.session.remove("table_view", table_view_id) is None:
+            raise EntityNotFound("table_view_id not found")
+        self.session.remove("rendered_table_view", table_view_id)
+        self.session.record_changes(ChangedEntity.TABLE_VIEW, [table_view_id], deleted=True)
+
+    def delete_by_table_config_id(self, table_config_id: int) -> int:
+        self.session.begin()
+        table_view_ids = list(self.session.store.views_by_table_config.get(table_config_id, ()))
+        for table_view_id in table_view_ids:
+            self.delete(table_view_id)
+        return len(table_view_ids)
+
+    def get_by_id(self, table_view_id: int) -> TableView:
+        return self.session.get("table_view", table_view_id, "table_view_id not found")
+
+    def get_many(self, table_view_ids: Sequence[int]) -> dict[int, TableView]:
+        return self.session.get_many("table_view", table_view_ids)
+
+    def find_by_name(self, name: str) -> TableView:
+        with self.session.store.lock:
+            table_view_id = self.session.store.names["table_view"].get(name)
+        if table_view_id is None:
+            raise EntityNotFound("name not found")
+        return self.get_by_id(table_view_id)
+
+    def find_by_table_config_id(self, table_config_id: int) -> list[TableView]:
+        with self.session.store.lock:
+            table_view_ids = sorted(self.session.store.views_by_table_config.get(table_config_id, ()))
+            return self.session.scan("table_view", table_view_ids)
+
+    def get_render(self, table_view_id: int) -> RenderedTableView:
+        return self.session.get("rendered_table_view", table_view_id, "table_view_id not found")
+
+    def all(self) -> list[TableView]:
+        return self.session.all("table_view")
+
+    def page(self, limit: int, after: Optional[int] = None) -> list[TableView]:
+        return self.session.page("table_view", limit, after)
+
+
+class MemoryRowsRepo:
+    def __init__(self, session: MemorySession) -> None:
+        self.session = session
+
+    def row_ids(self, table_config_id: Optional[int], after: Optional[int] = None) -> Iterator[int]:
+        store = self.session.store
+        if table_config_id is None:
+            return store.tables["row"].ids.after(after)
+        index = store.rows_by_table_config.get(table_config_id)
+        return index.after(after) if index is not None else iter(())
+
+    def find(self, row: Row) -> Optional[int]:
+        """The id of the row with row's natural key."""
+        store = self.session.store
+        key = store.row_key({"table_config_id": row.table_config_id, "data": row.data})
+        return None if key is None else store.rows_by_key[row.table_config_id].get(key)
+
+    def find_by_key(self, rows: Sequence[Row]) -> list[Optional[int]]:
+        """The id of the stored row with each row's natural key, if any."""
+        return [self.find(row) for row in rows]
+
+    def check_key(self, row: Row) -> None:
+        # the unique index on the natural key
+        if self.find(row) is not None:
+            raise EntityInUse("a row with the same natural_key exists; PUT upserts it")
+
+    def add(self, row: Row) -> Row:
+        self.session.begin()
+        self.check_key(row)
+        fields = self.session.add("row", row)
+        self.session.record_changes(ChangedEntity.ROW, [fields["id"]])
+        return load(Row, fields)
+
+    def add_many(self, rows: list[Row]) -> list[int]:
+        self.session.begin()
+        ids = []
+        for row in rows:
+            self.check_key(row)
+            ids.append(self.session.add("row", row)["id"])
+        self.session.record_changes(ChangedEntity.ROW, ids)
+        return ids
+
+    def upsert_many(self, rows: list[Row]) -> list[tuple[int, bool]]:
+        """Add rows, or replace the data of the row with the same natural key;
+        returns each row's id and whether it was added."""
+        self.session.begin()
+        store = self.session.store
+        ids, added, changed = [], set(), []
+        for row in rows:
+            if row.table_config_id not in store.key_columns:
+                raise EntityNotFound("table_config_id not found")
+            row_id = self.find(row)
+            if row_id is None:
+                row_id = self.session.add("row", row)["id"]
+                added.add(row_id)
+                changed.append(row_id)
+            elif store.get("row", row_id)["data"] != row.data:
+                self.session.put("row", {**store.get("row", row_id), "data": row.data})
+                changed.append(row_id)
+            ids.append(row_id)
+        self.session.record_changes(ChangedEntity.ROW, changed)
+        return created_first(ids, added)
+
+    def delete(self, row_id: int) -> None:
+        if not self.delete_many([row_id]):
+            raise EntityNotFound("row_id not found")
+
+    def delete_many(self, row_ids: Sequence[int], chunk_size: int = DELETE_CHUNK_SIZE) -> int:
+        """Delete rows by id in the current transaction; returns how many existed."""
+        deleted = [row_id for row_id in row_ids if self.session.remove("row", row_id) is not None]
+        self.session.record_changes(ChangedEntity.ROW, deleted, deleted=True)
+        return len(deleted)
+
+    def delete_where(
+        self,
+        table_config_id: Optional[int] = None,
+        created_before: Optional[datetime] = None,
+        filters: Sequence[RowFilter] = (),
+        chunk_size: int = DELETE_CHUNK_SIZE,
+    ) -> int:
+        """Delete the matching rows, committing after every chunk_size of them."""
+        if created_before is not None and created_before.tzinfo is not None:
+            # SQLite compares the stored naive timestamps with the wall time
+            created_before = created_before.replace(tzinfo=None)
+
+        def where(fields: dict) -> bool:
+            if created_before is not None and not fields["created_at"] < created_before:
+                return False
+            return matches(fields["data"], filters)
+
+        deleted, after = 0, None
+        while True:
+            rows = self.session.scan("row", self.row_ids(table_config_id, after), chunk_size, where)
+            deleted += self.delete_many([row.id for row in rows], chunk_size)
+            self.session.commit()
+            if len(rows) < chunk_size:
+                return deleted
+            after = rows[-1].id
+
+    def get_by_id(self, row_id: int) -> Row:
+        return self.session.get("row", row_id, "row_id not found")
+
+    def get_many(self, row_ids: Sequence[int]) -> dict[int, Row]:
+        return self.session.get_many("row", row_ids)
+
+    def all(self) -> list[Row]:
+        return self.session.all("row")
+
+    def page(
+        self,
+        limit: int,
+        after: Optional[int] = None,
+        table_config_id: Optional[int] = None,
+        filters: Sequence[RowFilter] = (),
+        include_archived: bool = False,
+    ) -> list[Row]:
+        # there is no archive in memory
+        where = (lambda fields: matches(fields["data"], filters)) if filters else None
+        return self.session.scan("row", self.row_ids(table_config_id, after), limit, where)
+
+    def search(
+        self,
+        query: str,
+        limit: int,
+        offset: int = 0,
+        table_config_id: Optional[int] = None,
+    ) -> list[Row]:
+        raise SearchUnavailable("search requires storage_backend=sqlite")
+
+    def export_batches(
+        self, table_config: TableConfig, batch_size: int, include_archived: bool = False
+    ) -> Iterator[Sequence[tuple]]:
+        # the tuples export_select gives; the lock is let go between batches
+        converters = export_converters(table_config)
+        after = None
+        while True:
+            rows = self.session.scan("row", self.row_ids(table_config.id, after), batch_size)
+            if not rows:
+                return
+            yield [export_values(converters, row.id, row.data) for row in rows]
+            after = rows[-1].id
+
+    def aggregate(self, table_config: TableConfig, aggregation: Aggregation) -> tuple[list[dict], bool]:
+        """The aggregation's groups, computed from the rows; never materialized."""
+        values: dict[tuple, list[dict]] = defaultdict(list)
+        with self.session.store.lock:
+            records = self.session.store.tables["row"].records
+            for row_id in self.row_ids(table_config.id):
+                data = records[row_id]["data"]
+                if matches(data, aggregation.filters):
+                    values[tuple(data.get(column) for column in aggregation.group_by)].append(data)
+        groups = []
+        for group_key, datas in values.items():
+            group = dict(zip(aggregation.group_by, group_key))
+            for metric in aggregation.metrics:
+                if metric.function == "count":
+                    group[metric.name] = len(datas)
+                    continue
+                numbers = [data[metric.column] for data in datas if data.get(metric.column) is not None]
+                if not numbers:
+                    value = None
+                elif metric.function in ("sum", "avg"):
+                    # SQLite sums ints exactly; floats may differ from it in
+                    # the last digits, as its order of summation does
+                    if any(isinstance(number, float) for number in numbers):
+                        value = math.fsum(numbers)
+                    else:
+                        value = sum(numbers)
+                    if metric.function == "avg":
+                        value /= len(numbers)
+                else:
+                    value = min(numbers) if metric.function == "min" else max(numbers)
+                group[metric.name] = value
+            groups.append(group)
+        # the order aggregate_rows gives: NULLs first, then by value
+        groups.sort(key=lambda group: [
+            (group[column] is not None, group[column]) for column in aggregation.group_by
+        ])
+        return groups, False
+
+
+class MemoryUsersRepo:
+    def __init__(self, session: MemorySession) -> None:
+        self.session = session
+
+    def add(self, user: User) -> User:
+        fields = self.session.add("user", user)
+        return load(User, fields)
+
+    def delete(self, user_id: int) -> None:
+        if self.session.remove("user", user_id) is None:
+            raise EntityNotFound("user_id not found")
+
+    def get_by_id(self, user_id: int) -> User:
+        return self.session.get("user", user_id, "user_id not found")
+
+    def all(self) -> list[User]:
+        return self.session.all("user")
+
+    def page(self, limit: int, after: Optional[int] = None) -> list[User]:
+        return self.session.page("user", limit, after)
+
+
+class MemoryImportJobsRepo:
+    def __init__(self, session: MemorySession) -> None:
+        self.session = session
+
+    def add(self, import_job: ImportJob) -> ImportJob:
+        fields = self.session.add("import_job", import_job)
+        return load(ImportJob, fields)
+
+    def update(self, import_job: ImportJob) -> None:
+        self.session.put("import_job", entity_fields(import_job))
+
+    def get_by_id(self, import_job_id: int) -> ImportJob:
+        return self.session.get("import_job", import_job_id, "import_job_id not found")
+
+    def find_active(self) -> list[ImportJob]:
+        return [
+            import_job for import_job in self.session.all("import_job")
+            if import_job.status in ACTIVE_IMPORT_STATUSES
+        ]
+
+
+class MemoryChangesRepo:
+    def __init__(self, session: MemorySession) -> None:
+        self.session = session
+
+    def page(self, limit: int, after: Optional[int] = None) -> list[Change]:
+        return self.session.page("change", limit, after)
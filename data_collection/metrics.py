@@ -0,0 +1,194 @@
+"""Request and SQL metrics in the Prometheus text format.
+
+MetricsMiddleware times every HTTP request and labels it with its route
+template rather than its path, so ids don't multiply the series. Engine
+event hooks add the count and duration of each statement to the request
+it ran for. The request is found through a context variable, which
+threadpool handlers and streaming responses inherit from the middleware.
+A route whose requests run many queries each is an N+1 candidate. All
+values are per process.
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUEST_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERIES_PER_REQUEST_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+UNMATCHED_ROUTE = "unmatched"
+# the method comes from the request line as the client sent it; any but
+# these is counted as OTHER_METHOD, as unmatched routes are
+HTTP_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "DELETE", "CONNECT", "OPTIONS", "TRACE", "PATCH"))
+OTHER_METHOD = "other"
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class Histogram:
+    """Bucket counts per label tuple; rendered cumulatively as Prometheus expects."""
+
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            # one count per bucket, then +Inf, sum
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self, name: str, label_names: tuple) -> list[str]:
+        lines = []
+        for labels, series in sorted(self.series.items()):
+            prefix = format_labels(label_names, labels)
+            count = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), series):
+                count += bucket_count
+                lines.append(f'{name}_bucket{{{prefix},le="{bound}"}} {count}')
+            lines.append(f"{name}_sum{{{prefix}}} {series[-1]}")
+            lines.append(f"{name}_count{{{prefix}}} {count}")
+        return lines
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    return ",".join(f'{name}="{escape(str(value))}"' for name, value in zip(names, values))
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.in_flight = 0
+        self.requests: dict[tuple, int] = {}
+        self.request_seconds = Histogram(REQUEST_SECONDS_BUCKETS)
+        self.queries_per_request = Histogram(QUERIES_PER_REQUEST_BUCKETS)
+        self.db_queries: dict[tuple, int] = {}
+        self.db_seconds: dict[tuple, float] = {}
+
+    def record(self, method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+        labels = (method, route)
+        with self.lock:
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.request_seconds.observe(labels, seconds)
+            self.queries_per_request.observe(labels, stats.queries)
+            self.db_queries[labels] = self.db_queries.get(labels, 0) + stats.queries
+            self.db_seconds[labels] = self.db_seconds.get(labels, 0.0) + stats.db_seconds
+
+    def render(self) -> str:
+        route = ("method", "route")
+        with self.lock:
+            lines = [
+                "# HELP http_requests_in_flight HTTP requests being handled.",
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {self.in_flight}",
+                "# HELP http_requests_total HTTP requests by route and status.",
+                "# TYPE http_requests_total counter",
+                *(
+                    f"http_requests_total{{{format_labels(route + ('status',), labels)}}} {value}"
+                    for labels, value in sorted(self.requests.items())
+                ),
+                "# HELP http_request_duration_seconds Time to handle and send a response.",
+                "# TYPE http_request_duration_seconds histogram",
+                *self.request_seconds.render("http_request_duration_seconds", route),
+                "# HELP db_queries_per_request SQL statements run by one request.",
+                "# TYPE db_queries_per_request histogram",
+                *self.queries_per_request.render("db_queries_per_request", route),
+                "# HELP db_queries_total SQL statements run by requests.",
+                "# TYPE db_queries_total counter",
+                *(
+                    f"db_queries_total{{{format_labels(route, labels)}}} {value}"
+                    for labels, value in sorted(self.db_queries.items())
+                ),
+                "# HELP db_query_duration_seconds_total Time spent executing SQL statements.",
+                "# TYPE db_query_duration_seconds_total counter",
+                *(
+                    f"db_query_duration_seconds_total{{{format_labels(route, labels)}}} {value}"
+                    for labels, value in sorted(self.db_seconds.items())
+                ),
+            ]
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, which unlike BaseHTTPMiddleware doesn't add a
+    task per request and keeps the handler's context variables visible."""
+
+    def __init__(self, app, metrics: Metrics) -> None:
+        self.app = app
+        self.metrics = metrics
+        self.route_paths: dict = {}
+
+    def route(self, scope) -> str:
+        # routing leaves the matched endpoint in the scope
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        if endpoint not in self.route_paths:
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    self.route_paths[endpoint] = route.path
+                    break
+            else:
+                return UNMATCHED_ROUTE
+        return self.route_paths[endpoint]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics = self.metrics
+        with metrics.lock:
+            metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            seconds = time.perf_counter() - start
+            with metrics.lock:
+                metrics.in_flight -= 1
+            method = scope["method"] if scope["method"] in HTTP_METHODS else OTHER_METHOD
+            metrics.record(method, self.route(scope), status, seconds, stats)
+            current_request.reset(token)
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Count statements and their time against the current request."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += time.perf_counter() - context._metrics_start
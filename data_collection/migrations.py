@@ -0,0 +1,215 @@
+"""Schema versions, and the migrations between them.
+
+The SchemaVersion table records every version a database has been
+migrated to. ``migrate`` brings a database up to SCHEMA_VERSION once,
+holding SQLite's write lock throughout, so processes migrating at the same
+time take turns and all but the first find nothing left to do. ``check``
+only reads the version and fails if it isn't the one this code was written
+for, which is all a worker needs to do at boot when the deployment runs
+the migration beforehand:
+
+    PYTHONPATH=. python -m data_collection.migrations
+
+which also fails the import jobs a crash or restart left unfinished, as
+each process does at startup when it migrates.
+
+A new database, or one from before versioning, gets the current tables
+from the models and is stamped BASELINE_VERSION if it had tables already,
+else SCHEMA_VERSION. To change the schema, change the models, add a
+function taking a Connection to MIGRATIONS under the next version and
+bump SCHEMA_VERSION.
+"""
+import argparse
+import logging
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel
+
+from data_collection.aggregation import update_summaries
+from data_collection.constants import ChangedEntity
+from data_collection.exceptions import SchemaVersionMismatch
+from data_collection.models import Row, RowAggregate, SchemaVersion, TableConfig
+from data_collection.search import CREATE_ROW_FTS, index_rows
+from data_collection.storage import decode_data
+
+logger = logging.getLogger(__name__)
+
+# the schema before versioning was added, whose missing tables create_all
+# adds; the migrations after it fill in the rest
+BASELINE_VERSION = 1
+SCHEMA_VERSION = 5
+BACKFILL_CHUNK_SIZE = 10_000
+
+
+def schema_version(connection: Connection) -> Optional[int]:
+    """The version a database is at, None if it isn't versioned."""
+    try:
+        return connection.execute(text("SELECT max(version) FROM schemaversion")).scalar()
+    except OperationalError:
+        # no such table
+        return None
+
+
+def backfill_rows(
+    connection: Connection, fill: Callable[[TableConfig, list[tuple[int, dict]]], None]
+) -> None:
+    """Pass the existing rows, decoded, to fill a chunk and config at a time."""
+    table_configs = {
+        table_config_id: TableConfig.construct(id=table_config_id, config_fields=config_fields)
+        for table_config_id, config_fields in connection.execute(
+            select(TableConfig.id, TableConfig.config_fields)
+        )
+    }
+    after = 0
+    while True:
+        rows = connection.execute(
+            select(Row.id, Row.table_config_id, Row.data)
+            .where(Row.id > after)
+            .order_by(Row.id)
+            .limit(BACKFILL_CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        by_table_config: dict[int, list] = {}
+        for row in rows:
+            by_table_config.setdefault(row.table_config_id, []).append(row)
+        for table_config_id, config_rows in by_table_config.items():
+            table_config = table_configs.get(table_config_id)
+            if table_config is not None:
+                fill(table_config, [(row.id, decode_data(table_config, row.data)) for row in config_rows])
+        after = rows[-1].id
+
+
+def add_row_search(connection: Connection) -> None:
+    """Version 2: the full-text index of rows, filled from the existing ones."""
+    connection.exec_driver_sql(CREATE_ROW_FTS)
+    backfill_rows(connection, lambda table_config, rows: index_rows(connection, table_config, rows))
+
+
+def add_declared_indexes(connection: Connection) -> None:
+    """Version 3: the indexes the models declare on tables that existed before
+    versioning, which create_all skips, e.g. row's on table_config_id."""
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def add_row_summaries(connection: Connection) -> None:
+    """Version 4: the summaries of rows from before they were kept, counted
+    again from all the rows as the ones added since are already in."""
+    connection.execute(delete(RowAggregate))
+    backfill_rows(
+        connection,
+        lambda table_config, rows: update_summaries(connection, table_config, [data for _, data in rows], 1),
+    )
+
+
+def add_existing_changes(connection: Connection) -> None:
+    """Version 5: a Change for every config, view and row from before the
+    feed, in that order and by id, so that since=0 still gets everything."""
+    for entity, table in (
+        (ChangedEntity.TABLE_CONFIG, "tableconfig"),
+        (ChangedEntity.TABLE_VIEW, "tableview"),
+        (ChangedEntity.ROW, "row"),
+    ):
+        # entities changed since have their latest change recorded already
+        connection.execute(
+            text(
+                "INSERT OR IGNORE INTO change (entity, entity_id, deleted) "
+                f"SELECT :entity, id, 0 FROM {table} ORDER BY id"
+            ),
+            {"entity": entity.value},
+        )
+
+
+MIGRATIONS: dict[int, Callable[[Connection], None]] = {
+    2: add_row_search,
+    3: add_declared_indexes,
+    4: add_row_summaries,
+    5: add_existing_changes,
+}
+
+
+def check(engine: Engine) -> None:
+    with engine.connect() as connection:
+        version = schema_version(connection)
+    if version != SCHEMA_VERSION:
+        raise SchemaVersionMismatch(
+            f"database schema is at version {version}, this code needs {SCHEMA_VERSION}; "
+            "run python -m data_collection.migrations"
+        )
+
+
+def migrate(engine: Engine) -> Optional[int]:
+    """Bring the database up to SCHEMA_VERSION; returns the version it was at."""
+    with engine.connect() as connection:
+        version = schema_version(connection)
+        if version == SCHEMA_VERSION:
+            return version
+    # BEGIN IMMEDIATE takes the write lock up front, and pysqlite only lets
+    # us issue it ourselves in autocommit mode
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            version = apply_migrations(connection)
+        except BaseException:
+            connection.exec_driver_sql("ROLLBACK")
+            raise
+        connection.exec_driver_sql("COMMIT")
+    return version
+
+
+def apply_migrations(connection: Connection) -> Optional[int]:
+    version = schema_version(connection)
+    if version is not None and version > SCHEMA_VERSION:
+        raise SchemaVersionMismatch(
+            f"database schema is at version {version}, newer than this code's {SCHEMA_VERSION}"
+        )
+    applied = []
+    if version is None:
+        existing = connection.execute(
+            text("SELECT count(*) FROM sqlite_master WHERE type = 'table'")
+        ).scalar()
+        SQLModel.metadata.create_all(connection)
+        applied.append(BASELINE_VERSION if existing else SCHEMA_VERSION)
+    start = applied[0] if applied else version
+    for target in range(start + 1, SCHEMA_VERSION + 1):
+        logger.info("migrating the database schema to version %s", target)
+        MIGRATIONS[target](connection)
+        applied.append(target)
+    if applied:
+        now = datetime.utcnow()
+        connection.execute(
+            insert(SchemaVersion), [{"version": target, "applied_at": now} for target in applied]
+        )
+    return version
+
+
+def main(argv=None) -> None:
+    from config import settings
+    from data_collection.imports import fail_interrupted_imports
+    from data_collection.unit_of_work import create_db_engine, SqlModelUnitOfWork
+
+    parser = argparse.ArgumentParser(description="Migrate the database to the current schema.")
+    parser.add_argument("--check", action="store_true", help="only check the version")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    engine = create_db_engine()
+    if args.check:
+        check(engine)
+        return
+    version = migrate(engine)
+    logger.info("database schema migrated from version %s to %s", version, SCHEMA_VERSION)
+    # run before the workers start, so no import can still be running
+    failed = fail_interrupted_imports(SqlModelUnitOfWork(engine), settings.import_dir)
+    logger.info("%s interrupted import jobs failed", failed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,23 @@
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Union
 
+from sqlalchemy import UniqueConstraint
 from sqlmodel import Column, Field, JSON, SQLModel
 
-from data_collection.constants import TableConfigName, TableViewName
+from data_collection.constants import (
+    BatchEntity,
+    BatchOp,
+    ChangedEntity,
+    ImportFormat,
+    ImportStatus,
+    TableConfigName,
+    TableViewName,
+)  # noqa: E133
+
+
+class SchemaVersion(SQLModel, table=True):
+    version: int = Field(primary_key=True)
+    applied_at: datetime = Field(default_factory=datetime.utcnow)
 
 
 class User(SQLModel, table=True):
@@ -14,10 +28,36 @@ class User(SQLModel, table=True):
 class Row(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    table_config_id: int = Field(foreign_key="tableconfig.id")
+    table_config_id: int = Field(foreign_key="tableconfig.id", index=True)
     data: dict = Field(default={}, sa_column=Column(JSON))
 
 
+class RowIds(SQLModel):
+    ids: list[int]
+
+
+class UpsertedRows(SQLModel):
+    # one per row, in order; rows with the same natural key share an id
+    ids: list[int]
+    # whether each row was created rather than matched by its natural key
+    created: list[bool]
+
+
+class DeletedRows(SQLModel):
+    deleted: int
+
+
+class Lookup(SQLModel):
+    # as many as the largest page
+    ids: list[int] = Field(max_items=1000)
+
+
+class RowLookup(SQLModel):
+    # found entities in the order their ids were asked for
+    found: list[Row]
+    missing: list[int]
+
+
 class TableConfig(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -31,3 +71,113 @@ class TableView(SQLModel, table=True):
     name: TableViewName = Field(unique=True)
     table_config_id: int = Field(foreign_key="tableconfig.id")
     view_fields: dict = Field(default={}, sa_column=Column(JSON))
+
+
+class TableConfigLookup(SQLModel):
+    found: list[TableConfig]
+    missing: list[int]
+
+
+class TableViewLookup(SQLModel):
+    found: list[TableView]
+    missing: list[int]
+
+
+class RenderedTableView(SQLModel, table=True):
+    table_view_id: int = Field(primary_key=True, foreign_key="tableview.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    table_config_id: int = Field(foreign_key="tableconfig.id", index=True)
+    num_rows: Optional[int] = None
+    columns: list = Field(default=[], sa_column=Column(JSON))
+
+
+class ImportJob(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    table_config_id: int = Field(foreign_key="tableconfig.id", index=True)
+    format: ImportFormat
+    status: ImportStatus = ImportStatus.PENDING
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    rows_processed: int = 0
+    rows_inserted: int = 0
+    rows_failed: int = 0
+    rows_per_second: Optional[float] = None
+    # the first problems found, each {"line", "column", "msg"}
+    errors: list = Field(default=[], sa_column=Column(JSON))
+    # why a failed job stopped
+    error: Optional[str] = None
+
+
+class RowAggregate(SQLModel, table=True):
+    table_config_id: int = Field(primary_key=True, foreign_key="tableconfig.id")
+    # group columns joined by commas, "" for all of the config's rows
+    grouping: str = Field(primary_key=True)
+    # JSON array of the group's values
+    group_key: str = Field(primary_key=True)
+    # "" for the group's row count
+    column: str = Field(primary_key=True)
+    count: int = 0
+    total: float = 0
+
+
+class Aggregate(SQLModel):
+    table_config_id: int
+    group_by: list[str]
+    materialized: bool
+    groups: list[dict]
+
+
+class Change(SQLModel, table=True):
+    # an entity's latest change only: recording another replaces it with a
+    # higher seq, and AUTOINCREMENT never hands a seq out twice
+    __table_args__ = (
+        UniqueConstraint("entity", "entity_id"),
+        {"sqlite_autoincrement": True},
+    )
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    entity: ChangedEntity
+    entity_id: int
+    deleted: bool = False
+
+
+class ChangeEntry(SQLModel):
+    seq: int
+    entity: ChangedEntity
+    id: int
+    deleted: bool
+    # the entity as it is now, null for a deletion
+    value: Optional[Union[Row, TableConfig, TableView]] = None
+
+
+class ChangeFeed(SQLModel):
+    changes: list[ChangeEntry]
+    # pass as since to get the changes after these
+    cursor: int
+    has_more: bool
+
+
+class BatchOperation(SQLModel):
+    op: BatchOp
+    entity: BatchEntity
+    # the entity to create; its table_config_id may be a reference
+    value: Optional[dict] = None
+    # the entity to delete, by id or reference
+    id: Optional[Union[int, str]] = None
+    # lets later operations refer to the id of the entity created as "$<ref>"
+    ref: Optional[str] = None
+
+
+class Batch(SQLModel):
+    operations: list[BatchOperation] = Field(min_items=1, max_items=1000)
+
+
+class BatchResult(SQLModel):
+    op: BatchOp
+    entity: BatchEntity
+    id: int
+
+
+class BatchResults(SQLModel):
+    # one per operation, in order
+    results: list[BatchResult]
@@ -0,0 +1,146 @@
+"""Natural keys: the columns that identify a config's rows.
+
+A config may list columns in ``config_fields["natural_key"]``, e.g.
+``["external_account_id", "year"]``. Its rows then get a partial unique
+expression index::
+
+    CREATE UNIQUE INDEX uq_row_key_<config id> ON row
+        (json_extract(data, '$.external_account_id'), json_extract(data, '$.year'))
+        WHERE table_config_id + 0 = <config id>
+
+so that adding a second row with a key already taken fails, and rows can be
+upserted by key: one ``INSERT ... ON CONFLICT DO UPDATE`` per chunk of rows.
+SQLite only takes an ON CONFLICT target that repeats the index's
+expressions and WHERE clause, which are inlined as literals for the reasons
+given in data_collection.row_filters.
+
+SQLite treats NULLs in a unique index as distinct, so only rows that have
+every key column are kept unique, and upserts require them. Keys are
+unique among the rows in the hot table; archived rows aren't checked.
+"""
+from contextlib import contextmanager
+from typing import Any, Iterator, Sequence
+
+from sqlalchemy import bindparam, DateTime, Integer, JSON, text
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from data_collection.exceptions import EntityInUse, InvalidTableConfig
+from data_collection.models import TableConfig
+from data_collection.storage import data_path, IDENTIFIER
+
+# bool values are stored as JSON true and false and read back as 1 and 0
+KEY_TYPES = ("int", "str", "bool")
+
+
+def natural_key_columns(table_config: TableConfig) -> list[str]:
+    names = table_config.config_fields.get("natural_key", [])
+    columns = table_config.config_fields.get("columns", {})
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise InvalidTableConfig("config_fields.natural_key must be a list of columns")
+    if len(set(names)) < len(names):
+        raise InvalidTableConfig("natural_key: columns must not repeat")
+    for name in names:
+        if name not in columns or not IDENTIFIER.fullmatch(name):
+            raise InvalidTableConfig(f"natural_key: {name!r} is not an identifier column")
+        if not isinstance(columns[name], dict) or columns[name].get("type") not in KEY_TYPES:
+            raise InvalidTableConfig(f"natural_key: {name} must be one of {list(KEY_TYPES)}")
+    return names
+
+
+def key_index_name(table_config_id: int) -> str:
+    return f"uq_row_key_{table_config_id}"
+
+
+def key_expressions(table_config: TableConfig) -> str:
+    return ", ".join(
+        f"json_extract(data, '{data_path(table_config, column)}')"
+        for column in natural_key_columns(table_config)
+    )
+
+
+def row_key(columns: Sequence[str], data: dict) -> tuple:
+    return tuple(data.get(column) for column in columns)
+
+
+def create_key_index(session: Session, table_config: TableConfig) -> None:
+    if not natural_key_columns(table_config):
+        return
+    session.execute(
+        text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {key_index_name(table_config.id)} "
+            f"ON row ({key_expressions(table_config)}) "
+            f"WHERE table_config_id + 0 = {int(table_config.id)}"
+        )
+    )
+
+
+def drop_key_index(session: Session, table_config_id: int) -> None:
+    session.execute(text(f"DROP INDEX IF EXISTS {key_index_name(int(table_config_id))}"))
+
+
+def key_lookup_statement(table_config: TableConfig, count: int):
+    """The config's rows with any of count keys, bound as key_<i>_<column index>.
+
+    A join against the keys as VALUES, which SQLite answers with a search of
+    the key index per key; for a row value IN list it scans the index.
+    """
+    table_config_id = int(table_config.id)
+    columns = natural_key_columns(table_config)
+    keys = ", ".join(
+        "(" + ", ".join(f":key_{i}_{j}" for j in range(len(columns))) + ")" for i in range(count)
+    )
+    on = " AND ".join(
+        f"json_extract(row.data, '{data_path(table_config, column)}') = keys.column{j + 1}"
+        for j, column in enumerate(columns)
+    )
+    return text(
+        f"SELECT row.id, row.table_config_id, row.data FROM (VALUES {keys}) AS keys "
+        f"JOIN row ON {on} AND row.table_config_id + 0 = {table_config_id}"
+    ).columns(id=Integer, table_config_id=Integer, data=JSON)
+
+
+def key_parameters(keys: Sequence[tuple]) -> dict:
+    return {f"key_{i}_{j}": value for i, key in enumerate(keys) for j, value in enumerate(key)}
+
+
+@contextmanager
+def key_conflicts() -> Iterator[None]:
+    """Turn an insert failing on a key index into EntityInUse."""
+    try:
+        yield
+    except IntegrityError as e:
+        if key_index_name("") not in str(e.orig):
+            raise
+        raise EntityInUse("a row with the same natural_key exists; PUT upserts it") from None
+
+
+def upsert_statement(table_config: TableConfig, count: int):
+    """Insert count rows of the config, or replace the data of the row with
+    the same key; RETURNING gives the id and key of each row inserted or
+    changed, but not of those whose data was already the same."""
+    table_config_id = int(table_config.id)
+    keys = key_expressions(table_config)
+    values = ", ".join(
+        f"(:id_{i}, :created_at_{i}, {table_config_id}, :data_{i})" for i in range(count)
+    )
+    return text(
+        f"INSERT INTO row (id, created_at, table_config_id, data) VALUES {values} "
+        f"ON CONFLICT ({keys}) WHERE table_config_id + 0 = {table_config_id} "
+        "DO UPDATE SET data = excluded.data WHERE data IS NOT excluded.data "
+        f"RETURNING id, {keys}"
+    ).bindparams(
+        # typed, so that they are stored as the ORM stores them
+        *(bindparam(f"created_at_{i}", type_=DateTime) for i in range(count)),
+        *(bindparam(f"data_{i}", type_=JSON) for i in range(count)),
+    ).columns(id=Integer)
+
+
+def upsert_parameters(rows: Sequence[tuple[Any, Any, Any]]) -> dict:
+    """Bind (id, created_at, stored data) for each row of upsert_statement."""
+    parameters = {}
+    for i, (row_id, created_at, data) in enumerate(rows):
+        parameters[f"id_{i}"] = row_id
+        parameters[f"created_at_{i}"] = created_at
+        parameters[f"data_{i}"] = data
+    return parameters
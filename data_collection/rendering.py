@@ -0,0 +1,35 @@
+from data_collection.exceptions import InvalidTableView
+from data_collection.models import RenderedTableView, TableConfig, TableView
+
+
+def render_table_view(table_view: TableView, table_config: TableConfig) -> RenderedTableView:
+    """Merge a view's display settings into its config's column specs.
+
+    Columns come out in the view's column_order, falling back to the order
+    of its columns, each with the config's spec (type, constraints)
+    overlaid by the view's (display_type, validation_regex).
+    """
+    config_columns = table_config.config_fields.get("columns", {})
+    view_columns = table_view.view_fields.get("columns", {})
+    if not isinstance(view_columns, dict) or not all(
+        isinstance(spec, dict) for spec in view_columns.values()
+    ):
+        raise InvalidTableView("view_fields.columns must map columns to objects")
+    column_order = table_view.view_fields.get("column_order") or []
+    if not isinstance(column_order, list) or not all(
+        isinstance(name, str) for name in column_order
+    ):
+        raise InvalidTableView("view_fields.column_order must be a list of columns")
+    order = list(column_order or view_columns)
+    order += [name for name in view_columns if name not in order]
+    columns = []
+    for name in order:
+        if name not in config_columns:
+            raise InvalidTableView(f"{name}: not a column of table_config {table_config.id}")
+        columns.append({"name": name, **config_columns[name], **view_columns.get(name, {})})
+    return RenderedTableView(
+        table_view_id=table_view.id,
+        table_config_id=table_config.id,
+        num_rows=table_view.view_fields.get("num_rows"),
+        columns=columns,
+    )
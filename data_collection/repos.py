@@ -1,9 +1,66 @@
-from typing import Protocol
+import heapq
+from datetime import datetime
+from operator import itemgetter
+from typing import Iterator, Optional, Protocol, Sequence
 
+from sqlalchemy import bindparam, delete, func, insert, Integer, JSON, or_, text
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlmodel import select, Session
 
-from data_collection.models import TableConfig, TableView, Row, User
-from data_collection.exceptions import EntityNotFound
+from data_collection.aggregation import (
+    aggregate_rows,
+    Aggregation,
+    delete_summaries,
+    is_materialized,
+    read_summaries,
+    update_summaries,
+)  # noqa: E133
+from data_collection.archive import (
+    archived_batches,
+    archived_ids,
+    archived_ids_where,
+    delete_archived,
+    get_archived,
+    has_archived_rows,
+    last_archived_id,
+    page_archived,
+    write_segment,
+)  # noqa: E133
+from data_collection.cache import EntityCache
+from data_collection.changes import record_changes
+from data_collection.constants import ChangedEntity, ImportStatus
+from data_collection.models import (
+    Change,
+    ImportJob,
+    RenderedTableView,
+    TableConfig,
+    TableView,
+    Row,
+    User,
+)  # noqa: E133
+from data_collection.rendering import render_table_view
+from data_collection.exceptions import EntityInUse, EntityNotFound
+from data_collection.export import export_converters, export_select, export_values
+from data_collection.natural_keys import (
+    create_key_index,
+    drop_key_index,
+    key_conflicts,
+    key_lookup_statement,
+    key_parameters,
+    natural_key_columns,
+    row_key,
+    upsert_parameters,
+    upsert_statement,
+)  # noqa: E133
+from data_collection.search import index_rows, match_query, ROW_FTS, ROW_FTS_MATCH, unindex_rows
+from data_collection.storage import decode_data, encode_data
+from data_collection.row_filters import (
+    create_row_indexes,
+    drop_row_indexes,
+    matches,
+    row_filter_criteria,
+    RowFilter,
+)  # noqa: E133
 
 
 class TableConfigsRepo(Protocol):
@@ -13,15 +70,24 @@ class TableConfigsRepo(Protocol):
     def delete(self, id: int) -> None:
         ...
 
+    def check_deletable(self, id: int, cascade: bool = False) -> None:
+        ...
+
     def get_by_id(self, id: int) -> TableConfig:
         ...
 
+    def get_many(self, ids: Sequence[int]) -> dict[int, TableConfig]:
+        ...
+
     def find_by_name(self, name: str) -> TableConfig:
         ...
 
     def all(self) -> list[TableConfig]:
         ...
 
+    def page(self, limit: int, after: Optional[int] = None) -> list[TableConfig]:
+        ...
+
 
 class TableViewsRepo(Protocol):
     def add(self, entity: TableView) -> TableView:
@@ -30,29 +96,94 @@ class TableViewsRepo(Protocol):
     def delete(self, id: int) -> None:
         ...
 
+    def delete_by_table_config_id(self, table_config_id: int) -> int:
+        ...
+
     def get_by_id(self, id: int) -> TableView:
         ...
 
+    def get_many(self, ids: Sequence[int]) -> dict[int, TableView]:
+        ...
+
     def find_by_name(self, name: str) -> TableView:
         ...
 
+    def find_by_table_config_id(self, table_config_id: int) -> list[TableView]:
+        ...
+
+    def get_render(self, id: int) -> RenderedTableView:
+        ...
+
     def all(self) -> list[TableView]:
         ...
 
+    def page(self, limit: int, after: Optional[int] = None) -> list[TableView]:
+        ...
+
 
 class RowsRepo(Protocol):
     def add(self, entity: Row) -> Row:
         ...
 
+    def add_many(self, entities: list[Row]) -> list[int]:
+        ...
+
+    def upsert_many(self, entities: list[Row]) -> list[tuple[int, bool]]:
+        ...
+
+    def find_by_key(self, entities: Sequence[Row]) -> list[Optional[int]]:
+        ...
+
     def delete(self, id: int) -> None:
         ...
 
+    def delete_many(self, ids: Sequence[int]) -> int:
+        ...
+
+    def delete_where(
+        self,
+        table_config_id: Optional[int] = None,
+        created_before: Optional[datetime] = None,
+        filters: Sequence[RowFilter] = (),
+    ) -> int:
+        ...
+
     def get_by_id(self, id: int) -> Row:
         ...
 
+    def get_many(self, ids: Sequence[int]) -> dict[int, Row]:
+        ...
+
     def all(self) -> list[Row]:
         ...
 
+    def page(
+        self,
+        limit: int,
+        after: Optional[int] = None,
+        table_config_id: Optional[int] = None,
+        filters: Sequence[RowFilter] = (),
+        include_archived: bool = False,
+    ) -> list[Row]:
+        ...
+
+    def search(
+        self,
+        query: str,
+        limit: int,
+        offset: int = 0,
+        table_config_id: Optional[int] = None,
+    ) -> list[Row]:
+        ...
+
+    def export_batches(
+        self, table_config: TableConfig, batch_size: int, include_archived: bool = False
+    ) -> Iterator[Sequence[tuple]]:
+        ...
+
+    def aggregate(self, table_config: TableConfig, aggregation: Aggregation) -> tuple[list[dict], bool]:
+        ...
+
 
 class UsersRepo(Protocol):
     def add(self, entity: User) -> User:
@@ -67,28 +198,143 @@ class UsersRepo(Protocol):
     def all(self) -> list[User]:
         ...
 
+    def page(self, limit: int, after: Optional[int] = None) -> list[User]:
+        ...
+
+
+class ChangesRepo(Protocol):
+    def page(self, limit: int, after: Optional[int] = None) -> list[Change]:
+        ...
+
+
+class ImportJobsRepo(Protocol):
+    def add(self, entity: ImportJob) -> ImportJob:
+        ...
+
+    def update(self, entity: ImportJob) -> None:
+        ...
+
+    def get_by_id(self, id: int) -> ImportJob:
+        ...
+
+    def find_active(self) -> list[ImportJob]:
+        ...
+
+
+def created_first(ids: list[int], added: set[int]) -> list[tuple[int, bool]]:
+    """Pair upserted ids with whether they were added; of several rows with
+    one key, only the first was, and the later ones replaced it."""
+    seen = set()
+    results = []
+    for row_id in ids:
+        results.append((row_id, row_id in added and row_id not in seen))
+        seen.add(row_id)
+    return results
+
+
+def select_page(session: Session, model, limit: int, after: Optional[int], *criteria):
+    # keyset pagination: seek past the last id seen instead of OFFSET, so
+    # every page costs the same however deep into the table it is
+    statement = select(model).where(*criteria)
+    if after is not None:
+        statement = statement.where(model.id > after)
+    statement = statement.order_by(model.id).limit(limit)
+    results = list(session.execute(statement).scalars())
+    session.expunge_all()
+    return results
+
+
+def select_many(session: Session, model, ids: Sequence[int]) -> dict:
+    # one IN query for the whole batch; ids that don't exist are left out
+    statement = select(model).where(model.id.in_(set(ids)))
+    results = {entity.id: entity for entity in session.execute(statement).scalars()}
+    session.expunge_all()
+    return results
+
+
+# RETURNING hands back what the summaries need from the deleted rows in the
+# same statement; SQLAlchemy 1.4 can't emit it for SQLite
+DELETE_ROWS = (
+    text("DELETE FROM row WHERE id IN :ids RETURNING id, table_config_id, data")
+    .bindparams(bindparam("ids", expanding=True))
+    .columns(id=Integer, table_config_id=Integer, data=JSON)
+)
+DELETE_CHUNK_SIZE = 5000
+ACTIVE_IMPORT_STATUSES = (ImportStatus.PENDING, ImportStatus.RUNNING)
+
 
 class SqlModelTableConfigsRepo:
-    def __init__(self, session: Session) -> None:
+    def __init__(
+        self, session: Session, cache: Optional[EntityCache] = None, archive: bool = False
+    ) -> None:
         self.session = session
+        self.cache = cache
+        # whether the session has the archive attached
+        self.archive_enabled = archive
 
     def add(self, table_config: TableConfig) -> TableConfig:
         self.session.add(table_config)
-        self.session.commit()
-        self.session.refresh(table_config)
+        self.session.flush()
+        create_row_indexes(self.session, table_config)
+        create_key_index(self.session, table_config)
+        record_changes(self.session, ChangedEntity.TABLE_CONFIG, [table_config.id])
         self.session.expunge_all()
+        if self.cache is not None:
+            self.cache.invalidate_on_rollback(self.session, table_config.id)
         return table_config
 
+    def check_deletable(self, table_config_id: int, cascade: bool = False) -> None:
+        """Raise EntityInUse if the config can't be deleted; with cascade, only
+        for what deleting its rows and views first would leave in the way."""
+        active_import = select(ImportJob.id).where(
+            ImportJob.table_config_id == table_config_id,
+            ImportJob.status.in_(ACTIVE_IMPORT_STATUSES),
+        ).limit(1)
+        if self.session.execute(active_import).first():
+            raise EntityInUse("table_config_id has an import in progress")
+        if cascade:
+            return
+        for model in (TableView, Row):
+            dependent = select(model.id).where(model.table_config_id == table_config_id).limit(1)
+            if self.session.execute(dependent).first():
+                raise EntityInUse(f"table_config_id is used by {model.__name__}s")
+        if self.archive_enabled and has_archived_rows(self.session, table_config_id):
+            raise EntityInUse("table_config_id is used by archived Rows")
+
     def delete(self, table_config_id: int) -> None:
-        self.session.delete(self.get_by_id(table_config_id))
+        self.check_deletable(table_config_id)
+        result = self.session.execute(delete(TableConfig).where(TableConfig.id == table_config_id))
+        if not result.rowcount:
+            raise EntityNotFound("table_config_id not found")
+        drop_row_indexes(self.session, table_config_id)
+        drop_key_index(self.session, table_config_id)
+        delete_summaries(self.session, table_config_id)
+        record_changes(self.session, ChangedEntity.TABLE_CONFIG, [table_config_id], deleted=True)
+        self.session.execute(delete(ImportJob).where(ImportJob.table_config_id == table_config_id))
+        # views left behind can't be rendered against a config reusing the id
+        self.session.execute(
+            delete(RenderedTableView).where(RenderedTableView.table_config_id == table_config_id)
+        )
+        if self.cache is not None:
+            self.cache.invalidate_on_commit(self.session, table_config_id)
 
     def get_by_id(self, table_config_id: int) -> TableConfig:
+        if self.cache is not None:
+            return self.cache.get_or_load(
+                table_config_id, lambda: self._get_by_id(table_config_id)
+            )
+        return self._get_by_id(table_config_id)
+
+    def _get_by_id(self, table_config_id: int) -> TableConfig:
         user = self.session.get(TableConfig, table_config_id)
         self.session.expunge_all()
         if not user:
             raise EntityNotFound("table_config_id not found")
         return user
 
+    def get_many(self, table_config_ids: Sequence[int]) -> dict[int, TableConfig]:
+        return select_many(self.session, TableConfig, table_config_ids)
+
     def all(self) -> list[TableConfig]:
         statement = select(TableConfig)
         results = self.session.execute(statement)
@@ -98,28 +344,84 @@ class SqlModelTableConfigsRepo:
             return []
         return results
 
+    def page(self, limit: int, after: Optional[int] = None) -> list[TableConfig]:
+        return select_page(self.session, TableConfig, limit, after)
+
 
 class SqlModelTableViewsRepo:
-    def __init__(self, session: Session) -> None:
+    def __init__(self, session: Session, cache: Optional[EntityCache] = None) -> None:
         self.session = session
+        self.cache = cache
 
     def add(self, table_view: TableView) -> TableView:
+        table_config = self.session.get(TableConfig, table_view.table_config_id)
+        if not table_config:
+            raise EntityNotFound("table_config_id not found")
+        # rendered up front so that an invalid view is rejected before insert
+        rendered = render_table_view(table_view, table_config)
         self.session.add(table_view)
-        self.session.commit()
-        self.session.refresh(table_view)
+        self.session.flush()
+        rendered.table_view_id = table_view.id
+        self.session.add(rendered)
+        record_changes(self.session, ChangedEntity.TABLE_VIEW, [table_view.id])
+        self.session.flush()
         self.session.expunge_all()
+        if self.cache is not None:
+            self.cache.invalidate_on_rollback(self.session, table_view.id)
         return table_view
 
     def delete(self, table_view_id: int) -> None:
-        self.session.delete(self.get_by_id(table_view_id))
+        result = self.session.execute(delete(TableView).where(TableView.id == table_view_id))
+        if not result.rowcount:
+            raise EntityNotFound("table_view_id not found")
+        self.session.execute(
+            delete(RenderedTableView).where(RenderedTableView.table_view_id == table_view_id)
+        )
+        record_changes(self.session, ChangedEntity.TABLE_VIEW, [table_view_id], deleted=True)
+        if self.cache is not None:
+            self.cache.invalidate_on_commit(self.session, table_view_id)
+
+    def delete_by_table_config_id(self, table_config_id: int) -> int:
+        statement = select(TableView.id).where(TableView.table_config_id == table_config_id)
+        table_view_ids = list(self.session.execute(statement).scalars())
+        self.session.execute(delete(TableView).where(TableView.id.in_(table_view_ids)))
+        self.session.execute(
+            delete(RenderedTableView).where(RenderedTableView.table_view_id.in_(table_view_ids))
+        )
+        record_changes(self.session, ChangedEntity.TABLE_VIEW, table_view_ids, deleted=True)
+        if self.cache is not None:
+            for table_view_id in table_view_ids:
+                self.cache.invalidate_on_commit(self.session, table_view_id)
+        return len(table_view_ids)
 
     def get_by_id(self, table_view_id: int) -> TableView:
+        if self.cache is not None:
+            return self.cache.get_or_load(table_view_id, lambda: self._get_by_id(table_view_id))
+        return self._get_by_id(table_view_id)
+
+    def _get_by_id(self, table_view_id: int) -> TableView:
         user = self.session.get(TableView, table_view_id)
         self.session.expunge_all()
         if not user:
             raise EntityNotFound("table_view_id not found")
         return user
 
+    def get_many(self, table_view_ids: Sequence[int]) -> dict[int, TableView]:
+        return select_many(self.session, TableView, table_view_ids)
+
+    def find_by_table_config_id(self, table_config_id: int) -> list[TableView]:
+        statement = select(TableView).where(TableView.table_config_id == table_config_id)
+        results = list(self.session.execute(statement).scalars())
+        self.session.expunge_all()
+        return results
+
+    def get_render(self, table_view_id: int) -> RenderedTableView:
+        rendered = self.session.get(RenderedTableView, table_view_id)
+        self.session.expunge_all()
+        if not rendered:
+            raise EntityNotFound("table_view_id not found")
+        return rendered
+
     def all(self) -> list[TableView]:
         statement = select(TableView)
         results = self.session.execute(statement)
@@ -129,27 +431,298 @@ class SqlModelTableViewsRepo:
             return []
         return results
 
+    def page(self, limit: int, after: Optional[int] = None) -> list[TableView]:
+        return select_page(self.session, TableView, limit, after)
+
 
 class SqlModelRowsRepo:
-    def __init__(self, session: Session) -> None:
+    def __init__(self, session: Session, table_configs: TableConfigsRepo, archive: bool = False) -> None:
         self.session = session
+        # configs say which summaries rows count towards
+        self.table_configs = table_configs
+        # whether the session has the archive attached; see data_collection.archive
+        self.archive_enabled = archive
+
+    def find_table_configs(self, rows: Sequence[Row]) -> dict[int, TableConfig]:
+        # rows outliving their config are left out
+        table_configs = {}
+        for table_config_id in {row.table_config_id for row in rows}:
+            try:
+                table_configs[table_config_id] = self.table_configs.get_by_id(table_config_id)
+            except EntityNotFound:
+                pass
+        return table_configs
+
+    def rehydrate(self, rows: list[Row]) -> list[Row]:
+        """Turn rows stored positionally back into objects."""
+        positional = [row for row in rows if isinstance(row.data, list)]
+        table_configs = self.find_table_configs(positional)
+        for row in positional:
+            if row.table_config_id in table_configs:
+                # the rows are detached; assigning through SQLModel would
+                # validate and track a change nobody will flush
+                set_committed_value(
+                    row, "data", decode_data(table_configs[row.table_config_id], row.data)
+                )
+        return rows
+
+    def update_derived(self, rows: Sequence[Row], ids: Sequence[int], sign: int) -> None:
+        """Keep the summaries and the search index in step with rows added
+        (sign 1) or deleted (-1)."""
+        by_table_config: dict[int, list] = {}
+        for row, row_id in zip(rows, ids):
+            by_table_config.setdefault(row.table_config_id, []).append((row_id, row.data))
+        for table_config_id, table_config in self.find_table_configs(rows).items():
+            decoded = [
+                (row_id, decode_data(table_config, stored))
+                for row_id, stored in by_table_config[table_config_id]
+            ]
+            update_summaries(self.session, table_config, [data for _, data in decoded], sign)
+            if sign > 0:
+                index_rows(self.session, table_config, decoded)
+            else:
+                unindex_rows(self.session, table_config, decoded)
+
+    def first_id(self) -> Optional[int]:
+        """The id to insert the next row with, if SQLite would hand out an archived one."""
+        if not self.archive_enabled:
+            return None
+        last_id = last_archived_id(self.session)
+        return None if last_id is None else last_id + 1
 
     def add(self, row: Row) -> Row:
+        table_config = self.find_table_configs([row]).get(row.table_config_id)
+        if table_config is not None:
+            row.data = encode_data(table_config, row.data)
+        row.id = self.first_id()
         self.session.add(row)
-        self.session.commit()
-        self.session.refresh(row)
+        with key_conflicts():
+            self.session.flush()
+        self.update_derived([row], [row.id], 1)
+        record_changes(self.session, ChangedEntity.ROW, [row.id])
         self.session.expunge_all()
-        return row
+        return self.rehydrate([row])[0]
+
+    def add_many(self, rows: list[Row], chunk_size: int = 1000) -> list[int]:
+        # Core executemany: no per-row flush, refresh or identity map
+        # bookkeeping. SQLite hands out INTEGER PRIMARY KEYs as max(id) + 1
+        # and the transaction holds the write lock from the first chunk until
+        # commit, so each chunk's ids end at last_insert_rowid().
+        table_configs = self.find_table_configs(rows)
+        first_id = self.first_id()
+        ids = []
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            parameters = [
+                {
+                    "created_at": row.created_at,
+                    "table_config_id": row.table_config_id,
+                    "data": encode_data(table_configs[row.table_config_id], row.data)
+                    if row.table_config_id in table_configs else row.data,
+                }
+                for row in chunk
+            ]
+            with key_conflicts():
+                if first_id is not None:
+                    # SQLite carries on from the id the first row is given
+                    self.session.execute(insert(Row.__table__), [{**parameters[0], "id": first_id}])
+                    parameters = parameters[1:]
+                    first_id = None
+                if parameters:
+                    self.session.execute(insert(Row.__table__), parameters)
+            last_id = self.session.execute(select(func.last_insert_rowid())).scalar()
+            ids.extend(range(last_id - len(chunk) + 1, last_id + 1))
+        self.update_derived(rows, ids, 1)
+        record_changes(self.session, ChangedEntity.ROW, ids)
+        return ids
+
+    def upsert_many(self, rows: list[Row], chunk_size: int = 500) -> list[tuple[int, bool]]:
+        """Add rows, or replace the data of the row with the same natural key;
+        returns each row's id and whether it was added.
+
+        A row whose data is already the same is left alone. The rows being
+        replaced are read first, in the same transaction, to take them out
+        of the summaries and the search index.
+        """
+        table_configs = self.find_table_configs(rows)
+        if len(table_configs) < len({row.table_config_id for row in rows}):
+            raise EntityNotFound("table_config_id not found")
+        # the last of several rows with one key wins, as it would one at a time
+        keys = [
+            row_key(natural_key_columns(table_configs[row.table_config_id]), row.data)
+            for row in rows
+        ]
+        latest: dict[int, dict[tuple, Row]] = {}
+        for row, key in zip(rows, keys):
+            latest.setdefault(row.table_config_id, {})[key] = row
+        ids: dict[tuple[int, tuple], int] = {}
+        added, changed = set(), []
+        for table_config_id, keyed in latest.items():
+            table_config = table_configs[table_config_id]
+            columns = natural_key_columns(table_config)
+            items = list(keyed.items())
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start:start + chunk_size]
+                replaced = {
+                    row_key(columns, decode_data(table_config, row.data)): row
+                    for row in self.session.execute(
+                        key_lookup_statement(table_config, len(chunk)),
+                        key_parameters([key for key, _ in chunk]),
+                    )
+                }
+                first_id = self.first_id()
+                parameters = upsert_parameters([
+                    (
+                        None if first_id is None else first_id + i,
+                        row.created_at,
+                        encode_data(table_config, row.data),
+                    )
+                    for i, (_, row) in enumerate(chunk)
+                ])
+                # RETURNING gives no order, so rows are matched up by key
+                written = {
+                    tuple(result[1:]): result[0]
+                    for result in self.session.execute(
+                        upsert_statement(table_config, len(chunk)), parameters
+                    )
+                }
+                for key, _ in chunk:
+                    if key in replaced:
+                        ids[table_config_id, key] = replaced[key].id
+                    else:
+                        ids[table_config_id, key] = written[key]
+                        added.add(written[key])
+                old = [row for key, row in replaced.items() if key in written]
+                self.update_derived(old, [row.id for row in old], -1)
+                new = [(row, written[key]) for key, row in chunk if key in written]
+                self.update_derived([row for row, _ in new], [row_id for _, row_id in new], 1)
+                changed.extend(written.values())
+        record_changes(self.session, ChangedEntity.ROW, changed)
+        return created_first(
+            [ids[row.table_config_id, key] for row, key in zip(rows, keys)], added
+        )
+
+    def find_by_key(self, rows: Sequence[Row], chunk_size: int = 500) -> list[Optional[int]]:
+        """The id of the stored row with each row's natural key, if any."""
+        table_configs = self.find_table_configs(rows)
+        wanted: dict[int, set[tuple]] = {}
+        keys = []
+        for row in rows:
+            table_config = table_configs.get(row.table_config_id)
+            columns = natural_key_columns(table_config) if table_config is not None else []
+            key = row_key(columns, row.data)
+            # rows without every key column aren't kept unique
+            if not columns or None in key:
+                key = None
+            else:
+                wanted.setdefault(row.table_config_id, set()).add(key)
+            keys.append(key)
+        found: dict[tuple[int, tuple], int] = {}
+        for table_config_id, config_keys in wanted.items():
+            table_config = table_configs[table_config_id]
+            columns = natural_key_columns(table_config)
+            config_keys = list(config_keys)
+            for start in range(0, len(config_keys), chunk_size):
+                chunk = config_keys[start:start + chunk_size]
+                for row in self.session.execute(
+                    key_lookup_statement(table_config, len(chunk)), key_parameters(chunk)
+                ):
+                    key = row_key(columns, decode_data(table_config, row.data))
+                    found[table_config_id, key] = row.id
+        return [
+            None if key is None else found.get((row.table_config_id, key))
+            for row, key in zip(rows, keys)
+        ]
 
     def delete(self, row_id: int) -> None:
-        self.session.delete(self.get_by_id(row_id))
+        if not self.delete_many([row_id]):
+            raise EntityNotFound("row_id not found")
+
+    def delete_many(self, row_ids: Sequence[int], chunk_size: int = DELETE_CHUNK_SIZE) -> int:
+        """Delete rows by id in the current transaction; returns how many existed."""
+        deleted = 0
+        for start in range(0, len(row_ids), chunk_size):
+            chunk = row_ids[start:start + chunk_size]
+            rows = self.session.execute(DELETE_ROWS, {"ids": chunk}).all()
+            self.update_derived(rows, [row.id for row in rows], -1)
+            deleted_ids = {row.id for row in rows}
+            if self.archive_enabled:
+                deleted_ids.update(delete_archived(self.session, chunk))
+            record_changes(self.session, ChangedEntity.ROW, sorted(deleted_ids), deleted=True)
+            deleted += len(deleted_ids)
+        return deleted
+
+    def delete_where(
+        self,
+        table_config_id: Optional[int] = None,
+        created_before: Optional[datetime] = None,
+        filters: Sequence[RowFilter] = (),
+        chunk_size: int = DELETE_CHUNK_SIZE,
+    ) -> int:
+        """Delete the matching rows, committing after every chunk_size of them.
+
+        Other writers get the database between chunks rather than waiting
+        for the whole delete; if it fails, earlier chunks stay deleted.
+        """
+        criteria = []
+        if filters:
+            criteria = row_filter_criteria(table_config_id, filters)
+        elif table_config_id is not None:
+            criteria.append(Row.table_config_id == table_config_id)
+        if created_before is not None:
+            criteria.append(Row.created_at < created_before)
+        statement = select(Row.id).where(*criteria).order_by(Row.id).limit(chunk_size)
+        deleted = 0
+        while True:
+            row_ids = list(self.session.execute(statement).scalars())
+            deleted += self.delete_many(row_ids, chunk_size)
+            self.session.commit()
+            if len(row_ids) < chunk_size:
+                break
+        if self.archive_enabled:
+            deleted += self.delete_archived_where(table_config_id, created_before, filters, chunk_size)
+        return deleted
+
+    def delete_archived_where(
+        self,
+        table_config_id: Optional[int],
+        created_before: Optional[datetime],
+        filters: Sequence[RowFilter],
+        chunk_size: int,
+    ) -> int:
+        # filters are applied to the rows as decoded from their segments
+        deleted, after = 0, 0
+        while True:
+            row_ids = archived_ids_where(
+                self.session, table_config_id, created_before, after, chunk_size
+            )
+            if not row_ids:
+                return deleted
+            after = row_ids[-1]
+            if filters:
+                rows = self.rehydrate(list(get_archived(self.session, row_ids).values()))
+                row_ids = [row.id for row in rows if matches(row.data, filters)]
+            row_ids = delete_archived(self.session, row_ids)
+            record_changes(self.session, ChangedEntity.ROW, row_ids, deleted=True)
+            self.session.commit()
+            deleted += len(row_ids)
 
     def get_by_id(self, row_id: int) -> Row:
         row = self.session.get(Row, row_id)
         self.session.expunge_all()
+        if not row and self.archive_enabled:
+            row = get_archived(self.session, [row_id]).get(row_id)
         if not row:
             raise EntityNotFound("row_id not found")
-        return row
+        return self.rehydrate([row])[0]
+
+    def get_many(self, row_ids: Sequence[int]) -> dict[int, Row]:
+        rows = select_many(self.session, Row, row_ids)
+        if self.archive_enabled and len(rows) < len(set(row_ids)):
+            missing = [row_id for row_id in row_ids if row_id not in rows]
+            rows.update(get_archived(self.session, missing))
+        self.rehydrate(list(rows.values()))
+        return rows
 
     def all(self) -> list[Row]:
         statement = select(Row)
@@ -158,7 +731,138 @@ class SqlModelRowsRepo:
         self.session.expunge_all()
         if len(results) == 0:
             return []
-        return results
+        return self.rehydrate(results)
+
+    def page(
+        self,
+        limit: int,
+        after: Optional[int] = None,
+        table_config_id: Optional[int] = None,
+        filters: Sequence[RowFilter] = (),
+        include_archived: bool = False,
+    ) -> list[Row]:
+        """A page of rows by id; archived rows only without filters, which would
+        have to inflate segments until they found enough matches."""
+        criteria = []
+        if filters:
+            criteria = row_filter_criteria(table_config_id, filters)
+        elif table_config_id is not None:
+            criteria.append(Row.table_config_id == table_config_id)
+        rows = select_page(self.session, Row, limit, after, *criteria)
+        if include_archived and self.archive_enabled and not filters:
+            # the hot copy wins for rows caught in both mid-archival
+            merged = {row.id: row for row in page_archived(self.session, limit, after, table_config_id)}
+            merged.update((row.id, row) for row in rows)
+            rows = [merged[row_id] for row_id in sorted(merged)[:limit]]
+        return self.rehydrate(rows)
+
+    def search(
+        self,
+        query: str,
+        limit: int,
+        offset: int = 0,
+        table_config_id: Optional[int] = None,
+    ) -> list[Row]:
+        """Rows whose string columns have every word of query, best match first."""
+        statement = (
+            select(Row)
+            .join(ROW_FTS, ROW_FTS.c.rowid == Row.id)
+            .where(ROW_FTS_MATCH(match_query(query)))
+        )
+        if table_config_id is not None:
+            statement = statement.where(Row.table_config_id == table_config_id)
+        statement = statement.order_by(ROW_FTS.c.rank).limit(limit).offset(offset)
+        results = list(self.session.execute(statement).scalars())
+        self.session.expunge_all()
+        return self.rehydrate(results)
+
+    def export_batches(
+        self, table_config: TableConfig, batch_size: int, include_archived: bool = False
+    ) -> Iterator[Sequence[tuple]]:
+        # plain tuples straight off the cursor, batch_size at a time
+        statement = export_select(table_config).execution_options(
+            stream_results=True, yield_per=batch_size
+        )
+        batches = self.session.execute(statement).partitions(batch_size)
+        if not (include_archived and self.archive_enabled):
+            yield from batches
+            return
+        # archived rows are decoded in Python and merged in by id
+        converters = export_converters(table_config)
+        archived = (
+            export_values(converters, row.id, row.data)
+            for rows in archived_batches(self.session, table_config.id, batch_size)
+            for row in self.rehydrate(rows)
+        )
+        hot = (values for batch in batches for values in batch)
+        batch, last_id = [], None
+        for values in heapq.merge(hot, archived, key=itemgetter(0)):
+            if values[0] == last_id:
+                # in both mid-archival
+                continue
+            last_id = values[0]
+            batch.append(values)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def aggregate(self, table_config: TableConfig, aggregation: Aggregation) -> tuple[list[dict], bool]:
+        """The aggregation's groups, and whether they came from the running totals."""
+        if is_materialized(table_config, aggregation):
+            return read_summaries(self.session, table_config, aggregation), True
+        return aggregate_rows(self.session, table_config, aggregation), False
+
+    def archive(
+        self,
+        created_before: Optional[datetime] = None,
+        table_config_ids: Sequence[int] = (),
+        segment_rows: int = 1000,
+    ) -> int:
+        """Move rows created before created_before, or of the given configs,
+        into the archive; returns how many.
+
+        Each segment is committed to the archive before its rows leave the
+        hot table, the summaries and the search index, in a second commit.
+        """
+        criteria = []
+        if created_before is not None:
+            criteria.append(Row.created_at < created_before)
+        if table_config_ids:
+            criteria.append(Row.table_config_id.in_(table_config_ids))
+        if not criteria:
+            return 0
+        archivable = or_(*criteria)
+        table_config_ids = self.session.execute(
+            select(Row.table_config_id.distinct()).where(archivable)
+        ).scalars().all()
+        archived = 0
+        for table_config_id in table_config_ids:
+            after = 0
+            while True:
+                statement = (
+                    select(Row)
+                    .where(archivable, Row.table_config_id == table_config_id, Row.id > after)
+                    .order_by(Row.id)
+                    .limit(segment_rows)
+                )
+                rows = list(self.session.execute(statement).scalars())
+                self.session.expunge_all()
+                if not rows:
+                    break
+                after = rows[-1].id
+                # rows already archived by a run that stopped before deleting them
+                done = archived_ids(self.session, [row.id for row in rows])
+                new_rows = [row for row in rows if row.id not in done]
+                if new_rows:
+                    write_segment(self.session, table_config_id, new_rows)
+                    self.session.commit()
+                deleted = self.session.execute(DELETE_ROWS, {"ids": [row.id for row in rows]}).all()
+                self.update_derived(deleted, [row.id for row in deleted], -1)
+                self.session.commit()
+                archived += len(new_rows)
+        return archived
 
 
 class SqlModelUsersRepo:
@@ -167,13 +871,14 @@ class SqlModelUsersRepo:
 
     def add(self, user: User) -> User:
         self.session.add(user)
-        self.session.commit()
-        self.session.refresh(user)
+        self.session.flush()
         self.session.expunge_all()
         return user
 
     def delete(self, user_id: int) -> None:
-        self.session.delete(self.get_by_id(user_id))
+        result = self.session.execute(delete(User).where(User.id == user_id))
+        if not result.rowcount:
+            raise EntityNotFound("user_id not found")
 
     def get_by_id(self, user_id: int) -> User:
         user = self.session.get(User, user_id)
@@ -190,3 +895,49 @@ class SqlModelUsersRepo:
         if len(results) == 0:
             return []
         return results
+
+    def page(self, limit: int, after: Optional[int] = None) -> list[User]:
+        return select_page(self.session, User, limit, after)
+
+
+class SqlModelImportJobsRepo:
+    def __init__(self, session: Session) -> None:
+        self.session = session
+
+    def add(self, import_job: ImportJob) -> ImportJob:
+        self.session.add(import_job)
+        self.session.flush()
+        self.session.expunge_all()
+        return import_job
+
+    def update(self, import_job: ImportJob) -> None:
+        self.session.merge(import_job)
+        self.session.flush()
+        self.session.expunge_all()
+
+    def get_by_id(self, import_job_id: int) -> ImportJob:
+        import_job = self.session.get(ImportJob, import_job_id)
+        self.session.expunge_all()
+        if not import_job:
+            raise EntityNotFound("import_job_id not found")
+        return import_job
+
+    def find_active(self) -> list[ImportJob]:
+        import_jobs = self.session.exec(
+            select(ImportJob).where(ImportJob.status.in_(ACTIVE_IMPORT_STATUSES)).order_by(ImportJob.id)
+        ).all()
+        self.session.expunge_all()
+        return import_jobs
+
+
+class SqlModelChangesRepo:
+    def __init__(self, session: Session) -> None:
+        self.session = session
+
+    def page(self, limit: int, after: Optional[int] = None) -> list[Change]:
+        statement = select(Change)
+        if after is not None:
+            statement = statement.where(Change.seq > after)
+        results = list(self.session.execute(statement.order_by(Change.seq).limit(limit)).scalars())
+        self.session.expunge_all()
+        return results
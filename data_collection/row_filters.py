@@ -0,0 +1,162 @@
+"""Filtering rows on values inside Row.data.
+
+Columns marked ``"indexed": true`` in ``TableConfig.config_fields`` get a
+partial expression index per config::
+
+    CREATE INDEX ix_row_data_<config id>_<column> ON row
+        (json_extract(data, '$.<column>')) WHERE table_config_id + 0 = <config id>
+
+with a '$[<position>]' path instead for configs with positional storage.
+
+SQLite only picks an expression index when the query repeats the indexed
+expression verbatim, and a partial index when the query's WHERE clause
+repeats the index's. Both the JSON path and the config id are therefore
+inlined as literals rather than bound, which is safe because column names
+are restricted to identifiers and ids are ints. The "+ 0" stops the plain
+index on table_config_id from matching the same term; without statistics
+the planner otherwise prefers it to the far more selective JSON index.
+"""
+from typing import Any, NamedTuple, Sequence
+
+from sqlalchemy import func, literal_column, text
+from sqlmodel import Session
+
+from data_collection.exceptions import InvalidRowFilter, InvalidTableConfig
+from data_collection.models import Row, TableConfig
+from data_collection.storage import data_path, IDENTIFIER
+
+OPERATORS = {
+    "eq": lambda column, value: column == value,
+    "ne": lambda column, value: column != value,
+    "lt": lambda column, value: column < value,
+    "le": lambda column, value: column <= value,
+    "gt": lambda column, value: column > value,
+    "ge": lambda column, value: column >= value,
+    "in": lambda column, values: column.in_(values),
+}
+# the same comparisons on values in Python, minus their NULL handling
+PREDICATES = {
+    "eq": lambda value, other: value == other,
+    "ne": lambda value, other: value != other,
+    "lt": lambda value, other: value < other,
+    "le": lambda value, other: value <= other,
+    "gt": lambda value, other: value > other,
+    "ge": lambda value, other: value >= other,
+    "in": lambda value, others: value in others,
+}
+BOOLEANS = {"true": 1, "false": 0}
+
+
+class RowFilter(NamedTuple):
+    column: str
+    operator: str
+    value: Any
+    # where the column's value is in the config's stored rows
+    path: str
+
+
+def indexed_columns(table_config: TableConfig) -> list[str]:
+    columns = table_config.config_fields.get("columns", {})
+    names = [name for name, spec in columns.items() if spec.get("indexed")]
+    for name in names:
+        if not IDENTIFIER.fullmatch(name):
+            raise InvalidTableConfig(f"{name}: only identifier columns can be indexed")
+    return names
+
+
+def index_name(table_config_id: int, column: str) -> str:
+    return f"ix_row_data_{table_config_id}_{column}"
+
+
+def data_value(path: str):
+    return func.json_extract(Row.data, literal_column(f"'{path}'"))
+
+
+def in_table_config(table_config_id: int):
+    return Row.table_config_id + literal_column("0") == literal_column(
+        str(int(table_config_id))
+    )
+
+
+def create_row_indexes(session: Session, table_config: TableConfig) -> None:
+    for column in indexed_columns(table_config):
+        session.execute(
+            text(
+                f"CREATE INDEX IF NOT EXISTS {index_name(table_config.id, column)} "
+                f"ON row (json_extract(data, '{data_path(table_config, column)}')) "
+                f"WHERE table_config_id + 0 = {int(table_config.id)}"
+            )
+        )
+
+
+def drop_row_indexes(session: Session, table_config_id: int) -> None:
+    # GLOB rather than LIKE, where "_" would be a wildcard
+    names = session.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'index' AND name GLOB :pattern"),
+        {"pattern": f"{index_name(table_config_id, '')}*"},
+    ).scalars()
+    for name in list(names):
+        session.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def parse_value(column: str, type_name: str, raw: str) -> Any:
+    try:
+        if type_name == "int":
+            return int(raw)
+        if type_name == "float":
+            return float(raw)
+        if type_name == "bool":
+            # json_extract returns JSON booleans as 1 and 0
+            return BOOLEANS[raw.lower()]
+    except (KeyError, ValueError):
+        raise InvalidRowFilter(f"{column}: {raw!r} is not a valid {type_name}")
+    return raw
+
+
+def parse_row_filters(table_config: TableConfig, filters: list[str]) -> list[RowFilter]:
+    """Parse ``column:operator:value`` strings.
+
+    Values are typed by the column's declared type; ``in`` takes a comma
+    separated list.
+    """
+    columns = table_config.config_fields.get("columns", {})
+    row_filters = []
+    for raw_filter in filters:
+        try:
+            column, operator, raw = raw_filter.split(":", 2)
+        except ValueError:
+            raise InvalidRowFilter(f"{raw_filter!r} is not column:operator:value")
+        if column not in columns or not IDENTIFIER.fullmatch(column):
+            raise InvalidRowFilter(f"{column}: unknown column")
+        if operator not in OPERATORS:
+            raise InvalidRowFilter(f"{operator}: operator must be one of {list(OPERATORS)}")
+        type_name = columns[column].get("type")
+        if operator == "in":
+            value = [parse_value(column, type_name, item) for item in raw.split(",")]
+        else:
+            value = parse_value(column, type_name, raw)
+        row_filters.append(RowFilter(column, operator, value, data_path(table_config, column)))
+    return row_filters
+
+
+def row_filter_criteria(table_config_id: int, row_filters: list[RowFilter]) -> list:
+    criteria = [in_table_config(table_config_id)]
+    for row_filter in row_filters:
+        criteria.append(
+            OPERATORS[row_filter.operator](data_value(row_filter.path), row_filter.value)
+        )
+    return criteria
+
+
+def matches(data: dict, row_filters: Sequence[RowFilter]) -> bool:
+    for row_filter in row_filters:
+        value = data.get(row_filter.column)
+        # a comparison with NULL is never true in SQL
+        if value is None:
+            return False
+        try:
+            if not PREDICATES[row_filter.operator](value, row_filter.value):
+                return False
+        except TypeError:
+            return False
+    return True
@@ -0,0 +1,80 @@
+"""Full-text search over the string columns of rows.
+
+The ``row_fts`` FTS5 table holds one document per row, with the row's id
+as its rowid: the values of the row's config's ``str`` columns, one per
+line. It is contentless, so the text isn't stored a second time, and only
+the index and the sizes bm25 ranks by are kept. That means a row must be
+taken out with exactly the text it went in with, which the rows repo can
+always recompute: configs are never updated in place, and deleting rows
+hands back their data.
+
+Queries are lists of words, all of which must appear; a word ending in
+``*`` matches as a prefix. Words are quoted before they reach FTS5, so its
+operators and column filters can't be used, nor produce syntax errors.
+"""
+from typing import Iterable, Sequence, Union
+
+from sqlalchemy import column, DDL, event, literal_column, table, text
+from sqlalchemy.engine import Connection
+from sqlmodel import Session, SQLModel
+
+from data_collection.exceptions import InvalidSearch
+from data_collection.models import TableConfig
+
+CREATE_ROW_FTS = "CREATE VIRTUAL TABLE IF NOT EXISTS row_fts USING fts5(text, content='')"
+INDEX_ROW = text("INSERT INTO row_fts (rowid, text) VALUES (:id, :text)")
+UNINDEX_ROW = text("INSERT INTO row_fts (row_fts, rowid, text) VALUES ('delete', :id, :text)")
+ROW_FTS = table("row_fts", column("rowid"), column("rank"))
+ROW_FTS_MATCH = literal_column("row_fts").op("MATCH")
+
+# create_all can't make virtual tables itself
+event.listen(SQLModel.metadata, "after_create", DDL(CREATE_ROW_FTS))
+
+
+def string_columns(table_config: TableConfig) -> list[str]:
+    columns = table_config.config_fields.get("columns", {})
+    return [name for name, spec in columns.items() if spec.get("type") == "str"]
+
+
+def search_text(columns: Sequence[str], data: dict) -> str:
+    values = (data.get(name) for name in columns)
+    return "\n".join(value for value in values if isinstance(value, str) and value)
+
+
+def search_documents(table_config: TableConfig, rows: Iterable[tuple[int, dict]]) -> list[dict]:
+    """row_fts parameters for (id, data) pairs; rows without text have none."""
+    columns = string_columns(table_config)
+    if not columns:
+        return []
+    documents = []
+    for row_id, data in rows:
+        document = search_text(columns, data)
+        if document:
+            documents.append({"id": row_id, "text": document})
+    return documents
+
+
+def index_rows(session: Union[Session, Connection], table_config: TableConfig, rows: Iterable[tuple[int, dict]]) -> None:
+    documents = search_documents(table_config, rows)
+    if documents:
+        session.execute(INDEX_ROW, documents)
+
+
+def unindex_rows(session: Union[Session, Connection], table_config: TableConfig, rows: Iterable[tuple[int, dict]]) -> None:
+    documents = search_documents(table_config, rows)
+    if documents:
+        session.execute(UNINDEX_ROW, documents)
+
+
+def match_query(query: str) -> str:
+    """The FTS5 query for a list of words."""
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            quoted = '"' + word.replace('"', '""') + '"'
+            terms.append(quoted + "*" if prefix else quoted)
+    if not terms:
+        raise InvalidSearch("q must have at least one word")
+    return " AND ".join(terms)
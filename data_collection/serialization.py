@@ -0,0 +1,82 @@
+"""JSON responses for entities without FastAPI's re-validation.
+
+FastAPI validates whatever a handler returns against its response_model,
+copying every entity, and then walks the copies with jsonable_encoder
+before json.dumps. Entities coming out of the repos were validated on the
+way in, so EntityResponse reads their fields directly and encodes them in
+one pass, with orjson when it is installed.
+
+The body is byte for byte the one FastAPI's JSONResponse would send.
+orjson and the json module only disagree on floats beyond 1e16 or below
+1e-4, where json uses repr's ``1e+16`` and ``1e-05`` and orjson writes
+``1e16`` and ``0.00001``, so a body in which orjson wrote either form is
+encoded again with the json module.
+"""
+import json
+import re
+from datetime import datetime
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from sqlmodel import SQLModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# searched for as "e" then the preceding digit is checked, which is several
+# times faster than a pattern that starts with a character class; strings
+# that merely look like such floats only send the body down the slower path
+EXPONENT = re.compile(rb"e[-0-9]")
+DIGITS = b"0123456789"
+
+
+def has_orjson_only_float(body: bytes) -> bool:
+    if b"0.0000" in body:
+        return True
+    return any(body[match.start() - 1] in DIGITS for match in EXPONENT.finditer(body))
+
+
+def entity_fields(entity: SQLModel) -> dict:
+    # fields in declaration order, as SQLModel.dict() would give them
+    return {name: getattr(entity, name) for name in entity.__fields__}
+
+
+def encode_default(value: Any) -> Any:
+    if isinstance(value, SQLModel):
+        return entity_fields(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps_json(content: Any) -> bytes:
+    # the arguments JSONResponse.render passes
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+        default=encode_default,
+    ).encode("utf-8")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        try:
+            body = orjson.dumps(content, default=encode_default)
+        except orjson.JSONEncodeError:
+            # e.g. ints beyond 64 bits, which json handles
+            return dumps_json(content)
+        if not has_orjson_only_float(body):
+            return body
+    return dumps_json(content)
+
+
+class EntityResponse(JSONResponse):
+    """A JSONResponse that also takes entities and lists of them."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
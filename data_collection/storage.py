@@ -0,0 +1,69 @@
+"""How Row.data is laid out in the database.
+
+By default a row's data is stored as the JSON object it was posted as,
+which repeats every column name in every row. A config with
+``"storage": "positional"`` in its ``config_fields`` has its rows stored as
+JSON arrays instead, holding the values in the order of the config's
+``columns``, with null for a missing value and trailing nulls left off::
+
+    {"year": 2021, "crop_type": "corn", "tillage_depth": 3.5}  ->  [2021, "corn", 3.5]
+
+The config is the schema version: configs are never updated in place and
+can only be deleted once they have no rows, so a row's table_config_id
+always names the column order its array was written in. SQL reads values
+with ``json_extract`` either way, through a ``$[i]`` path rather than
+``$.name``. The rows repo turns arrays back into objects before rows leave
+it, so the API only ever sees objects; a null and a missing value read back
+the same, as a missing key.
+"""
+import re
+from typing import Any, Union
+
+from data_collection.exceptions import InvalidTableConfig
+from data_collection.models import TableConfig
+
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+OBJECT = "object"
+POSITIONAL = "positional"
+STORAGE_MODES = (OBJECT, POSITIONAL)
+
+
+def storage_mode(table_config: TableConfig) -> str:
+    mode = table_config.config_fields.get("storage", OBJECT)
+    if mode not in STORAGE_MODES:
+        raise InvalidTableConfig(f"config_fields.storage must be one of {list(STORAGE_MODES)}")
+    return mode
+
+
+def is_positional(table_config: TableConfig) -> bool:
+    return storage_mode(table_config) == POSITIONAL
+
+
+def data_path(table_config: TableConfig, column: str) -> str:
+    """The JSON path of a column's value within a stored row."""
+    if is_positional(table_config):
+        return f"$[{list(table_config.config_fields['columns']).index(column)}]"
+    if IDENTIFIER.fullmatch(column):
+        return f"$.{column}"
+    return f'$."{column}"'
+
+
+def encode_data(table_config: TableConfig, data: dict) -> Union[dict, list]:
+    if not is_positional(table_config):
+        return data
+    values = [data.get(name) for name in table_config.config_fields["columns"]]
+    while values and values[-1] is None:
+        values.pop()
+    return values
+
+
+def decode_data(table_config: TableConfig, stored: Any) -> dict:
+    # the stored value's shape says how it was written: objects are returned
+    # as they are
+    if not isinstance(stored, list):
+        return stored
+    return {
+        name: value
+        for name, value in zip(table_config.config_fields["columns"], stored)
+        if value is not None
+    }
@@ -1,10 +1,32 @@
+import os
+import weakref
 from abc import ABC, abstractmethod
+from typing import Optional
 
-from sqlmodel import create_engine, Session, SQLModel
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlmodel import create_engine, Session
 
-from config import settings
+from config import Settings, settings
 from data_collection import models  # noqa: F401
+from data_collection.archive import SCHEMA as ARCHIVE_SCHEMA
+from data_collection.cache import CatalogWatch, EntityCache
+from data_collection.memory import (
+    MemoryChangesRepo,
+    MemoryImportJobsRepo,
+    MemoryRowsRepo,
+    MemorySession,
+    MemoryStore,
+    MemoryTableConfigsRepo,
+    MemoryTableViewsRepo,
+    MemoryUsersRepo,
+)  # noqa: E133
 from data_collection.repos import (
+    ChangesRepo,
+    ImportJobsRepo,
+    SqlModelChangesRepo,
+    SqlModelImportJobsRepo,
     SqlModelUsersRepo,
     TableConfigsRepo,
     TableViewsRepo,
@@ -17,6 +39,8 @@ from data_collection.repos import (
 
 
 class UnitOfWork(ABC):
+    changes: ChangesRepo
+    import_jobs: ImportJobsRepo
     rows: RowsRepo
     table_configs: TableConfigsRepo
     table_views: TableViewsRepo
@@ -40,18 +64,104 @@ class UnitOfWork(ABC):
         raise NotImplementedError
 
 
+def set_sqlite_pragmas(settings: Settings, in_memory: bool):
+    pragmas = {
+        "synchronous": settings.db_synchronous,
+        "busy_timeout": settings.db_busy_timeout_ms,
+        # negative sizes are in KiB rather than pages
+        "cache_size": -settings.db_cache_size_kib,
+        "mmap_size": settings.db_mmap_size,
+    }
+    if not in_memory:
+        # in-memory databases only support the "memory" journal
+        pragmas["journal_mode"] = settings.db_journal_mode
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        if settings.archive_path is not None:
+            cursor.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (settings.archive_path,))
+            for name in ("journal_mode", "synchronous"):
+                if name in pragmas:
+                    cursor.execute(f"PRAGMA {ARCHIVE_SCHEMA}.{name} = {pragmas[name]}")
+        cursor.close()
+
+    return on_connect
+
+
+def create_db_engine(settings: Settings = settings) -> Engine:
+    sqlite_url = f"sqlite:///{settings.db_path}"
+    in_memory = settings.db_path == ":memory:"
+    # sessions are opened, used and closed on different threadpool threads
+    connect_args = {"check_same_thread": False}
+    if in_memory:
+        # every connection to :memory: is a new, empty database, so share one
+        pool_args = {"poolclass": StaticPool}
+    else:
+        pool_args = {
+            "poolclass": QueuePool,
+            "pool_size": settings.db_pool_size,
+            "max_overflow": settings.db_max_overflow,
+            "pool_timeout": settings.db_pool_timeout,
+        }
+    engine = create_engine(
+        sqlite_url, echo=settings.db_echo, connect_args=connect_args, **pool_args
+    )
+    event.listen(engine, "connect", set_sqlite_pragmas(settings, in_memory))
+    if not in_memory:
+        dispose_after_fork(engine)
+    return engine
+
+
+def dispose_after_fork(engine: Engine) -> None:
+    # a forked worker must not use the connections its parent opened; it
+    # gets an empty pool instead, leaving the parent's connections alone
+    engine_ref = weakref.ref(engine)
+
+    def after_fork():
+        engine = engine_ref()
+        if engine is not None:
+            engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=after_fork)
+
+
 class SqlModelUnitOfWork(UnitOfWork):
-    def __init__(self) -> None:
-        sqlite_url = f"sqlite:///{settings.db_path}"
-        self.engine = create_engine(sqlite_url, echo=True)
-        SQLModel.metadata.create_all(self.engine)
+    """A unit of work for a single request or job.
+
+    Instances hold one session and must not be shared between threads; the
+    engine they are created from is.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        table_configs_cache: Optional[EntityCache] = None,
+        table_views_cache: Optional[EntityCache] = None,
+        archive: bool = False,
+        catalog: Optional[CatalogWatch] = None,
+    ) -> None:
+        self.engine = engine
+        self.table_configs_cache = table_configs_cache
+        self.table_views_cache = table_views_cache
+        # whether the engine attaches the archive
+        self.archive = archive
+        # clears the caches when another process changed what they hold
+        self.catalog = catalog
 
     def __enter__(self):
         self.session = Session(self.engine)
-        self.rows = SqlModelRowsRepo(self.session)
-        self.table_configs = SqlModelTableConfigsRepo(self.session)
-        self.table_views = SqlModelTableViewsRepo(self.session)
+        if self.catalog is not None:
+            self.catalog.check(self.session)
+        self.table_configs = SqlModelTableConfigsRepo(
+            self.session, self.table_configs_cache, self.archive
+        )
+        self.rows = SqlModelRowsRepo(self.session, self.table_configs, self.archive)
+        self.table_views = SqlModelTableViewsRepo(self.session, self.table_views_cache)
         self.users = SqlModelUsersRepo(self.session)
+        self.import_jobs = SqlModelImportJobsRepo(self.session)
+        self.changes = SqlModelChangesRepo(self.session)
         return super().__enter__()
 
     def __exit__(self, *args):
@@ -63,3 +173,30 @@ class SqlModelUnitOfWork(UnitOfWork):
 
     def rollback(self):
         self.session.rollback()
+
+
+class InMemoryUnitOfWork(UnitOfWork):
+    """A unit of work against a MemoryStore; see data_collection.memory.
+
+    Like SqlModelUnitOfWork, instances must not be shared between threads
+    and the store they are created from is.
+    """
+
+    def __init__(self, store: MemoryStore) -> None:
+        self.store = store
+
+    def __enter__(self):
+        self.session = MemorySession(self.store)
+        self.table_configs = MemoryTableConfigsRepo(self.session)
+        self.rows = MemoryRowsRepo(self.session)
+        self.table_views = MemoryTableViewsRepo(self.session)
+        self.users = MemoryUsersRepo(self.session)
+        self.import_jobs = MemoryImportJobsRepo(self.session)
+        self.changes = MemoryChangesRepo(self.session)
+        return super().__enter__()
+
+    def _commit(self):
+        self.session.commit()
+
+    def rollback(self):
+        self.session.rollback()
@@ -0,0 +1,203 @@
+import operator
+import re
+from typing import Any, Iterable, Optional
+
+from data_collection.exceptions import (
+    EntityNotFound,
+    InvalidRows,
+    InvalidTableConfig,
+    InvalidTableView,
+)  # noqa: E133
+from data_collection.models import Row, TableConfig, TableView
+from data_collection.natural_keys import natural_key_columns
+from data_collection.unit_of_work import UnitOfWork
+
+# bool is a subclass of int, so types are matched exactly rather than with
+# isinstance to keep True out of int and float columns.
+COLUMN_TYPES = {
+    "int": (int,),
+    "float": (int, float),
+    "str": (str,),
+    "bool": (bool,),
+}
+BOUNDS = {
+    "gt": (operator.gt, "greater than"),
+    "ge": (operator.ge, "greater than or equal to"),
+    "lt": (operator.lt, "less than"),
+    "le": (operator.le, "less than or equal to"),
+}
+
+
+def compile_regex(column: str, pattern: Any) -> re.Pattern:
+    try:
+        return re.compile(pattern)
+    except (re.error, TypeError):
+        raise InvalidTableView(f"{column}: invalid validation_regex {pattern!r}")
+
+
+def view_columns(view_fields: dict) -> dict[str, dict]:
+    columns = view_fields.get("columns", {})
+    if not isinstance(columns, dict):
+        raise InvalidTableView("view_fields.columns must be an object")
+    for name, spec in columns.items():
+        if not isinstance(spec, dict):
+            raise InvalidTableView(f"{name}: column spec must be an object")
+    return columns
+
+
+def validate_view_fields(view_fields: dict) -> None:
+    for column, spec in view_columns(view_fields).items():
+        if "validation_regex" in spec:
+            compile_regex(column, spec["validation_regex"])
+
+
+class ColumnValidator:
+    __slots__ = ("name", "types", "required", "choices", "bounds", "patterns")
+
+    def __init__(self, name: str, spec: dict, patterns: list[re.Pattern]) -> None:
+        if not isinstance(spec, dict):
+            raise InvalidTableConfig(f"{name}: column spec must be an object")
+        type_name = spec.get("type")
+        if type_name not in COLUMN_TYPES:
+            raise InvalidTableConfig(f"{name}: unsupported type {type_name!r}")
+        self.name = name
+        self.types = COLUMN_TYPES[type_name]
+        self.required = bool(spec.get("required", False))
+        self.choices = None
+        if "choices" in spec:
+            choices = spec["choices"]
+            if not isinstance(choices, list) or not all(
+                type(choice) in self.types for choice in choices
+            ):
+                raise InvalidTableConfig(f"{name}: choices must be a list of {type_name}")
+            self.choices = frozenset(choices)
+        self.bounds = []
+        for key, (compare, description) in BOUNDS.items():
+            if key not in spec:
+                continue
+            if type_name not in ("int", "float") or type(spec[key]) not in (int, float):
+                raise InvalidTableConfig(f"{name}: {key} requires a numeric column and bound")
+            self.bounds.append((compare, spec[key], description))
+        self.patterns = list(patterns)
+        if "regex" in spec:
+            if type_name != "str":
+                raise InvalidTableConfig(f"{name}: regex requires a str column")
+            self.patterns.append(compile_regex(name, spec["regex"]))
+
+    def check(self, value: Any) -> Optional[str]:
+        if value is None:
+            return "field required" if self.required else None
+        if type(value) not in self.types:
+            return f"value is not a valid {self.types[-1].__name__}"
+        if self.choices is not None and value not in self.choices:
+            return f"value is not one of {sorted(self.choices)}"
+        for compare, bound, description in self.bounds:
+            if not compare(value, bound):
+                return f"value must be {description} {bound}"
+        for pattern in self.patterns:
+            if type(value) is str and not pattern.fullmatch(value):
+                return f"value does not match {pattern.pattern!r}"
+        return None
+
+
+class RowValidator:
+    """Checks Row.data against the columns declared in a TableConfig.
+
+    Everything that can be worked out from the config (types, picklists,
+    bounds, regexes from the config and its views) is compiled once here so
+    that validating a row is a dict walk.
+    """
+
+    def __init__(self, table_config: TableConfig, table_views: Iterable[TableView] = ()) -> None:
+        columns = table_config.config_fields.get("columns", {})
+        if not isinstance(columns, dict):
+            raise InvalidTableConfig("config_fields.columns must be an object")
+        patterns: dict[str, list[re.Pattern]] = {}
+        for table_view in table_views:
+            for name, spec in view_columns(table_view.view_fields).items():
+                if "validation_regex" in spec:
+                    patterns.setdefault(name, []).append(
+                        compile_regex(name, spec["validation_regex"])
+                    )
+        self.columns = [
+            ColumnValidator(name, spec, patterns.get(name, []))
+            for name, spec in columns.items()
+        ]
+        self.names = frozenset(columns)
+        self.key = frozenset(natural_key_columns(table_config))
+
+    def errors(self, data: dict, upsert: bool = False) -> list[tuple[str, str]]:
+        """Problems with data, by column; an upsert needs every key column."""
+        errors = [(key, "unknown column") for key in data if key not in self.names]
+        for column in self.columns:
+            value = data.get(column.name)
+            error = column.check(value)
+            if error is None and upsert and value is None and column.name in self.key:
+                error = "field required"
+            if error is not None:
+                errors.append((column.name, error))
+        return errors
+
+
+class RowValidatorCache:
+    """RowValidators keyed by table_config_id.
+
+    Callers must invalidate an id whenever its TableConfig or one of its
+    TableViews is created or deleted, as SQLite may hand a deleted id out
+    again; changes made by other processes clear it through a CatalogWatch.
+    """
+
+    def __init__(self) -> None:
+        self._validators: dict[int, RowValidator] = {}
+        self._generation = 0
+
+    def get(self, uow: UnitOfWork, table_config_id: int) -> RowValidator:
+        validator = self._validators.get(table_config_id)
+        if validator is None:
+            generation = self._generation
+            validator = RowValidator(
+                uow.table_configs.get_by_id(table_config_id),
+                uow.table_views.find_by_table_config_id(table_config_id),
+            )
+            # don't cache a validator built while an invalidation happened
+            if generation == self._generation:
+                self._validators[table_config_id] = validator
+        return validator
+
+    def invalidate(self, table_config_id: int) -> None:
+        self._generation += 1
+        self._validators.pop(table_config_id, None)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._validators.clear()
+
+    def validate(self, uow: UnitOfWork, rows: list[Row], upsert: bool = False) -> None:
+        errors = []
+        for index, row in enumerate(rows):
+            try:
+                validator = self.get(uow, row.table_config_id)
+            except EntityNotFound:
+                errors.append(
+                    {
+                        "loc": (index, "table_config_id"),
+                        "msg": "table_config_id not found",
+                        "type": "value_error.not_found",
+                    }
+                )
+                continue
+            if upsert and not validator.key:
+                errors.append(
+                    {
+                        "loc": (index, "table_config_id"),
+                        "msg": "table_config has no natural_key",
+                        "type": "value_error",
+                    }
+                )
+                continue
+            for column, msg in validator.errors(row.data, upsert):
+                errors.append(
+                    {"loc": (index, "data", column), "msg": msg, "type": "value_error"}
+                )
+        if errors:
+            raise InvalidRows(errors)
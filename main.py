@@ -1,38 +1,287 @@
-from fastapi import FastAPI, HTTPException, status
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import partial
+from typing import AsyncIterator, Optional
 
-from data_collection.exceptions import EntityNotFound
-from data_collection.models import User, Row, TableConfig, TableView
-from data_collection.unit_of_work import SqlModelUnitOfWork
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import parse_obj_as, ValidationError
+from sqlalchemy import inspect
 
-app = FastAPI()
+from config import settings
+from data_collection import migrations
+from data_collection.admission import Admission, Gate
+from data_collection.aggregation import parse_aggregation, summary_groupings
+from data_collection.archive import create_archive_tables
+from data_collection.cache import CatalogWatch, EntityCache
+from data_collection.constants import AccessKind, BatchEntity, BatchOp, ChangedEntity
+from data_collection.exceptions import (
+    AdmissionRejected,
+    EntityInUse,
+    EntityNotFound,
+    ExportUnavailable,
+    InvalidAggregation,
+    InvalidImport,
+    InvalidRowFilter,
+    InvalidRows,
+    InvalidSearch,
+    InvalidTableConfig,
+    InvalidTableView,
+    SearchUnavailable,
+)  # noqa: E133
+from data_collection.export import check_format, export_rows, ExportFormat, MEDIA_TYPES
+from data_collection.imports import (
+    fail_interrupted_imports,
+    import_format,
+    ImportWorker,
+    spool_path,
+)  # noqa: E133
+from data_collection.metrics import instrument_engine, Metrics, MetricsMiddleware
+from data_collection.models import (
+    Aggregate,
+    Batch,
+    BatchOperation,
+    BatchResults,
+    ChangeFeed,
+    DeletedRows,
+    ImportJob,
+    Lookup,
+    RenderedTableView,
+    Row,
+    RowIds,
+    RowLookup,
+    TableConfig,
+    TableConfigLookup,
+    TableView,
+    TableViewLookup,
+    UpsertedRows,
+    User,
+)  # noqa: E133
+from data_collection.natural_keys import natural_key_columns, row_key
+from data_collection.row_filters import indexed_columns, parse_row_filters
+from data_collection.serialization import EntityResponse
+from data_collection.memory import MemoryStore
+from data_collection.storage import storage_mode
+from data_collection.unit_of_work import (
+    create_db_engine,
+    InMemoryUnitOfWork,
+    SqlModelUnitOfWork,
+    UnitOfWork,
+)  # noqa: E133
+from data_collection.validation import (
+    RowValidator,
+    RowValidatorCache,
+    validate_view_fields,
+)  # noqa: E133
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson")
+READ_METHODS = ("GET", "HEAD")
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+app = FastAPI(default_response_class=EntityResponse)
+metrics = Metrics()
+app.add_middleware(MetricsMiddleware, metrics=metrics)
 
 
 @app.on_event("startup")
 async def startup_event():
-    global uow
-    uow = SqlModelUnitOfWork()
+    global engine, store, uow_factory, row_validators, import_worker, admission
+    # startup runs in each worker process, after any fork
+    row_validators = RowValidatorCache()
+    if settings.storage_backend == "memory":
+        store = MemoryStore(settings.memory_dir, settings.memory_snapshot_every)
+        uow_factory = partial(InMemoryUnitOfWork, store)
+    else:
+        engine = create_db_engine()
+        if settings.db_migrate:
+            migrations.migrate(engine)
+        else:
+            migrations.check(engine)
+        instrument_engine(engine)
+        archive = settings.archive_path is not None
+        if archive:
+            create_archive_tables(engine)
+        table_configs_cache = EntityCache(settings.entity_cache_size)
+        table_views_cache = EntityCache(settings.entity_cache_size)
+        catalog = CatalogWatch([table_configs_cache, table_views_cache, row_validators])
+        uow_factory = partial(
+            SqlModelUnitOfWork,
+            engine,
+            table_configs_cache,
+            table_views_cache,
+            archive,
+            catalog=catalog,
+        )
+    # with several workers, one starting can't tell another's running imports
+    # from interrupted ones; the migration run before them fails those
+    if settings.storage_backend == "memory" or settings.db_migrate:
+        fail_interrupted_imports(uow_factory(), settings.import_dir)
+    import_worker = ImportWorker(
+        uow_factory,
+        row_validators,
+        workers=settings.import_workers,
+        batch_size=settings.import_batch_size,
+    )
+    admission = None
+    if settings.admission_control:
+        admission = Admission({
+            AccessKind.READ: Gate(
+                settings.admission_read_limit, settings.admission_read_queue, settings.admission_timeout
+            ),
+            AccessKind.WRITE: Gate(
+                settings.admission_write_limit, settings.admission_write_queue, settings.admission_timeout
+            ),
+        })
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await run_in_threadpool(import_worker.shutdown)
+    if settings.storage_backend == "memory":
+        store.close()
+
+
+@asynccontextmanager
+async def admitted(kind: AccessKind) -> AsyncIterator[None]:
+    if admission is None:
+        yield
+        return
+    try:
+        await admission.acquire(kind)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"too many {kind.value} requests ({e.args[0].value}), try again later",
+            headers={"Retry-After": str(settings.admission_retry_after)},
+        )
+    try:
+        yield
+    finally:
+        admission.release(kind)
+
+
+async def get_uow(request: Request) -> AsyncIterator[UnitOfWork]:
+    # handlers enter the unit of work themselves so that its connection goes
+    # back to the pool before the response is serialized; the admission slot
+    # is held until the response is sent, which for exports is the last batch
+    kind = AccessKind.READ if request.method in READ_METHODS else AccessKind.WRITE
+    async with admitted(kind):
+        yield uow_factory()
+
+
+async def get_read_uow() -> AsyncIterator[UnitOfWork]:
+    # for POSTs that only read
+    async with admitted(AccessKind.READ):
+        yield uow_factory()
+
+
+def validate_rows(context, rows: list[Row], is_list: bool = True, upsert: bool = False) -> None:
+    try:
+        row_validators.validate(context, rows, upsert)
+    except InvalidRows as e:
+        # error locations start with the row's index in the list
+        skip = 0 if is_list else 1
+        raise RequestValidationError(
+            [{**error, "loc": ("body",) + error["loc"][skip:]} for error in e.errors]
+        )
+
+
+def paginate(
+    request: Request, entities: list, limit: int, offset: Optional[int] = None
+) -> EntityResponse:
+    # repos are asked for limit + 1 entities to tell whether a next page
+    # exists; pages come after the last id unless they're by offset
+    headers = {}
+    if len(entities) > limit:
+        entities = entities[:limit]
+        if offset is None:
+            url = request.url.include_query_params(after=entities[-1].id, limit=limit)
+        else:
+            url = request.url.include_query_params(offset=offset + limit, limit=limit)
+        headers["Link"] = f'<{url}>; rel="next"'
+    return EntityResponse(entities, headers=headers)
+
+
+Limit = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+IncludeArchived = Query(
+    default=False, description="also return rows moved to the archive, merged in by id"
+)
+RowFilters = Query(
+    default=[],
+    alias="filter",
+    description="column:operator:value, where operator is one of "
+    "eq, ne, lt, le, gt, ge or in (comma separated values)",
+)
+
+
+def entity_etag(entity) -> str:
+    # TableConfigs and TableViews (and their renders) are never updated in
+    # place, and an id that is reused after a delete comes with a new
+    # created_at
+    entity_id = tuple(inspect(type(entity)).primary_key_from_instance(entity))
+    identity = f"{type(entity).__name__}:{entity_id}:{entity.created_at.isoformat()}"
+    return '"' + hashlib.sha1(identity.encode()).hexdigest() + '"'
+
+
+def lookup_response(ids: list[int], entities: dict) -> EntityResponse:
+    # in request order; an id asked for twice is answered twice
+    return EntityResponse({
+        "found": [entities[entity_id] for entity_id in ids if entity_id in entities],
+        "missing": [entity_id for entity_id in ids if entity_id not in entities],
+    })
+
+
+def conditional_response(request: Request, entity) -> Response:
+    etag = entity_etag(entity)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if etag in tags or "*" in tags:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return EntityResponse(entity, headers=headers)
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    text = metrics.render()
+    if admission is not None:
+        text += admission.render()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 # User
 
 
 @app.get("/users", response_model=list[User])
-async def get_users():
+def get_users(
+    request: Request,
+    limit: int = Limit,
+    after: Optional[int] = None,
+    uow: UnitOfWork = Depends(get_uow),
+):
     with uow as context:
-        return context.users.all()
+        entities = context.users.page(limit + 1, after)
+    return paginate(request, entities, limit)
 
 
 @app.get("/users/{user_id}", response_model=User)
-async def get_user(user_id: int):
+def get_user(user_id: int, uow: UnitOfWork = Depends(get_uow)):
     with uow as context:
         try:
-            return context.users.get_by_id(user_id)
+            return EntityResponse(context.users.get_by_id(user_id))
         except EntityNotFound:
             raise HTTPException(status_code=404, detail="user_id not found")
 
 
 @app.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_user(user_id: int):
+def delete_user(user_id: int, uow: UnitOfWork = Depends(get_uow)):
     with uow as context:
         try:
             context.users.delete(user_id)
@@ -44,71 +293,234 @@ async def delete_user(user_id: int):
 
 
 @app.post("/users", status_code=status.HTTP_201_CREATED, response_model=User)
-async def create_user(user: User):
+def create_user(user: User, uow: UnitOfWork = Depends(get_uow)):
     with uow as context:
-        return context.users.add(user)
+        user = context.users.add(user)
+        context.commit()
+    return user
 
 
 # TableConfig
 
 
 @app.get("/table-configs", response_model=list[TableConfig])
-async def get_table_configs():
+def get_table_configs(
+    request: Request,
+    limit: int = Limit,
+    after: Optional[int] = None,
+    uow: UnitOfWork = Depends(get_uow),
+):
     with uow as context:
-        return context.table_configs.all()
+        entities = context.table_configs.page(limit + 1, after)
+    return paginate(request, entities, limit)
 
 
 @app.get("/table-configs/{table_config_id}", response_model=TableConfig)
-async def get_table_config(table_config_id: int):
+def get_table_config(
+    table_config_id: int,
+    request: Request,
+    uow: UnitOfWork = Depends(get_uow),
+):
     with uow as context:
         try:
-            return context.table_configs.get_by_id(table_config_id)
+            table_config = context.table_configs.get_by_id(table_config_id)
         except EntityNotFound:
             raise HTTPException(status_code=404, detail="table_config_id not found")
+    return conditional_response(request, table_config)
+
+
+@app.post("/table-configs/lookup", response_model=TableConfigLookup)
+def lookup_table_configs(lookup: Lookup, uow: UnitOfWork = Depends(get_read_uow)):
+    with uow as context:
+        entities = context.table_configs.get_many(lookup.ids)
+    return lookup_response(lookup.ids, entities)
 
 
 @app.delete("/table-configs/{table_config_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_table_config(table_config_id: int):
+def delete_table_config(
+    table_config_id: int,
+    cascade: bool = Query(
+        default=False,
+        description="also delete the config's rows and views; otherwise a config that "
+        "still has any is not deleted",
+    ),
+    uow: UnitOfWork = Depends(get_uow),
+):
     with uow as context:
         try:
+            if cascade:
+                context.table_configs.get_by_id(table_config_id)
+                # before anything is deleted, as the rows' chunks are committed
+                context.table_configs.check_deletable(table_config_id, cascade=True)
+                context.rows.delete_where(
+                    table_config_id=table_config_id, chunk_size=settings.delete_chunk_size
+                )
+                context.table_views.delete_by_table_config_id(table_config_id)
             context.table_configs.delete(table_config_id)
+            context.commit()
         except EntityNotFound:
             raise HTTPException(status_code=404, detail="table_config_id not found")
+        except EntityInUse as e:
+            raise HTTPException(status_code=409, detail=str(e))
         finally:
-            context.commit()
+            row_validators.invalidate(table_config_id)
     return
 
 
+def check_table_config(table_config: TableConfig) -> None:
+    RowValidator(table_config)
+    indexed_columns(table_config)
+    natural_key_columns(table_config)
+    summary_groupings(table_config)
+    storage_mode(table_config)
+
+
 @app.post(
     "/table-configs",
     status_code=status.HTTP_201_CREATED,
     response_model=TableConfig
     )
-async def create_table_config(table_config: TableConfig):
+def create_table_config(
+    table_config: TableConfig,
+    uow: UnitOfWork = Depends(get_uow),
+):
+    try:
+        check_table_config(table_config)
+    except InvalidTableConfig as e:
+        raise HTTPException(status_code=422, detail=str(e))
     with uow as context:
-        return context.table_configs.add(table_config)
+        table_config = context.table_configs.add(table_config)
+        context.commit()
+    row_validators.invalidate(table_config.id)
+    return table_config
+
+
+@app.get(
+    "/table-configs/{table_config_id}/export",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {media_type: {} for media_type in MEDIA_TYPES.values()}}
+    },
+    )
+def export_table_config_rows(
+    table_config_id: int,
+    format: ExportFormat = ExportFormat.CSV,
+    include_archived: bool = IncludeArchived,
+    uow: UnitOfWork = Depends(get_uow),
+):
+    try:
+        check_format(format)
+    except ExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    with uow as context:
+        try:
+            table_config = context.table_configs.get_by_id(table_config_id)
+        except EntityNotFound:
+            raise HTTPException(status_code=404, detail="table_config_id not found")
+
+    def stream():
+        # runs after the handler has returned, in its own session, which
+        # holds a pooled connection until the last batch is sent
+        with uow as context:
+            batches = context.rows.export_batches(
+                table_config, settings.export_batch_size, include_archived
+            )
+            yield from export_rows(table_config, batches, format)
+
+    filename = f"table_config_{table_config_id}.{format.value}"
+    return StreamingResponse(
+        stream(),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.get("/table-configs/{table_config_id}/aggregate", response_model=Aggregate)
+def aggregate_rows(
+    table_config_id: int,
+    group_by: list[str] = Query(default=[], description="columns to group rows by"),
+    metrics: list[str] = Query(
+        default=[],
+        alias="metric",
+        description="count, or sum, avg, min or max and a numeric column, e.g. avg:tillage_depth; "
+        "count if none are given",
+    ),
+    filters: list[str] = RowFilters,
+    uow: UnitOfWork = Depends(get_uow),
+):
+    with uow as context:
+        try:
+            table_config = context.table_configs.get_by_id(table_config_id)
+            aggregation = parse_aggregation(
+                table_config, group_by, metrics, parse_row_filters(table_config, filters)
+            )
+        except EntityNotFound:
+            raise HTTPException(status_code=404, detail="table_config_id not found")
+        except (InvalidAggregation, InvalidRowFilter) as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        groups, materialized = context.rows.aggregate(table_config, aggregation)
+    return EntityResponse(
+        Aggregate(
+            table_config_id=table_config_id,
+            group_by=group_by,
+            materialized=materialized,
+            groups=groups,
+        )
+    )
 
 
 # TableView
 
 
 @app.get("/table-views", response_model=list[TableView])
-async def get_table_views():
+def get_table_views(
+    request: Request,
+    limit: int = Limit,
+    after: Optional[int] = None,
+    uow: UnitOfWork = Depends(get_uow),
+):
     with uow as context:
-        return context.table_views.all()
+        entities = context.table_views.page(limit + 1, after)
+    return paginate(request, entities, limit)
 
 
 @app.get("/table-views/{table_view_id}", response_model=TableView)
-async def get_table_view(table_view_id: int):
+def get_table_view(
+    table_view_id: int,
+    request: Request,
+    uow: UnitOfWork = Depends(get_uow),
+):
     with uow as context:
         try:
-            return context.table_views.get_by_id(table_view_id)
+            table_view = context.table_views.get_by_id(table_view_id)
         except EntityNotFound:
             raise HTTPException(status_code=404, detail="table_view_id not found")
+    return conditional_response(request, table_view)
+
+
+@app.get("/table-views/{table_view_id}/render", response_model=RenderedTableView)
+def get_rendered_table_view(
+    table_view_id: int,
+    request: Request,
+    uow: UnitOfWork = Depends(get_uow),
+):
+    with uow as context:
+        try:
+            rendered = context.table_views.get_render(table_view_id)
+        except EntityNotFound:
+            raise HTTPException(status_code=404, detail="table_view_id not found")
+    return conditional_response(request, rendered)
+
+
+@app.post("/table-views/lookup", response_model=TableViewLookup)
+def lookup_table_views(lookup: Lookup, uow: UnitOfWork = Depends(get_read_uow)):
+    with uow as context:
+        entities = context.table_views.get_many(lookup.ids)
+    return lookup_response(lookup.ids, entities)
 
 
 @app.delete("/table-views/{table_view_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_table_view(table_view_id: int):
+def delete_table_view(table_view_id: int, uow: UnitOfWork = Depends(get_uow)):
     with uow as context:
         try:
             context.table_views.delete(table_view_id)
@@ -116,35 +528,139 @@ async def delete_table_view(table_view_id: int):
             raise HTTPException(status_code=404, detail="table_view_id not found")
         finally:
             context.commit()
+            row_validators.clear()
     return
 
 
 @app.post("/table-views", status_code=status.HTTP_201_CREATED, response_model=TableView)
-async def create_table_view(table_view: TableView):
+def create_table_view(table_view: TableView, uow: UnitOfWork = Depends(get_uow)):
+    try:
+        validate_view_fields(table_view.view_fields)
+    except InvalidTableView as e:
+        raise HTTPException(status_code=422, detail=str(e))
     with uow as context:
-        return context.table_views.add(table_view)
+        try:
+            table_view = context.table_views.add(table_view)
+            context.commit()
+        except EntityNotFound:
+            raise HTTPException(status_code=422, detail="table_config_id not found")
+        except InvalidTableView as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    row_validators.invalidate(table_view.table_config_id)
+    return table_view
 
 
 # Row
 
 
 @app.get("/rows", response_model=list[Row])
-async def get_rows():
+def get_rows(
+    request: Request,
+    limit: int = Limit,
+    after: Optional[int] = None,
+    table_config_id: Optional[int] = None,
+    filters: list[str] = RowFilters,
+    include_archived: bool = IncludeArchived,
+    uow: UnitOfWork = Depends(get_uow),
+):
+    if filters and include_archived:
+        raise HTTPException(status_code=422, detail="filter can't be combined with include_archived")
+    with uow as context:
+        row_filters = []
+        if filters:
+            if table_config_id is None:
+                raise HTTPException(status_code=422, detail="filter requires table_config_id")
+            try:
+                table_config = context.table_configs.get_by_id(table_config_id)
+                row_filters = parse_row_filters(table_config, filters)
+            except EntityNotFound:
+                raise HTTPException(status_code=422, detail="table_config_id not found")
+            except InvalidRowFilter as e:
+                raise HTTPException(status_code=422, detail=str(e))
+        rows = context.rows.page(
+            limit + 1,
+            after,
+            table_config_id=table_config_id,
+            filters=row_filters,
+            include_archived=include_archived,
+        )
+    return paginate(request, rows, limit)
+
+
+@app.get("/rows/search", response_model=list[Row])
+def search_rows(
+    request: Request,
+    q: str = Query(description="words the rows' str columns must all have; end one with * for a prefix"),
+    limit: int = Limit,
+    offset: int = Query(default=0, ge=0),
+    table_config_id: Optional[int] = None,
+    uow: UnitOfWork = Depends(get_uow),
+):
     with uow as context:
-        return context.rows.all()
+        try:
+            rows = context.rows.search(q, limit + 1, offset, table_config_id=table_config_id)
+        except InvalidSearch as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except SearchUnavailable as e:
+            raise HTTPException(status_code=501, detail=str(e))
+    return paginate(request, rows, limit, offset)
 
 
 @app.get("/rows/{row_id}", response_model=Row)
-async def get_row(row_id: int):
+def get_row(row_id: int, uow: UnitOfWork = Depends(get_uow)):
     with uow as context:
         try:
-            return context.rows.get_by_id(row_id)
+            return EntityResponse(context.rows.get_by_id(row_id))
         except EntityNotFound:
             raise HTTPException(status_code=404, detail="row_id not found")
 
 
+@app.post("/rows/lookup", response_model=RowLookup)
+def lookup_rows(lookup: Lookup, uow: UnitOfWork = Depends(get_read_uow)):
+    with uow as context:
+        entities = context.rows.get_many(lookup.ids)
+    return lookup_response(lookup.ids, entities)
+
+
+@app.delete("/rows", response_model=DeletedRows)
+def delete_rows(
+    table_config_id: Optional[int] = None,
+    created_before: Optional[datetime] = None,
+    filters: list[str] = RowFilters,
+    uow: UnitOfWork = Depends(get_uow),
+):
+    if table_config_id is None and created_before is None:
+        raise HTTPException(
+            status_code=422, detail="table_config_id or created_before is required"
+        )
+    with uow as context:
+        row_filters = []
+        if filters:
+            if table_config_id is None:
+                raise HTTPException(status_code=422, detail="filter requires table_config_id")
+            try:
+                table_config = context.table_configs.get_by_id(table_config_id)
+                row_filters = parse_row_filters(table_config, filters)
+            except EntityNotFound:
+                raise HTTPException(status_code=422, detail="table_config_id not found")
+            except InvalidRowFilter as e:
+                raise HTTPException(status_code=422, detail=str(e))
+        deleted = context.rows.delete_where(
+            table_config_id, created_before, row_filters, chunk_size=settings.delete_chunk_size
+        )
+    return DeletedRows(deleted=deleted)
+
+
+@app.post("/rows/delete", response_model=DeletedRows)
+def delete_rows_by_id(row_ids: RowIds, uow: UnitOfWork = Depends(get_uow)):
+    with uow as context:
+        deleted = context.rows.delete_many(row_ids.ids, chunk_size=settings.delete_chunk_size)
+        context.commit()
+    return DeletedRows(deleted=deleted)
+
+
 @app.delete("/rows/{row_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_row(row_id: int):
+def delete_row(row_id: int, uow: UnitOfWork = Depends(get_uow)):
     with uow as context:
         try:
             context.rows.delete(row_id)
@@ -156,6 +672,398 @@ async def delete_row(row_id: int):
 
 
 @app.post("/rows", status_code=status.HTTP_201_CREATED, response_model=Row)
-async def create_row(row: Row):
+def create_row(row: Row, uow: UnitOfWork = Depends(get_uow)):
     with uow as context:
-        return context.rows.add(row)
+        validate_rows(context, [row], is_list=False)
+        try:
+            row = context.rows.add(row)
+        except EntityInUse as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        context.commit()
+    return row
+
+
+@app.put(
+    "/rows",
+    response_model=Row,
+    responses={status.HTTP_201_CREATED: {"model": Row, "description": "Created"}},
+)
+def upsert_row(row: Row, uow: UnitOfWork = Depends(get_uow)):
+    """Create the row, or replace the data of the row with the same natural key."""
+    with uow as context:
+        validate_rows(context, [row], is_list=False, upsert=True)
+        [(row_id, created)] = context.rows.upsert_many([row])
+        row = context.rows.get_by_id(row_id)
+        context.commit()
+    return EntityResponse(row, status_code=201 if created else 200)
+
+
+async def read_rows(request: Request) -> list[Row]:
+    content_type = request.headers.get("content-type", "")
+    try:
+        if content_type.startswith(NDJSON_MEDIA_TYPES):
+            body = await request.body()
+            payload = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="request body is not valid JSON")
+    try:
+        return parse_obj_as(list[Row], payload)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body",) + error["loc"][1:]} for error in e.errors()]
+        )
+
+
+ROWS_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": {"type": "array", "items": {"$ref": "#/components/schemas/Row"}}
+            },
+            **{
+                media_type: {"schema": {"$ref": "#/components/schemas/Row"}}
+                for media_type in NDJSON_MEDIA_TYPES
+            },
+        },
+    }
+}
+
+
+@app.post(
+    "/rows/bulk",
+    status_code=status.HTTP_201_CREATED,
+    response_model=RowIds,
+    openapi_extra=ROWS_BODY,
+    )
+async def create_rows(rows: list[Row] = Depends(read_rows), uow: UnitOfWork = Depends(get_uow)):
+    # the body is read before a write slot is taken
+    return await run_in_threadpool(add_rows, uow, rows)
+
+
+def add_rows(uow: UnitOfWork, rows: list[Row]) -> RowIds:
+    with uow as context:
+        validate_rows(context, rows)
+        try:
+            ids = context.rows.add_many(rows)
+        except EntityInUse as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        context.commit()
+    return RowIds(ids=ids)
+
+
+@app.put("/rows/bulk", response_model=UpsertedRows, openapi_extra=ROWS_BODY)
+async def upsert_rows(rows: list[Row] = Depends(read_rows), uow: UnitOfWork = Depends(get_uow)):
+    """Create rows, or replace the data of the rows with the same natural keys."""
+    return await run_in_threadpool(put_rows, uow, rows)
+
+
+def put_rows(uow: UnitOfWork, rows: list[Row]) -> UpsertedRows:
+    with uow as context:
+        validate_rows(context, rows, upsert=True)
+        results = context.rows.upsert_many(rows)
+        context.commit()
+    return UpsertedRows(
+        ids=[row_id for row_id, _ in results], created=[created for _, created in results]
+    )
+
+
+# Import
+
+
+async def spool_upload(request: Request) -> str:
+    # chunk by chunk to a file, so the upload is never held in memory
+    file = tempfile.NamedTemporaryFile(dir=settings.import_dir, prefix="import-", delete=False)
+    try:
+        with file:
+            async for chunk in request.stream():
+                await run_in_threadpool(file.write, chunk)
+    except BaseException:
+        os.remove(file.name)
+        raise
+    return file.name
+
+
+def find_table_config(uow: UnitOfWork, table_config_id: int) -> TableConfig:
+    with uow as context:
+        try:
+            return context.table_configs.get_by_id(table_config_id)
+        except EntityNotFound:
+            raise HTTPException(status_code=404, detail="table_config_id not found")
+
+
+def add_import_job(uow: UnitOfWork, import_job: ImportJob) -> ImportJob:
+    # the config may have gone while the upload was read
+    find_table_config(uow, import_job.table_config_id)
+    with uow as context:
+        import_job = context.import_jobs.add(import_job)
+        context.commit()
+    return import_job
+
+
+@app.post(
+    "/table-configs/{table_config_id}/imports",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=ImportJob,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                media_type: {"schema": {"type": "string", "format": "binary"}}
+                for media_type in ("text/csv", *NDJSON_MEDIA_TYPES)
+            },
+        }
+    },
+    )
+async def create_import_job(table_config_id: int, request: Request):
+    try:
+        upload_format = import_format(request.headers.get("content-type", ""))
+    except InvalidImport as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    # admitted for the database work only, not the upload, which can be slow
+    uow = uow_factory()
+    async with admitted(AccessKind.READ):
+        await run_in_threadpool(find_table_config, uow, table_config_id)
+    path = await spool_upload(request)
+    try:
+        async with admitted(AccessKind.WRITE):
+            import_job = await run_in_threadpool(
+                add_import_job, uow, ImportJob(table_config_id=table_config_id, format=upload_format)
+            )
+    except BaseException:
+        os.remove(path)
+        raise
+    # named after the job, for fail_interrupted_imports to find
+    job_path = spool_path(settings.import_dir, import_job.id)
+    os.replace(path, job_path)
+    import_worker.submit(import_job.id, job_path)
+    return EntityResponse(
+        import_job,
+        status_code=status.HTTP_202_ACCEPTED,
+        headers={"Location": f"/imports/{import_job.id}"},
+    )
+
+
+@app.get("/imports/{import_job_id}", response_model=ImportJob)
+def get_import_job(import_job_id: int, uow: UnitOfWork = Depends(get_uow)):
+    with uow as context:
+        try:
+            return EntityResponse(context.import_jobs.get_by_id(import_job_id))
+        except EntityNotFound:
+            raise HTTPException(status_code=404, detail="import_job_id not found")
+
+
+# Change
+
+
+@app.get("/changes", response_model=ChangeFeed)
+def get_changes(
+    since: int = Query(default=0, ge=0, description="cursor of the last page seen; 0 for everything"),
+    limit: int = Limit,
+    uow: UnitOfWork = Depends(get_uow),
+):
+    with uow as context:
+        changes = context.changes.page(limit + 1, since)
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        repos = {
+            ChangedEntity.ROW: context.rows,
+            ChangedEntity.TABLE_CONFIG: context.table_configs,
+            ChangedEntity.TABLE_VIEW: context.table_views,
+        }
+        values = {}
+        for entity, repo in repos.items():
+            ids = [change.entity_id for change in changes if change.entity == entity and not change.deleted]
+            values[entity] = repo.get_many(ids) if ids else {}
+    return EntityResponse({
+        "changes": [
+            {
+                "seq": change.seq,
+                "entity": change.entity,
+                "id": change.entity_id,
+                "deleted": change.deleted,
+                "value": values[change.entity].get(change.entity_id),
+            }
+            for change in changes
+        ],
+        "cursor": changes[-1].seq if changes else since,
+        "has_more": has_more,
+    })
+
+
+# Batch
+
+
+def batch_error(index: int, status_code: int, detail: str) -> HTTPException:
+    return HTTPException(status_code=status_code, detail=f"operations[{index}]: {detail}")
+
+
+def resolve_id(index: int, refs: dict[str, int], id) -> int:
+    if isinstance(id, str) and id.startswith("$"):
+        if id[1:] not in refs:
+            raise batch_error(index, 422, f"{id} is not the ref of an earlier create")
+        return refs[id[1:]]
+    if not isinstance(id, int) or isinstance(id, bool):
+        raise batch_error(index, 422, f"{id!r} is neither an id nor a $ref")
+    return id
+
+
+def parse_value(index: int, refs: dict[str, int], operation: BatchOperation):
+    model = BATCH_MODELS[operation.entity]
+    value = dict(operation.value or {})
+    if "table_config_id" in value:
+        value["table_config_id"] = resolve_id(index, refs, value["table_config_id"])
+    try:
+        return model.validate(value)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", "operations", index, "value") + error["loc"]} for error in e.errors()]
+        )
+
+
+def add_batch_rows(context, rows: list[tuple[int, Row]]) -> list[int]:
+    try:
+        row_validators.validate(context, [row for _, row in rows])
+    except InvalidRows as e:
+        raise RequestValidationError([
+            {**error, "loc": ("body", "operations", rows[error["loc"][0]][0], "value") + error["loc"][1:]}
+            for error in e.errors
+        ])
+    check_batch_keys(context, rows)
+    try:
+        return context.rows.add_many([row for _, row in rows])
+    except EntityInUse as e:
+        # the rows are inserted together; check_batch_keys found no clash
+        raise batch_error(rows[0][0], 409, str(e))
+
+
+def check_batch_keys(context, rows: list[tuple[int, Row]]) -> None:
+    """Fail on the first row whose natural key a stored or an earlier row has,
+    which add_many can't tell apart."""
+    stored = context.rows.find_by_key([row for _, row in rows])
+    seen = set()
+    for (index, row), row_id in zip(rows, stored):
+        columns = natural_key_columns(context.table_configs.get_by_id(row.table_config_id))
+        key = (row.table_config_id, row_key(columns, row.data))
+        if not columns or None in key[1]:
+            continue
+        if row_id is not None or key in seen:
+            raise batch_error(index, 409, "a row with the same natural_key exists; PUT upserts it")
+        seen.add(key)
+
+
+def create_entity(context, index: int, entity: BatchEntity, value) -> int:
+    if entity == BatchEntity.USER:
+        return context.users.add(value).id
+    if entity == BatchEntity.TABLE_CONFIG:
+        try:
+            check_table_config(value)
+        except InvalidTableConfig as e:
+            raise batch_error(index, 422, str(e))
+        return context.table_configs.add(value).id
+    try:
+        validate_view_fields(value.view_fields)
+        table_view = context.table_views.add(value)
+    except EntityNotFound:
+        raise batch_error(index, 422, "table_config_id not found")
+    except InvalidTableView as e:
+        raise batch_error(index, 422, str(e))
+    # rows later in the batch are validated against the view too
+    row_validators.invalidate(table_view.table_config_id)
+    return table_view.id
+
+
+def delete_entity(context, entity: BatchEntity, id: int) -> Optional[int]:
+    """Delete an entity; returns the table config whose validator it changes."""
+    if entity == BatchEntity.USER:
+        context.users.delete(id)
+    elif entity == BatchEntity.ROW:
+        context.rows.delete(id)
+    elif entity == BatchEntity.TABLE_CONFIG:
+        context.table_configs.delete(id)
+        return id
+    else:
+        table_config_id = context.table_views.get_by_id(id).table_config_id
+        context.table_views.delete(id)
+        return table_config_id
+    return None
+
+
+def run_batch(context, operations: list[BatchOperation], table_config_ids: set[int]) -> list[dict]:
+    refs: dict[str, int] = {}
+    results: list[dict] = []
+    # consecutive row creates are validated and inserted together
+    rows: list[tuple[int, Row]] = []
+
+    def add_rows():
+        ids = add_batch_rows(context, rows)
+        for (index, _), row_id in zip(rows, ids):
+            if operations[index].ref is not None:
+                refs[operations[index].ref] = row_id
+            results.append({"op": BatchOp.CREATE, "entity": BatchEntity.ROW, "id": row_id})
+        rows.clear()
+
+    for index, operation in enumerate(operations):
+        if operation.ref is not None:
+            if operation.op != BatchOp.CREATE:
+                raise batch_error(index, 422, "only creates take a ref")
+            if operation.ref in refs or any(operations[i].ref == operation.ref for i, _ in rows):
+                raise batch_error(index, 422, f"ref {operation.ref} is already taken")
+        if operation.op == BatchOp.CREATE:
+            value = parse_value(index, refs, operation)
+            if operation.entity == BatchEntity.ROW:
+                rows.append((index, value))
+                continue
+        if rows:
+            add_rows()
+        if operation.op == BatchOp.CREATE:
+            id = create_entity(context, index, operation.entity, value)
+            if operation.entity == BatchEntity.TABLE_CONFIG:
+                table_config_ids.add(id)
+            elif operation.entity == BatchEntity.TABLE_VIEW:
+                table_config_ids.add(value.table_config_id)
+            if operation.ref is not None:
+                refs[operation.ref] = id
+        else:
+            if operation.id is None:
+                raise batch_error(index, 422, "a delete needs an id")
+            id = resolve_id(index, refs, operation.id)
+            try:
+                table_config_id = delete_entity(context, operation.entity, id)
+            except EntityNotFound as e:
+                raise batch_error(index, 404, str(e))
+            except EntityInUse as e:
+                raise batch_error(index, 409, str(e))
+            if table_config_id is not None:
+                table_config_ids.add(table_config_id)
+                row_validators.invalidate(table_config_id)
+        results.append({"op": operation.op, "entity": operation.entity, "id": id})
+    if rows:
+        add_rows()
+    return results
+
+
+BATCH_MODELS = {
+    BatchEntity.USER: User,
+    BatchEntity.TABLE_CONFIG: TableConfig,
+    BatchEntity.TABLE_VIEW: TableView,
+    BatchEntity.ROW: Row,
+}
+
+
+@app.post("/batch", response_model=BatchResults)
+def create_batch(batch: Batch, uow: UnitOfWork = Depends(get_uow)):
+    """Run creates and deletes in order, in one transaction: all or none."""
+    table_config_ids: set[int] = set()
+    try:
+        with uow as context:
+            results = run_batch(context, batch.operations, table_config_ids)
+            context.commit()
+    finally:
+        # validators may have been built from configs and views that were
+        # rolled back
+        for table_config_id in table_config_ids:
+            row_validators.invalidate(table_config_id)
+    return EntityResponse({"results": results})
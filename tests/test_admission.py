@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from data_collection.admission import Admission, Gate
+from data_collection.constants import AccessKind, RejectReason
+from data_collection.exceptions import AdmissionRejected
+
+
+def test_gate_queue():
+    async def run():
+        gate = Gate(limit=1, queue_size=1, timeout=5)
+        assert await gate.acquire() == 0.0
+        waiter = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        assert len(gate.waiters) == 1
+        # the queue is full: turned away at once
+        with pytest.raises(AdmissionRejected):
+            await gate.acquire()
+        assert gate.rejected[RejectReason.QUEUE_FULL] == 1
+        gate.release()
+        assert await waiter > 0
+        assert (gate.active, len(gate.waiters)) == (1, 0)
+        gate.release()
+        assert gate.active == 0
+
+    asyncio.run(run())
+
+
+def test_gate_timeout_and_cancel():
+    async def run():
+        gate = Gate(limit=1, queue_size=2, timeout=0.01)
+        await gate.acquire()
+        with pytest.raises(AdmissionRejected):
+            await gate.acquire()
+        assert gate.rejected[RejectReason.TIMEOUT] == 1
+        assert len(gate.waiters) == 0
+
+        # a waiter cancelled as the slot is handed over doesn't keep it
+        gate.timeout = 5
+        waiter = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        gate.release()
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        else:
+            # wait_for may hand back the slot it got rather than be cancelled
+            gate.release()
+        assert (gate.active, len(gate.waiters)) == (0, 0)
+
+    asyncio.run(run())
+
+
+def test_render():
+    async def run():
+        admission = Admission({
+            AccessKind.READ: Gate(limit=2, queue_size=0, timeout=1),
+            AccessKind.WRITE: Gate(limit=1, queue_size=0, timeout=1),
+        })
+        await admission.acquire(AccessKind.WRITE)
+        with pytest.raises(AdmissionRejected):
+            await admission.acquire(AccessKind.WRITE)
+        return admission.render()
+
+    text = asyncio.run(run())
+    assert 'admission_in_flight{kind="write"} 1' in text
+    assert 'admission_limit{kind="read"} 2' in text
+    assert 'admission_rejected_total{kind="write",reason="queue_full"} 1' in text
+    assert 'admission_wait_seconds_count{kind="write"} 1' in text
@@ -0,0 +1,128 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+from config import Settings
+from data_collection import migrations
+from data_collection.aggregation import parse_aggregation
+from data_collection.archive import create_archive_tables, write_segment
+from data_collection.constants import TableConfigName
+from data_collection.exceptions import EntityInUse, EntityNotFound
+from data_collection.models import Row, TableConfig
+from data_collection.row_filters import parse_row_filters
+from data_collection.unit_of_work import create_db_engine, SqlModelUnitOfWork
+
+CONFIG_FIELDS = {
+    "columns": {"year": {"type": "int"}, "crop_type": {"type": "str"}},
+    "summaries": [["year"]],
+    "storage": "positional",
+}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    settings = Settings(db_path=str(tmp_path / "test.db"), archive_path=str(tmp_path / "archive.db"))
+    engine = create_db_engine(settings)
+    migrations.migrate(engine)
+    create_archive_tables(engine)
+    yield engine
+    engine.dispose()
+
+
+def fill(engine) -> TableConfig:
+    # rows 1-6 from 2020, 7-10 from 2024
+    with SqlModelUnitOfWork(engine, archive=True) as uow:
+        table_config = uow.table_configs.add(
+            TableConfig(name=TableConfigName.FARMING_PRACTICE_CONFIG, config_fields=CONFIG_FIELDS)
+        )
+        uow.rows.add_many([
+            Row(
+                table_config_id=table_config.id,
+                created_at=datetime(2020 if i < 6 else 2024, 1, 1),
+                data={"year": 2015 + i, "crop_type": "corn" if i % 2 else "wheat"},
+            )
+            for i in range(10)
+        ])
+        uow.commit()
+    return table_config
+
+
+def hot_ids(engine) -> list[int]:
+    with engine.connect() as connection:
+        return list(connection.execute(text("SELECT id FROM row ORDER BY id")).scalars())
+
+
+def test_archive_rows(engine):
+    table_config = fill(engine)
+    with SqlModelUnitOfWork(engine, archive=True) as uow:
+        assert uow.rows.archive(datetime(2021, 1, 1), segment_rows=4) == 6
+        assert uow.rows.archive(datetime(2021, 1, 1)) == 0
+    assert hot_ids(engine) == [7, 8, 9, 10]
+
+    with SqlModelUnitOfWork(engine, archive=True) as uow:
+        row = uow.rows.get_by_id(2)
+        assert (row.created_at, row.data) == (datetime(2020, 1, 1), {"year": 2016, "crop_type": "corn"})
+        assert sorted(uow.rows.get_many([1, 5, 8, 99])) == [1, 5, 8]
+        assert [row.id for row in uow.rows.page(100)] == [7, 8, 9, 10]
+        rows = uow.rows.page(3, 4, include_archived=True)
+        assert [(row.id, row.data["year"]) for row in rows] == [(5, 2019), (6, 2020), (7, 2021)]
+        batches = list(uow.rows.export_batches(table_config, 4, include_archived=True))
+        assert [len(batch) for batch in batches] == [4, 4, 2]
+        assert [values[0] for batch in batches for values in batch] == list(range(1, 11))
+        assert batches[0][1] == (2, 2016, "corn")
+        # archived rows left the summaries and the search index
+        groups, materialized = uow.rows.aggregate(
+            table_config, parse_aggregation(table_config, [], ["count"], [])
+        )
+        assert (groups, materialized) == ([{"count": 4}], True)
+        assert [row.id for row in uow.rows.search("wheat", 10)] == [7, 9]
+
+
+def test_archived_ids_not_reused(engine):
+    table_config = fill(engine)
+    with SqlModelUnitOfWork(engine, archive=True) as uow:
+        # a retired config takes the newest rows with it
+        assert uow.rows.archive(table_config_ids=[table_config.id]) == 10
+        assert hot_ids(engine) == []
+        row = uow.rows.add(Row(table_config_id=table_config.id, data={"year": 2030}))
+        assert row.id == 11
+        assert uow.rows.add_many([Row(table_config_id=table_config.id, data={})] * 2) == [12, 13]
+        uow.commit()
+        assert uow.rows.get_by_id(2).data["year"] == 2016
+
+
+def test_delete_archived(engine):
+    table_config = fill(engine)
+    with SqlModelUnitOfWork(engine, archive=True) as uow:
+        uow.rows.archive(datetime(2021, 1, 1), segment_rows=3)
+        uow.rows.delete(2)
+        assert uow.rows.delete_many([1, 3, 7, 42]) == 3
+        uow.commit()
+        with pytest.raises(EntityNotFound):
+            uow.rows.get_by_id(2)
+        # rows 1-3 were a segment of their own
+        with engine.connect() as connection:
+            assert connection.execute(text("SELECT count(*) FROM archive.row_segment")).scalar() == 1
+
+        filters = parse_row_filters(table_config, ["crop_type:eq:corn"])
+        assert uow.rows.delete_where(table_config.id, filters=filters) == 4
+        assert [row.id for row in uow.rows.page(10, include_archived=True)] == [5, 9]
+        with pytest.raises(EntityInUse):
+            uow.table_configs.delete(table_config.id)
+        assert uow.rows.delete_where(table_config.id) == 2
+        uow.table_configs.delete(table_config.id)
+        uow.commit()
+
+
+def test_archive_resumes(engine):
+    # a run that stopped between committing a segment and deleting its rows
+    fill(engine)
+    with SqlModelUnitOfWork(engine, archive=True) as uow:
+        rows = uow.rows.page(3)
+        write_segment(uow.session, rows[0].table_config_id, rows)
+        uow.commit()
+        assert [row.id for row in uow.rows.page(4, include_archived=True)] == [1, 2, 3, 4]
+        assert uow.rows.archive(datetime(2021, 1, 1)) == 3
+        assert hot_ids(engine) == [7, 8, 9, 10]
+        assert [row.id for row in uow.rows.page(100, include_archived=True)] == list(range(1, 11))
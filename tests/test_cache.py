@@ -0,0 +1,62 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from data_collection.cache import EntityCache
+
+
+def test_concurrent_misses_share_one_load():
+    cache = EntityCache()
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.05)
+        return "value"
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: cache.get_or_load(1, load), range(8)))
+    assert results == ["value"] * 8
+    assert len(calls) == 1
+
+
+def test_failed_loads_are_not_cached():
+    cache = EntityCache()
+
+    def load():
+        raise KeyError(1)
+
+    with pytest.raises(KeyError):
+        cache.get_or_load(1, load)
+    assert cache.get_or_load(1, lambda: "value") == "value"
+
+
+def test_invalidate_discards_load_in_flight():
+    cache = EntityCache()
+    started, release = threading.Event(), threading.Event()
+
+    def load():
+        started.set()
+        release.wait()
+        return "stale"
+
+    thread = threading.Thread(target=cache.get_or_load, args=(1, load))
+    thread.start()
+    started.wait()
+    cache.invalidate(1)
+    release.set()
+    thread.join()
+    assert cache.get_or_load(1, lambda: "fresh") == "fresh"
+
+
+def test_least_recently_used_is_evicted():
+    cache = EntityCache(maxsize=2)
+    cache.get_or_load(1, lambda: 1)
+    cache.get_or_load(2, lambda: 2)
+    cache.get_or_load(1, lambda: None)
+    cache.get_or_load(3, lambda: 3)
+    assert len(cache) == 2
+    assert cache.get_or_load(1, lambda: None) == 1
+    assert cache.get_or_load(2, lambda: None) is None
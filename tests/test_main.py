@@ -1,10 +1,25 @@
+import io
+import json
+import time
+
+import pytest
 from fastapi import status
 from fastapi.testclient import TestClient
-from data_collection.constants import TableConfigName, TableViewName
+from sqlalchemy import text
+from data_collection.constants import ImportFormat, TableConfigName, TableViewName
+from data_collection.imports import spool_path
+from data_collection.models import ImportJob
 
+import main
 from main import app
 
 
+@pytest.fixture(params=["sqlite", "memory"])
+def storage_backend(request, monkeypatch):
+    monkeypatch.setattr(main.settings, "storage_backend", request.param)
+    return request.param
+
+
 # users
 
 
@@ -31,6 +46,7 @@ def delete_user(client, user_id: int):
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
 
+@pytest.mark.usefixtures("storage_backend")
 def test_crud_users():
     with TestClient(app) as client:
         # expect nothing in fresh db
@@ -86,11 +102,12 @@ def get_table_config(client, table_config_id: int):
     return response.json()
 
 
-def delete_table_config(client, table_config_id: int):
-    response = client.delete(f"/table-configs/{table_config_id}")
+def delete_table_config(client, table_config_id: int, cascade: bool = False):
+    response = client.delete(f"/table-configs/{table_config_id}", params={"cascade": cascade})
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
 
+@pytest.mark.usefixtures("storage_backend")
 def test_crud_table_configs():
     with TestClient(app) as client:
         # expect nothing in fresh db
@@ -154,6 +171,7 @@ def delete_table_view(client, table_view_id: int):
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
 
+@pytest.mark.usefixtures("storage_backend")
 def test_crud_table_views():
     with TestClient(app) as client:
         # expect nothing in fresh db
@@ -219,6 +237,7 @@ def delete_row(client, row_id: int):
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
 
+@pytest.mark.usefixtures("storage_backend")
 def test_crud_rows():
     with TestClient(app) as client:
         # expect nothing in fresh db
@@ -246,3 +265,1059 @@ def test_crud_rows():
         response = delete_row(client, row_id=row_id)
         response = get_all_rows(client)
         assert len(response) == 0
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_upsert_rows():
+    with TestClient(app) as client:
+        data = {
+            "name": TableConfigName.FARMING_PRACTICE_CONFIG,
+            "config_fields": {
+                "columns": {
+                    "external_account_id": {"type": "str"},
+                    "year": {"type": "int"},
+                    "crop_type": {"type": "str"},
+                },
+                "natural_key": ["external_account_id", "year"],
+                "summaries": [["year"]],
+                "storage": "positional",
+            },
+        }
+        for natural_key in (["tillage_depth"], ["year", "year"], "year"):
+            response = client.post(
+                "/table-configs",
+                json={**data, "config_fields": {**data["config_fields"], "natural_key": natural_key}},
+            )
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        response = client.post("/table-configs", json=data)
+        assert response.status_code == status.HTTP_201_CREATED
+        table_config_id = response.json()["id"]
+
+        def row(year, crop_type, account="AB1"):
+            data = {"external_account_id": account, "year": year, "crop_type": crop_type}
+            return {"table_config_id": table_config_id, "data": data}
+
+        response = client.put("/rows", json=row(2020, "corn"))
+        assert response.status_code == status.HTTP_201_CREATED
+        row_id = response.json()["id"]
+        cursor = client.get("/changes").json()["cursor"]
+        # a resubmit changes nothing, a changed form replaces the data
+        for crop_type in ("corn", "wheat"):
+            response = client.put("/rows", json=row(2020, crop_type))
+            assert response.status_code == status.HTTP_200_OK
+            assert (response.json()["id"], response.json()["data"]["crop_type"]) == (row_id, crop_type)
+            changes = client.get("/changes", params={"since": cursor}).json()["changes"]
+            assert [change["id"] for change in changes] == ([] if crop_type == "corn" else [row_id])
+        response = client.post("/rows", json=row(2020, "hops"))
+        assert response.status_code == status.HTTP_409_CONFLICT
+        response = client.post("/rows/bulk", json=[row(2021, "rye"), row(2020, "hops")])
+        assert response.status_code == status.HTTP_409_CONFLICT
+
+        response = client.put(
+            "/rows/bulk",
+            json=[row(2020, "wheat"), row(2021, "rye"), row(2020, "oats", "CD2"), row(2021, "barley")],
+        )
+        assert response.status_code == status.HTTP_200_OK
+        ids, created = response.json()["ids"], response.json()["created"]
+        assert ids[0] == row_id and ids[1] == ids[3] and len(set(ids)) == 3
+        assert created == [False, True, True, False]
+        rows = client.get("/rows").json()
+        assert [(row["id"], row["data"]["crop_type"]) for row in rows] == [
+            (row_id, "wheat"), (ids[1], "barley"), (ids[2], "oats")
+        ]
+        response = client.get(
+            f"/table-configs/{table_config_id}/aggregate", params={"group_by": "year", "metric": "count"}
+        )
+        assert response.json()["groups"] == [{"year": 2020, "count": 2}, {"year": 2021, "count": 1}]
+        # a key repeated in one body is created once and replaced after
+        response = client.put("/rows/bulk", json=[row(2022, crop_type) for crop_type in ("a", "b", "c")])
+        assert response.status_code == status.HTTP_200_OK
+        ids, created = response.json()["ids"], response.json()["created"]
+        assert len(set(ids)) == 1 and created == [True, False, False]
+        assert get_row(client, ids[0])["data"]["crop_type"] == "c"
+
+        response = client.put("/rows", json={"table_config_id": table_config_id, "data": {"year": 2022}})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert response.json()["detail"][0]["loc"] == ["body", "data", "external_account_id"]
+        delete_table_config(client, table_config_id, cascade=True)
+        table_config_id = create_table_config(client)["id"]
+        response = client.put("/rows/bulk", json=[{"table_config_id": table_config_id, "data": {}}])
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert response.json()["detail"][0]["loc"] == ["body", 0, "table_config_id"]
+
+
+def create_rows(client, table_config_id, count: int) -> dict:
+    data = [
+        {"table_config_id": table_config_id, "data": {"year": 2000 + i, "is_tilled": False}}
+        for i in range(count)
+    ]
+    response = client.post("/rows/bulk", json=data)
+    assert response.status_code == status.HTTP_201_CREATED
+    return response.json()
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_bulk_rows():
+    with TestClient(app) as client:
+        response = create_table_config(client)
+        table_config_id = response["id"]
+        # json array body
+        response = create_rows(client, table_config_id, count=3)
+        assert len(response["ids"]) == 3
+        for i, row_id in enumerate(response["ids"]):
+            assert get_row(client, row_id)["data"]["year"] == 2000 + i
+        # ndjson body
+        body = "\n".join(
+            json.dumps({"table_config_id": table_config_id, "data": {"year": year}})
+            for year in (2020, 2021)
+        )
+        response = client.post(
+            "/rows/bulk", content=body, headers={"content-type": "application/x-ndjson"}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        ids = response.json()["ids"]
+        assert [get_row(client, row_id)["data"]["year"] for row_id in ids] == [2020, 2021]
+        assert len(get_all_rows(client)) == 5
+        # invalid entries reject the whole batch
+        response = client.post("/rows/bulk", json=[{"data": {}}])
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert len(get_all_rows(client)) == 5
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_row_validation():
+    with TestClient(app) as client:
+        data = {
+            "name": TableConfigName.FARMING_PRACTICE_CONFIG,
+            "config_fields": {
+                "columns": {
+                    "year": {"type": "int", "required": True, "ge": 1900},
+                    "crop_type": {"type": "str", "choices": ["corn", "wheat"]},
+                    "tillage_depth": {"type": "float", "ge": 0, "lt": 10},
+                    "is_tilled": {"type": "bool"},
+                    "external_account_id": {"type": "str"},
+                }
+            },
+        }
+        response = client.post("/table-configs", json=data)
+        assert response.status_code == status.HTTP_201_CREATED
+        table_config_id = response.json()["id"]
+
+        def post_row(row_data: dict):
+            return client.post(
+                "/rows", json={"table_config_id": table_config_id, "data": row_data}
+            )
+
+        response = post_row({"year": 2021, "crop_type": "corn", "tillage_depth": 9.5})
+        assert response.status_code == status.HTTP_201_CREATED
+        response = post_row({"crop_type": "hops", "tillage_depth": 10, "foo": 1})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        locs = {tuple(error["loc"]) for error in response.json()["detail"]}
+        assert locs == {
+            ("body", "data", "foo"),
+            ("body", "data", "year"),
+            ("body", "data", "crop_type"),
+            ("body", "data", "tillage_depth"),
+        }
+        response = post_row({"year": True})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        # regexes on views apply once the view exists
+        view = create_table_view(client, table_config_id)
+        response = post_row({"year": 2021, "external_account_id": "ABC"})
+        assert response.status_code == status.HTTP_201_CREATED
+        delete_table_view(client, view["id"])
+        view_data = {
+            "name": TableViewName.FARMING_PRACTICE_TYPICAL_VIEW,
+            "table_config_id": table_config_id,
+            "view_fields": {"columns": {"external_account_id": {"validation_regex": "[0-9]+"}}},
+        }
+        response = client.post("/table-views", json=view_data)
+        assert response.status_code == status.HTTP_201_CREATED
+        response = post_row({"year": 2021, "external_account_id": "ABC"})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        # bulk inserts report the index of the offending row
+        response = client.post(
+            "/rows/bulk",
+            json=[
+                {"table_config_id": table_config_id, "data": {"year": 2020}},
+                {"table_config_id": table_config_id + 1, "data": {"year": 2020}},
+            ],
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert response.json()["detail"][0]["loc"] == ["body", 1, "table_config_id"]
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_invalid_table_config():
+    with TestClient(app) as client:
+        data = {
+            "name": TableConfigName.FARMING_PRACTICE_CONFIG,
+            "config_fields": {"columns": {"year": {"type": "date"}}},
+        }
+        response = client.post("/table-configs", json=data)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        data["config_fields"] = {"columns": {"year": {"type": "int"}}, "summaries": [["crop_type"]]}
+        response = client.post("/table-configs", json=data)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert len(get_all_table_configs(client)) == 0
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_paginate_rows():
+    with TestClient(app) as client:
+        table_config_id = create_table_config(client)["id"]
+        ids = create_rows(client, table_config_id, count=5)["ids"]
+        response = client.get("/rows", params={"limit": 2})
+        assert response.status_code == status.HTTP_200_OK
+        assert [row["id"] for row in response.json()] == ids[:2]
+        seen = []
+        url = f"/rows?table_config_id={table_config_id}&limit=2"
+        while url:
+            response = client.get(url)
+            seen += [row["id"] for row in response.json()]
+            url = response.links.get("next", {}).get("url")
+        assert seen == ids
+        response = client.get("/rows", params={"after": ids[2]})
+        assert [row["id"] for row in response.json()] == ids[3:]
+        assert "link" not in response.headers
+        response = client.get("/rows", params={"table_config_id": table_config_id + 1})
+        assert response.json() == []
+        response = client.get("/rows", params={"limit": 0})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_filter_rows():
+    with TestClient(app) as client:
+        data = {
+            "name": TableConfigName.FARMING_PRACTICE_CONFIG,
+            "config_fields": {
+                "columns": {
+                    "year": {"type": "int", "indexed": True},
+                    "crop_type": {"type": "str", "indexed": True},
+                    "tillage_depth": {"type": "float"},
+                    "is_tilled": {"type": "bool"},
+                }
+            },
+        }
+        response = client.post("/table-configs", json=data)
+        assert response.status_code == status.HTTP_201_CREATED
+        table_config_id = response.json()["id"]
+        rows = [
+            {"year": year, "crop_type": crop, "tillage_depth": depth, "is_tilled": depth > 0}
+            for year, crop, depth in [
+                (2020, "corn", 0.0), (2021, "corn", 2.5), (2021, "wheat", 5.0), (2022, "hops", 7.5)
+            ]
+        ]
+        response = client.post(
+            "/rows/bulk",
+            json=[{"table_config_id": table_config_id, "data": row} for row in rows],
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+        def filter_rows(*filters):
+            response = client.get(
+                "/rows", params={"table_config_id": table_config_id, "filter": filters}
+            )
+            assert response.status_code == status.HTTP_200_OK
+            return [(row["data"]["year"], row["data"]["crop_type"]) for row in response.json()]
+
+        assert filter_rows("year:eq:2021", "crop_type:eq:corn") == [(2021, "corn")]
+        assert filter_rows("year:ge:2021", "year:lt:2022") == [(2021, "corn"), (2021, "wheat")]
+        assert filter_rows("crop_type:in:hops,wheat") == [(2021, "wheat"), (2022, "hops")]
+        assert filter_rows("tillage_depth:gt:4") == [(2021, "wheat"), (2022, "hops")]
+        assert filter_rows("is_tilled:eq:false") == [(2020, "corn")]
+        for bad_filter in ("year:eq:twenty", "foo:eq:1", "year:like:2", "year"):
+            response = client.get(
+                "/rows", params={"table_config_id": table_config_id, "filter": bad_filter}
+            )
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        response = client.get("/rows", params={"filter": "year:eq:2021"})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+        with main.engine.connect() as connection:
+            plan = connection.execute(
+                text(
+                    "EXPLAIN QUERY PLAN SELECT id FROM row "
+                    f"WHERE table_config_id + 0 = {table_config_id} "
+                    "AND json_extract(row.data, '$.year') IN (2021, 2022)"
+                )
+            ).all()
+            assert f"ix_row_data_{table_config_id}_year" in str(plan)
+            delete_table_config(client, table_config_id, cascade=True)
+            indexes = connection.execute(
+                text("SELECT name FROM sqlite_master WHERE name GLOB 'ix_row_data_*'")
+            ).all()
+            assert indexes == []
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_search_rows(storage_backend):
+    with TestClient(app) as client:
+        data = {
+            "name": TableConfigName.FARMING_PRACTICE_CONFIG,
+            "config_fields": {
+                "columns": {
+                    "year": {"type": "int"},
+                    "crop_type": {"type": "str"},
+                    "comments": {"type": "str"},
+                }
+            },
+        }
+        response = client.post("/table-configs", json=data)
+        assert response.status_code == status.HTTP_201_CREATED
+        table_config_id = response.json()["id"]
+
+        def search(q, **params):
+            return client.get(
+                "/rows/search", params={"q": q, "table_config_id": table_config_id, **params}
+            )
+
+        if storage_backend == "memory":
+            assert search("corn").status_code == status.HTTP_501_NOT_IMPLEMENTED
+            delete_table_config(client, table_config_id)
+            return
+
+        rows = [
+            {"year": 2020, "crop_type": "corn", "comments": "Heavy rain in spring"},
+            {"year": 2021, "crop_type": "wheat", "comments": "corn stubble left on the field"},
+            {"year": 2022, "crop_type": "corn", "comments": "dry, no rain"},
+            {"year": 2023, "crop_type": "hops"},
+        ]
+        response = client.post(
+            "/rows/bulk",
+            json=[{"table_config_id": table_config_id, "data": row} for row in rows[:3]],
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        response = client.post("/rows", json={"table_config_id": table_config_id, "data": rows[3]})
+        assert response.status_code == status.HTTP_201_CREATED
+
+        def years(response):
+            assert response.status_code == status.HTTP_200_OK
+            return sorted(row["data"]["year"] for row in response.json())
+
+        assert years(search("corn")) == [2020, 2021, 2022]
+        assert years(search("CORN rain")) == [2020, 2022]
+        assert years(search("ho*")) == [2023]
+        assert years(search("stubble")) == [2021]
+        # FTS5 syntax is searched for, not interpreted
+        assert years(search('corn OR "hops" NOT')) == []
+        assert years(search("crop_type:corn")) == []
+        assert years(search("rain", table_config_id=table_config_id + 1)) == []
+        for bad_query in ("", "  * "):
+            assert search(bad_query).status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+        response = search("corn", limit=2)
+        assert len(response.json()) == 2
+        assert "offset=2" in response.headers["link"]
+        response = search("corn", limit=2, offset=2)
+        assert len(response.json()) == 1
+        assert "link" not in response.headers
+
+        # deleted rows leave the index
+        row_id = search("stubble").json()[0]["id"]
+        response = client.delete(f"/rows/{row_id}")
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        assert years(search("corn")) == [2020, 2022]
+        delete_table_config(client, table_config_id, cascade=True)
+        assert search("rain").json() == []
+
+
+def test_table_config_etag():
+    with TestClient(app) as client:
+        table_config_id = create_table_config(client)["id"]
+        response = client.get(f"/table-configs/{table_config_id}")
+        etag = response.headers["etag"]
+        response = client.get(
+            f"/table-configs/{table_config_id}", headers={"if-none-match": etag}
+        )
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+        table_view_id = create_table_view(client, table_config_id)["id"]
+        response = client.get(f"/table-views/{table_view_id}", headers={"if-none-match": etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["etag"] != etag
+        # deletes evict cached entities
+        delete_table_view(client, table_view_id)
+        response = client.get(f"/table-views/{table_view_id}")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        delete_table_config(client, table_config_id)
+        response = client.get(f"/table-configs/{table_config_id}")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        # a recreated config reuses the id but not the etag
+        assert create_table_config(client)["id"] == table_config_id
+        response = client.get(
+            f"/table-configs/{table_config_id}", headers={"if-none-match": etag}
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_render_table_view():
+    with TestClient(app) as client:
+        table_config_id = create_table_config(client)["id"]
+        table_view_id = create_table_view(client, table_config_id)["id"]
+        response = client.get(f"/table-views/{table_view_id}/render")
+        assert response.status_code == status.HTTP_200_OK
+        rendered = response.json()
+        assert rendered["table_view_id"] == table_view_id
+        assert rendered["table_config_id"] == table_config_id
+        assert rendered["num_rows"] == 5
+        assert rendered["columns"] == [
+            {"name": "year", "type": "int"},
+            {"name": "is_tilled", "type": "bool"},
+            {"name": "external_account_id", "type": "str", "validation_regex": ".*"},
+            {"name": "tillage_depth", "type": "float", "display_type": "FLOAT_SLIDER"},
+        ]
+        etag = response.headers["etag"]
+        response = client.get(
+            f"/table-views/{table_view_id}/render", headers={"if-none-match": etag}
+        )
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        delete_table_view(client, table_view_id)
+        response = client.get(f"/table-views/{table_view_id}/render")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        # views may only use columns of an existing config
+        data = {
+            "name": TableViewName.FARMING_PRACTICE_TYPICAL_VIEW,
+            "table_config_id": table_config_id,
+            "view_fields": {"columns": {"soil_type": {}}},
+        }
+        response = client.post("/table-views", json=data)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        for view_fields in (
+            {"columns": []},
+            {"columns": {"year": 5}},
+            {"column_order": 5},
+            {"column_order": [["year"]]},
+            {"column_order": ["soil_type"]},
+        ):
+            data["view_fields"] = view_fields
+            response = client.post("/table-views", json=data)
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        data["table_config_id"] = table_config_id + 1
+        data["view_fields"] = {}
+        response = client.post("/table-views", json=data)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_export_rows(monkeypatch):
+    monkeypatch.setattr(main.settings, "export_batch_size", 2)
+    with TestClient(app) as client:
+        table_config_id = create_table_config(client)["id"]
+        rows = [
+            {"table_config_id": table_config_id, "data": {"year": 2020, "is_tilled": True}},
+            {"table_config_id": table_config_id, "data": {"crop_type": "corn, sweet"}},
+            {"table_config_id": table_config_id, "data": {"tillage_depth": 1.5}},
+        ]
+        ids = client.post("/rows/bulk", json=rows).json()["ids"]
+        url = f"/table-configs/{table_config_id}/export"
+        response = client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("text/csv")
+        assert response.text.splitlines() == [
+            "id,year,crop_type,tillage_depth,comments,is_tilled,external_account_id",
+            f"{ids[0]},2020,,,,True,",
+            f'{ids[1]},,"corn, sweet",,,,',
+            f"{ids[2]},,,1.5,,,",
+        ]
+        response = client.get(url, params={"format": "ndjson"})
+        assert response.status_code == status.HTTP_200_OK
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["id"] for line in lines] == ids
+        assert lines[0]["is_tilled"] is True and lines[0]["year"] == 2020
+        assert lines[2]["tillage_depth"] == 1.5 and lines[2]["comments"] is None
+        response = client.get("/table-configs/0/export")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_archived_rows(monkeypatch, tmp_path):
+    monkeypatch.setattr(main.settings, "archive_path", str(tmp_path / "archive.db"))
+    monkeypatch.setattr(main.settings, "export_batch_size", 2)
+    with TestClient(app) as client:
+        table_config_id = create_table_config(client)["id"]
+        ids = create_rows(client, table_config_id, count=3)["ids"]
+        with main.uow_factory() as uow:
+            assert uow.rows.archive(table_config_ids=[table_config_id]) == 3
+        assert client.get("/rows").json() == []
+        response = client.get("/rows", params={"include_archived": True, "limit": 2})
+        assert [row["id"] for row in response.json()] == ids[:2]
+        assert f"after={ids[1]}" in response.headers["link"]
+        assert get_row(client, ids[2])["data"]["year"] == 2002
+        response = client.get(
+            f"/table-configs/{table_config_id}/export", params={"include_archived": True}
+        )
+        assert [line.split(",")[0] for line in response.text.splitlines()[1:]] == list(map(str, ids))
+        response = client.get("/rows", params={
+            "table_config_id": table_config_id, "filter": "year:eq:2000", "include_archived": True
+        })
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        response = client.delete(f"/table-configs/{table_config_id}")
+        assert response.status_code == status.HTTP_409_CONFLICT
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_export_rows_parquet():
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    with TestClient(app) as client:
+        table_config_id = create_table_config(client)["id"]
+        create_rows(client, table_config_id, count=3)
+        response = client.get(
+            f"/table-configs/{table_config_id}/export", params={"format": "parquet"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        table = pyarrow_parquet.read_table(io.BytesIO(response.content))
+        assert table.column_names[:3] == ["id", "year", "crop_type"]
+        assert str(table.schema.field("is_tilled").type) == "bool"
+        assert table.column("year").to_pylist() == [2000, 2001, 2002]
+
+
+def test_metrics():
+    with TestClient(app) as client:
+        user_id = create_user(client)["id"]
+        get_user(client, user_id)
+        delete_user(client, user_id)
+        client.get("/no-such-route")
+        client.request("BREW", "/users")
+        response = client.get("/metrics")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        samples = dict(
+            line.rsplit(" ", 1) for line in response.text.splitlines() if not line.startswith("#")
+        )
+        route = 'method="GET",route="/users/{user_id}"'
+        assert int(samples[f'http_requests_total{{{route},status="200"}}']) >= 1
+        assert int(samples[f'http_request_duration_seconds_count{{{route}}}']) >= 1
+        assert int(samples[f'db_queries_total{{{route}}}']) >= 1
+        assert 'http_requests_total{method="GET",route="unmatched",status="404"}' in samples
+        assert not any('method="BREW"' in sample for sample in samples)
+        assert any(sample.startswith('http_requests_total{method="other"') for sample in samples)
+        assert samples["http_requests_in_flight"] == "1"
+
+
+def test_admission(monkeypatch):
+    # writes shed at once, reads unaffected
+    monkeypatch.setattr(main.settings, "admission_write_limit", 0)
+    monkeypatch.setattr(main.settings, "admission_write_queue", 0)
+    monkeypatch.setattr(main.settings, "admission_retry_after", 3)
+    with TestClient(app) as client:
+        response = client.post("/users", json={"name": "foobar"})
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.headers["retry-after"] == "3"
+        response = client.post("/rows/lookup", json={"ids": [1]})
+        assert response.status_code == status.HTTP_200_OK
+        get_all_users(client)
+        samples = dict(
+            line.rsplit(" ", 1)
+            for line in client.get("/metrics").text.splitlines()
+            if not line.startswith("#")
+        )
+        assert samples['admission_rejected_total{kind="write",reason="queue_full"}'] == "1"
+        assert samples['admission_in_flight{kind="write"}'] == "0"
+        assert int(samples['admission_wait_seconds_count{kind="read"}']) >= 2
+
+
+def test_aggregate_rows():
+    with TestClient(app) as client:
+        data = {
+            "name": TableConfigName.FARMING_PRACTICE_CONFIG,
+            "config_fields": {
+                "columns": {
+                    "year": {"type": "int"},
+                    "crop_type": {"type": "str"},
+                    "tillage_depth": {"type": "float"},
+                    "is_tilled": {"type": "bool"},
+                },
+                "summaries": [["year"], ["year", "crop_type"]],
+            },
+        }
+        response = client.post("/table-configs", json=data)
+        assert response.status_code == status.HTTP_201_CREATED
+        table_config_id = response.json()["id"]
+        rows = [
+            {"year": 2020, "crop_type": "corn", "tillage_depth": 1.0, "is_tilled": True},
+            {"year": 2020, "crop_type": "corn", "tillage_depth": 2.0, "is_tilled": False},
+            {"year": 2020, "crop_type": "wheat", "is_tilled": True},
+            {"year": 2021, "crop_type": "corn", "tillage_depth": 4.0},
+            {"crop_type": "hops", "tillage_depth": 8.0},
+        ]
+        ids = client.post(
+            "/rows/bulk", json=[{"table_config_id": table_config_id, "data": row} for row in rows]
+        ).json()["ids"]
+        client.post("/rows", json={"table_config_id": table_config_id, "data": {"year": 2022}})
+        delete_row(client, ids[1])
+
+        url = f"/table-configs/{table_config_id}/aggregate"
+        metrics = ["count", "sum:tillage_depth", "avg:tillage_depth", "sum:year"]
+
+        def aggregate(**params):
+            response = client.get(url, params=params)
+            assert response.status_code == status.HTTP_200_OK
+            return response.json()
+
+        # kept up to date through adds and deletes
+        response = aggregate(group_by="year", metric=metrics)
+        assert response["materialized"] is True
+        expected = [
+            {"year": None, "count": 1, "sum_tillage_depth": 8.0, "avg_tillage_depth": 8.0, "sum_year": None},
+            {"year": 2020, "count": 2, "sum_tillage_depth": 1.0, "avg_tillage_depth": 1.0, "sum_year": 4040},
+            {"year": 2021, "count": 1, "sum_tillage_depth": 4.0, "avg_tillage_depth": 4.0, "sum_year": 2021},
+            {"year": 2022, "count": 1, "sum_tillage_depth": None, "avg_tillage_depth": None, "sum_year": 2022},
+        ]
+        assert response["groups"] == expected
+        # computed by SQLite, with the same result
+        response = aggregate(group_by="year", metric=metrics, filter="year:ge:0")
+        assert response["materialized"] is False
+        assert response["groups"] == expected[1:]
+        assert aggregate()["groups"] == [{"count": 5}]
+        response = aggregate(group_by=["year", "crop_type"])
+        assert response["materialized"] is True
+        assert [group["count"] for group in response["groups"]] == [1, 1, 1, 1, 1]
+        response = aggregate(group_by="is_tilled", metric=["min:tillage_depth", "max:year"])
+        assert response["materialized"] is False
+        assert response["groups"] == [
+            {"is_tilled": None, "min_tillage_depth": 4.0, "max_year": 2022},
+            {"is_tilled": True, "min_tillage_depth": 1.0, "max_year": 2020},
+        ]
+
+        for params in ({"group_by": "comments"}, {"metric": "avg:crop_type"}, {"metric": "median:year"}):
+            response = client.get(url, params=params)
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        response = client.get("/table-configs/0/aggregate")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        # groups whose rows are all gone disappear
+        delete_row(client, ids[4])
+        response = aggregate(group_by="year", metric=metrics)
+        assert response["groups"] == expected[1:]
+        # running totals go with their config
+        delete_table_config(client, table_config_id, cascade=True)
+        with main.engine.connect() as connection:
+            assert connection.execute(text("SELECT count(*) FROM rowaggregate")).scalar() == 0
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_delete_rows(monkeypatch):
+    monkeypatch.setattr(main.settings, "delete_chunk_size", 2)
+    with TestClient(app) as client:
+        table_config_id = create_table_config(client)["id"]
+        ids = create_rows(client, table_config_id, count=8)["ids"]
+        # by id, in chunks of two, ignoring ids that don't exist
+        response = client.post("/rows/delete", json={"ids": ids[:2] + [0]})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"deleted": 2}
+        response = client.delete(f"/rows/{ids[0]}")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        # by filter, in chunks of two
+        response = client.delete(
+            "/rows", params={"table_config_id": table_config_id, "filter": "year:lt:2005"}
+        )
+        assert response.json() == {"deleted": 3}
+        assert [row["id"] for row in get_all_rows(client)] == ids[5:]
+        response = client.delete("/rows", params={"created_before": "2000-01-01T00:00:00"})
+        assert response.json() == {"deleted": 0}
+        response = client.delete("/rows")
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        response = client.get(f"/table-configs/{table_config_id}/aggregate")
+        assert response.json()["groups"] == [{"count": 3}]
+
+        # a config with rows or views is only deleted along with them
+        table_view_id = create_table_view(client, table_config_id)["id"]
+        get_table_view(client, table_view_id)
+        response = client.delete(f"/table-configs/{table_config_id}")
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert len(get_all_rows(client)) == 3
+        delete_table_config(client, table_config_id, cascade=True)
+        assert get_all_rows(client) == []
+        assert get_all_table_views(client) == []
+        for url in (f"/table-views/{table_view_id}", f"/table-views/{table_view_id}/render"):
+            assert client.get(url).status_code == status.HTTP_404_NOT_FOUND
+        response = client.delete(f"/table-configs/{table_config_id}", params={"cascade": True})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_lookup():
+    with TestClient(app) as client:
+        table_config_id = create_table_config(client)["id"]
+        table_view_id = create_table_view(client, table_config_id)["id"]
+        ids = create_rows(client, table_config_id, count=4)["ids"]
+        # request order, missing ids reported rather than failing the batch
+        lookup = [ids[2], 0, ids[0], ids[2]]
+        response = client.post("/rows/lookup", json={"ids": lookup})
+        assert response.status_code == status.HTTP_200_OK
+        response = response.json()
+        assert [row["id"] for row in response["found"]] == [ids[2], ids[0], ids[2]]
+        assert response["found"][1] == get_row(client, ids[0])
+        assert response["missing"] == [0]
+        response = client.post("/table-configs/lookup", json={"ids": [table_config_id, 0]})
+        assert response.json() == {
+            "found": [get_table_config(client, table_config_id)],
+            "missing": [0],
+        }
+        response = client.post("/table-views/lookup", json={"ids": [table_view_id]})
+        assert response.json() == {"found": [get_table_view(client, table_view_id)], "missing": []}
+        response = client.post("/rows/lookup", json={"ids": []})
+        assert response.json() == {"found": [], "missing": []}
+        response = client.post("/rows/lookup", json={"ids": list(range(1001))})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        delete_table_config(client, table_config_id, cascade=True)
+
+
+def test_positional_storage():
+    with TestClient(app) as client:
+        data = {
+            "name": TableConfigName.FARMING_PRACTICE_CONFIG,
+            "config_fields": {
+                "columns": {
+                    "year": {"type": "int", "indexed": True},
+                    "crop_type": {"type": "str"},
+                    "tillage_depth": {"type": "float"},
+                    "is_tilled": {"type": "bool"},
+                },
+                "summaries": [["year"]],
+                "storage": "positional",
+            },
+        }
+        table_config_id = client.post("/table-configs", json=data).json()["id"]
+        rows = [
+            {"year": 2020, "crop_type": "corn", "tillage_depth": 1.5, "is_tilled": True},
+            {"year": 2021, "tillage_depth": 2.5},
+            {"year": 2021, "crop_type": "wheat"},
+        ]
+        ids = client.post(
+            "/rows/bulk", json=[{"table_config_id": table_config_id, "data": row} for row in rows]
+        ).json()["ids"]
+        response = client.post("/rows", json={"table_config_id": table_config_id, "data": {}})
+        assert response.json()["data"] == {}
+        ids.append(response.json()["id"])
+        with main.engine.connect() as connection:
+            stored = connection.execute(text("SELECT data FROM row ORDER BY id")).scalars().all()
+            assert [json.loads(value) for value in stored] == [
+                [2020, "corn", 1.5, True], [2021, None, 2.5], [2021, "wheat"], []
+            ]
+            plan = connection.execute(
+                text(
+                    "EXPLAIN QUERY PLAN SELECT id FROM row "
+                    f"WHERE table_config_id + 0 = {table_config_id} "
+                    "AND json_extract(row.data, '$[0]') = 2021"
+                )
+            ).all()
+            assert f"ix_row_data_{table_config_id}_year" in str(plan)
+
+        # rows read back as objects
+        assert get_row(client, ids[1])["data"] == rows[1]
+        assert [row["data"] for row in get_all_rows(client)] == rows + [{}]
+        response = client.post("/rows/lookup", json={"ids": ids[:1]})
+        assert response.json()["found"][0]["data"] == rows[0]
+        response = client.get(
+            "/rows", params={"table_config_id": table_config_id, "filter": "year:eq:2021"}
+        )
+        assert [row["data"] for row in response.json()] == rows[1:]
+        response = client.get(f"/table-configs/{table_config_id}/export")
+        assert response.text.splitlines()[1:] == [
+            f"{ids[0]},2020,corn,1.5,True",
+            f"{ids[1]},2021,,2.5,",
+            f"{ids[2]},2021,wheat,,",
+            f"{ids[3]},,,,",
+        ]
+
+        def aggregate(**params):
+            response = client.get(f"/table-configs/{table_config_id}/aggregate", params=params)
+            return response.json()["groups"]
+
+        client.delete(f"/rows/{ids[3]}")
+        assert aggregate(group_by="year", metric="sum:tillage_depth") == [
+            {"year": 2020, "sum_tillage_depth": 1.5}, {"year": 2021, "sum_tillage_depth": 2.5}
+        ]
+        assert aggregate(group_by="crop_type", metric="max:tillage_depth") == [
+            {"crop_type": None, "max_tillage_depth": 2.5},
+            {"crop_type": "corn", "max_tillage_depth": 1.5},
+            {"crop_type": "wheat", "max_tillage_depth": None},
+        ]
+        data["config_fields"]["storage"] = "columnar"
+        response = client.post("/table-configs", json=data)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        delete_table_config(client, table_config_id, cascade=True)
+
+
+def wait_for_import(client, response) -> dict:
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    url = response.headers["location"]
+    for _ in range(200):
+        import_job = client.get(url).json()
+        if import_job["status"] in ("succeeded", "failed"):
+            return import_job
+        time.sleep(0.05)
+    raise AssertionError(f"{url} did not finish")
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_import_rows(monkeypatch, tmp_path):
+    # the import runs on its own thread, which can't share the one
+    # connection an in-memory database has
+    monkeypatch.setattr(main.settings, "db_path", str(tmp_path / "import.db"))
+    monkeypatch.setattr(main.settings, "import_dir", str(tmp_path))
+    monkeypatch.setattr(main.settings, "import_batch_size", 2)
+    with TestClient(app) as client:
+        table_config_id = create_table_config(client)["id"]
+        url = f"/table-configs/{table_config_id}/imports"
+        # an export imports as it is
+        create_rows(client, table_config_id, count=3)
+        export = client.get(f"/table-configs/{table_config_id}/export").content
+        response = client.post(url, content=export, headers={"content-type": "text/csv"})
+        import_job = wait_for_import(client, response)
+        assert import_job["status"] == "succeeded"
+        assert import_job["format"] == "csv"
+        assert (import_job["rows_processed"], import_job["rows_inserted"]) == (3, 3)
+        assert import_job["rows_per_second"] > 0
+        rows = [row["data"] for row in get_all_rows(client)]
+        assert rows[3:] == rows[:3]
+
+        # rows with errors are reported and the rest inserted
+        upload = "year,is_tilled,foo\n2020,true,\n20x0,false,\n2021,,bar\n"
+        response = client.post(url, content=upload, headers={"content-type": "text/csv"})
+        import_job = wait_for_import(client, response)
+        assert import_job["status"] == "succeeded"
+        assert import_job["rows_processed"] == 3
+        assert (import_job["rows_inserted"], import_job["rows_failed"]) == (1, 2)
+        assert import_job["errors"] == [
+            {"line": 3, "column": "year", "msg": "value is not a valid int"},
+            {"line": 4, "column": "foo", "msg": "unknown column"},
+        ]
+        upload = '{"id": 1, "year": 2022, "comments": null}\nnot json\n\n[2022]\n'
+        response = client.post(
+            url, content=upload, headers={"content-type": "application/x-ndjson"}
+        )
+        import_job = wait_for_import(client, response)
+        assert (import_job["rows_inserted"], import_job["rows_failed"]) == (1, 2)
+        assert [error["line"] for error in import_job["errors"]] == [2, 4]
+        assert get_all_rows(client)[-1]["data"] == {"year": 2022}
+        assert len(get_all_rows(client)) == 8
+        assert list(tmp_path.glob("import-*")) == []
+
+        response = client.post(url, json=[], headers={"content-type": "application/json"})
+        assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        response = client.post(
+            "/table-configs/0/imports", content="year\n", headers={"content-type": "text/csv"}
+        )
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert client.get("/imports/0").status_code == status.HTTP_404_NOT_FOUND
+        # finished imports go with their config
+        delete_table_config(client, table_config_id, cascade=True)
+        response = client.get(f"/imports/{import_job['id']}")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_interrupted_imports_fail_at_startup(monkeypatch, tmp_path):
+    monkeypatch.setattr(main.settings, "db_path", str(tmp_path / "import.db"))
+    monkeypatch.setattr(main.settings, "memory_dir", str(tmp_path))
+    monkeypatch.setattr(main.settings, "import_dir", str(tmp_path))
+    with TestClient(app) as client:
+        table_config_id = create_table_config(client)["id"]
+        # as a crash would leave a job and its upload
+        with main.uow_factory() as context:
+            import_job = context.import_jobs.add(
+                ImportJob(table_config_id=table_config_id, format=ImportFormat.CSV)
+            )
+            context.commit()
+        with open(spool_path(str(tmp_path), import_job.id), "w") as file:
+            file.write("year\n2020\n")
+        response = client.delete(f"/table-configs/{table_config_id}")
+        assert response.status_code == status.HTTP_409_CONFLICT
+        # a cascade refuses before deleting anything
+        create_table_view(client, table_config_id)
+        create_rows(client, table_config_id, count=3)
+        response = client.delete(f"/table-configs/{table_config_id}", params={"cascade": True})
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert (len(get_all_rows(client)), len(get_all_table_views(client))) == (3, 1)
+    with TestClient(app) as client:
+        import_job = client.get(f"/imports/{import_job.id}").json()
+        assert import_job["status"] == "failed"
+        assert import_job["error"] == "interrupted by a restart"
+        assert import_job["finished_at"] is not None
+        assert list(tmp_path.glob("import-*")) == []
+        delete_table_config(client, table_config_id, cascade=True)
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_changes():
+    with TestClient(app) as client:
+
+        def get_changes(since: int, limit: int = 100) -> dict:
+            response = client.get("/changes", params={"since": since, "limit": limit})
+            assert response.status_code == status.HTTP_200_OK
+            return response.json()
+
+        start = get_changes(0, limit=1000)["cursor"]
+        table_config = create_table_config(client)
+        table_view = create_table_view(client, table_config["id"])
+        ids = create_rows(client, table_config["id"], count=3)["ids"]
+        row = get_row(client, ids[0])
+        feed = get_changes(start)
+        assert not feed["has_more"]
+        assert [(change["entity"], change["id"]) for change in feed["changes"]] == [
+            ("table_config", table_config["id"]),
+            ("table_view", table_view["id"]),
+        ] + [("row", row_id) for row_id in ids]
+        assert feed["changes"][0]["value"] == table_config
+        assert feed["changes"][2]["value"] == row
+        assert not any(change["deleted"] for change in feed["changes"])
+        seqs = [change["seq"] for change in feed["changes"]]
+        assert seqs == sorted(seqs) and feed["cursor"] == seqs[-1]
+
+        # paged, and nothing after the last change
+        first = get_changes(start, limit=2)
+        assert first["has_more"] and len(first["changes"]) == 2
+        assert get_changes(first["cursor"])["changes"] == feed["changes"][2:]
+        assert get_changes(feed["cursor"]) == {
+            "changes": [], "cursor": feed["cursor"], "has_more": False
+        }
+
+        # deletes replace the entity's change with a tombstone
+        delete_row(client, ids[1])
+        feed = get_changes(feed["cursor"])
+        assert feed["changes"] == [
+            {"seq": feed["cursor"], "entity": "row", "id": ids[1], "deleted": True, "value": None}
+        ]
+        delete_table_config(client, table_config["id"], cascade=True)
+        feed = get_changes(start)
+        assert {(change["entity"], change["id"]) for change in feed["changes"]} == {
+            ("table_config", table_config["id"]),
+            ("table_view", table_view["id"]),
+        } | {("row", row_id) for row_id in ids}
+        assert all(change["deleted"] and change["value"] is None for change in feed["changes"])
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_batch():
+    with TestClient(app) as client:
+        row_data = {"year": 2023, "crop_type": "corn", "external_account_id": "A1"}
+
+        def create_row(data: dict, **fields) -> dict:
+            value = {"table_config_id": "$config", "data": data}
+            return {"op": "create", "entity": "row", "value": value, **fields}
+
+        operations = [
+            {
+                "op": "create",
+                "entity": "table_config",
+                "ref": "config",
+                "value": {
+                    "name": TableConfigName.FARMING_PRACTICE_CONFIG,
+                    "config_fields": {
+                        "columns": {
+                            "year": {"type": "int"},
+                            "crop_type": {"type": "str"},
+                            "external_account_id": {"type": "str"},
+                        }
+                    },
+                },
+            },
+            {
+                "op": "create",
+                "entity": "table_view",
+                "value": {
+                    "name": TableViewName.FARMING_PRACTICE_OFFERING_VIEW,
+                    "table_config_id": "$config",
+                    "view_fields": {
+                        "columns": {"external_account_id": {"validation_regex": "[A-Z][0-9]"}},
+                    },
+                },
+            },
+            create_row(row_data, ref="first"),
+            create_row(row_data),
+            {"op": "delete", "entity": "row", "id": "$first"},
+            {"op": "create", "entity": "user", "value": {"name": "foobar"}},
+        ]
+
+        # nothing is kept from a batch that fails, wherever it fails
+        failures = [
+            (create_row({"year": "x"}), status.HTTP_422_UNPROCESSABLE_ENTITY),
+            # the view's validation_regex
+            (create_row({"external_account_id": "a"}), status.HTTP_422_UNPROCESSABLE_ENTITY),
+            (
+                {"op": "delete", "entity": "row", "id": "$missing"},
+                status.HTTP_422_UNPROCESSABLE_ENTITY,
+            ),
+            ({"op": "delete", "entity": "row", "id": 999}, status.HTTP_404_NOT_FOUND),
+            (
+                {"op": "delete", "entity": "table_config", "id": "$config"},
+                status.HTTP_409_CONFLICT,
+            ),
+        ]
+        for operation, status_code in failures:
+            response = client.post("/batch", json={"operations": operations + [operation]})
+            assert response.status_code == status_code, response.text
+            assert get_all_table_configs(client) == []
+            assert get_all_table_views(client) == []
+            assert get_all_rows(client) == []
+            assert get_all_users(client) == []
+        response = client.post("/batch", json={"operations": operations + [failures[0][0]]})
+        loc = response.json()["detail"][0]["loc"]
+        assert loc == ["body", "operations", 6, "value", "data", "year"]
+        response = client.post("/batch", json={"operations": operations + [failures[3][0]]})
+        assert response.json()["detail"] == "operations[6]: row_id not found"
+
+        response = client.post("/batch", json={"operations": operations})
+        assert response.status_code == status.HTTP_200_OK
+        results = response.json()["results"]
+        assert [(result["op"], result["entity"]) for result in results] == [
+            (operation["op"], operation["entity"]) for operation in operations
+        ]
+        table_config_id, table_view_id, first_id, row_id, deleted_id, user_id = [
+            result["id"] for result in results
+        ]
+        assert deleted_id == first_id
+        assert get_table_view(client, table_view_id)["table_config_id"] == table_config_id
+        assert [row["id"] for row in get_all_rows(client)] == [row_id]
+        assert get_row(client, row_id)["data"] == row_data
+        assert get_user(client, user_id)["name"] == "foobar"
+        # the view created in the batch applies to rows posted after it
+        response = client.post(
+            "/rows",
+            json={"table_config_id": table_config_id, "data": {"external_account_id": "a"}},
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.usefixtures("storage_backend")
+def test_batch_ids_and_key_conflicts():
+    with TestClient(app) as client:
+
+        def create_row(year: int, table_config_id="$config") -> dict:
+            value = {"table_config_id": table_config_id, "data": {"year": year}}
+            return {"op": "create", "entity": "row", "value": value}
+
+        create_config = {
+            "op": "create",
+            "entity": "table_config",
+            "ref": "config",
+            "value": {
+                "name": TableConfigName.FARMING_PRACTICE_CONFIG,
+                "config_fields": {"columns": {"year": {"type": "int"}}, "natural_key": ["year"]},
+            },
+        }
+        # ids are ints or refs
+        for operation in (
+            {"op": "delete", "entity": "row", "id": "abc"},
+            create_row(2020, table_config_id="abc"),
+        ):
+            response = client.post("/batch", json={"operations": [create_config, operation]})
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+            assert response.json()["detail"] == "operations[1]: 'abc' is neither an id nor a $ref"
+
+        # the row repeating a key is the one reported, not the first of the run
+        operations = [create_config, create_row(2020), create_row(2021), create_row(2021)]
+        response = client.post("/batch", json={"operations": operations})
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.json()["detail"].startswith("operations[3]: ")
+        response = client.post("/batch", json={"operations": operations[:2]})
+        assert response.status_code == status.HTTP_200_OK
+        table_config_id = response.json()["results"][0]["id"]
+        operations = [create_row(year, table_config_id) for year in (2019, 2020, 2022)]
+        response = client.post("/batch", json={"operations": operations})
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.json()["detail"].startswith("operations[1]: ")
+        assert len(get_all_rows(client)) == 1
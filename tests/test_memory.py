@@ -0,0 +1,103 @@
+import pytest
+
+from data_collection.constants import ChangedEntity, TableConfigName
+from data_collection.exceptions import EntityInUse, StoreInUse
+from data_collection.memory import MemoryStore
+from data_collection.models import Row, TableConfig
+from data_collection.unit_of_work import InMemoryUnitOfWork
+
+CONFIG_FIELDS = {
+    "columns": {"year": {"type": "int"}, "crop_type": {"type": "str"}},
+    "natural_key": ["year"],
+}
+
+
+def fill(store: MemoryStore) -> int:
+    with InMemoryUnitOfWork(store) as uow:
+        table_config = uow.table_configs.add(
+            TableConfig(name=TableConfigName.FARMING_PRACTICE_CONFIG, config_fields=CONFIG_FIELDS)
+        )
+        uow.rows.add_many([
+            Row(table_config_id=table_config.id, data={"year": 2020 + i, "crop_type": "corn"})
+            for i in range(5)
+        ])
+        uow.rows.delete(2)
+        uow.commit()
+    return table_config.id
+
+
+def contents(store: MemoryStore) -> dict:
+    with InMemoryUnitOfWork(store) as uow:
+        return {
+            "rows": [(row.id, row.created_at, row.data) for row in uow.rows.all()],
+            "table_configs": [entity.dict() for entity in uow.table_configs.all()],
+            "changes": [change.dict() for change in uow.changes.page(100)],
+        }
+
+
+@pytest.mark.parametrize("snapshot_every", [100_000, 4])
+def test_reopen(tmp_path, snapshot_every):
+    store = MemoryStore(str(tmp_path), snapshot_every)
+    table_config_id = fill(store)
+    expected = contents(store)
+    store.close()
+    assert (tmp_path / "snapshot.jsonl").exists() == (snapshot_every == 4)
+
+    store = MemoryStore(str(tmp_path), snapshot_every)
+    assert contents(store) == expected
+    with InMemoryUnitOfWork(store) as uow:
+        assert [row.id for row in uow.rows.page(10, 1, table_config_id=table_config_id)] == [3, 4, 5]
+        assert uow.changes.page(1, 5)[0].entity == ChangedEntity.ROW
+        # ids and seqs carry on after the ones handed out before
+        assert uow.rows.add_many([Row(table_config_id=table_config_id, data={})]) == [6]
+        uow.commit()
+        assert uow.changes.page(10, 7)[-1].seq == 8
+        # and rows are found by natural key again; 2021 was deleted
+        rows = [Row(table_config_id=table_config_id, data={"year": year}) for year in (2022, 2021)]
+        assert uow.rows.upsert_many(rows) == [(3, False), (7, True)]
+    store.close()
+
+
+def test_torn_log(tmp_path):
+    store = MemoryStore(str(tmp_path))
+    fill(store)
+    expected = contents(store)
+    store.close()
+    with open(tmp_path / "log.jsonl", "ab") as log:
+        log.write(b'[["put", "user", {"id": 1, "na')
+
+    store = MemoryStore(str(tmp_path))
+    assert contents(store) == expected
+    with InMemoryUnitOfWork(store) as uow:
+        uow.rows.delete(1)
+        uow.commit()
+    store.close()
+    assert MemoryStore(str(tmp_path)).tables["row"].records.keys() == {3, 4, 5}
+
+
+def test_rollback():
+    store = MemoryStore()
+    table_config_id = fill(store)
+    expected = contents(store)
+    with InMemoryUnitOfWork(store) as uow:
+        assert uow.rows.delete_many([1, 3, 4]) == 3
+        with pytest.raises(EntityInUse):
+            uow.table_configs.delete(table_config_id)
+        assert uow.table_views.delete_by_table_config_id(table_config_id) == 0
+        uow.rollback()
+        assert contents(store) == expected
+        uow.rows.delete_many([1, 3, 4, 5])
+        uow.table_configs.delete(table_config_id)
+    assert contents(store) == expected
+    with InMemoryUnitOfWork(store) as uow:
+        assert [row.id for row in uow.rows.page(10, table_config_id=table_config_id)] == [1, 3, 4, 5]
+        with pytest.raises(EntityInUse):
+            uow.rows.add(Row(table_config_id=table_config_id, data={"year": 2020}))
+
+
+def test_directory_in_use(tmp_path):
+    store = MemoryStore(str(tmp_path))
+    with pytest.raises(StoreInUse):
+        MemoryStore(str(tmp_path))
+    store.close()
+    MemoryStore(str(tmp_path)).close()
@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+from sqlalchemy import text
+
+from config import Settings
+from data_collection import migrations
+from data_collection.aggregation import parse_aggregation
+from data_collection.exceptions import SchemaVersionMismatch
+from data_collection.unit_of_work import create_db_engine, SqlModelUnitOfWork
+
+
+def table_names(engine) -> set[str]:
+    with engine.connect() as connection:
+        return set(
+            connection.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'table'")
+            ).scalars()
+        )
+
+
+def versions(engine) -> list[int]:
+    with engine.connect() as connection:
+        return list(connection.execute(text("SELECT version FROM schemaversion")).scalars())
+
+
+def test_migrate(tmp_path):
+    engine = create_db_engine(Settings(db_path=str(tmp_path / "test.db")))
+    with pytest.raises(SchemaVersionMismatch):
+        migrations.check(engine)
+    assert migrations.migrate(engine) is None
+    assert {"row", "tableconfig", "schemaversion"} <= table_names(engine)
+    migrations.check(engine)
+    assert migrations.migrate(engine) == migrations.SCHEMA_VERSION
+    assert versions(engine) == [migrations.SCHEMA_VERSION]
+
+    # a database migrated by newer code
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO schemaversion (version, applied_at) VALUES (99, '2030-01-01')")
+        )
+    with pytest.raises(SchemaVersionMismatch):
+        migrations.check(engine)
+    with pytest.raises(SchemaVersionMismatch):
+        migrations.migrate(engine)
+    engine.dispose()
+
+
+def index_names(engine, table: str) -> set[str]:
+    with engine.connect() as connection:
+        return set(
+            connection.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"),
+                {"table": table},
+            ).scalars()
+        )
+
+
+def test_migrate_unversioned(tmp_path):
+    # a database from before versioning is completed and stamped the baseline
+    engine = create_db_engine(Settings(db_path=str(tmp_path / "test.db")))
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE user (id INTEGER PRIMARY KEY, name VARCHAR)"))
+        # without the index on table_config_id declared since
+        connection.execute(
+            text(
+                "CREATE TABLE row (id INTEGER PRIMARY KEY, created_at DATETIME NOT NULL, "
+                "table_config_id INTEGER NOT NULL, data JSON)"
+            )
+        )
+    migrations.migrate(engine)
+    assert "tableconfig" in table_names(engine)
+    assert "ix_row_table_config_id" in index_names(engine, "row")
+    assert versions(engine) == list(range(migrations.BASELINE_VERSION, migrations.SCHEMA_VERSION + 1))
+    engine.dispose()
+
+
+def test_migrate_existing_rows(tmp_path):
+    # rows from before version 2 are indexed, summarized and put in the
+    # change feed, stored either way
+    engine = create_db_engine(Settings(db_path=str(tmp_path / "test.db")))
+    migrations.migrate(engine)
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE row_fts"))
+        connection.execute(text("UPDATE schemaversion SET version = 1"))
+        connection.execute(
+            text(
+                "INSERT INTO tableconfig (id, created_at, name, config_fields) VALUES "
+                "(1, '2024-01-01 00:00:00', 'FARMING_PRACTICE_CONFIG', "
+                "'{\"columns\": {\"year\": {\"type\": \"int\"}, \"crop_type\": {\"type\": \"str\"}}}')"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO row (id, created_at, table_config_id, data) VALUES "
+                "(1, '2024-01-01 00:00:00', 1, '{\"year\": 2020, \"crop_type\": \"corn\"}'), "
+                "(2, '2024-01-01 00:00:00', 1, '[2021, \"wheat\"]'), "
+                "(3, '2024-01-01 00:00:00', 1, '[2022, \"corn\"]')"
+            )
+        )
+    assert migrations.migrate(engine) == 1
+    assert versions(engine) == list(range(1, migrations.SCHEMA_VERSION + 1))
+    with SqlModelUnitOfWork(engine) as uow:
+        assert sorted(row.id for row in uow.rows.search("corn", 10)) == [1, 3]
+        assert [row.data for row in uow.rows.search("wheat", 10)] == [{"year": 2021, "crop_type": "wheat"}]
+        table_config = uow.table_configs.get_by_id(1)
+        groups, materialized = uow.rows.aggregate(
+            table_config, parse_aggregation(table_config, [], ["count", "sum:year"], [])
+        )
+        assert (groups, materialized) == ([{"count": 3, "sum_year": 6063}], True)
+        # the change feed starts with them
+        changes = uow.changes.page(10)
+        assert [(change.entity, change.entity_id) for change in changes] == [
+            ("table_config", 1), ("row", 1), ("row", 2), ("row", 3)
+        ]
+    engine.dispose()
+
+
+def test_migrate_concurrently(tmp_path):
+    # workers starting together: one migrates, the others wait and find it done
+    settings = Settings(db_path=str(tmp_path / "test.db"))
+    engines = [create_db_engine(settings) for _ in range(4)]
+    barrier = threading.Barrier(len(engines))
+    errors = []
+
+    def start(engine):
+        barrier.wait()
+        try:
+            migrations.migrate(engine)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=start, args=(engine,)) for engine in engines]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert versions(engines[0]) == [migrations.SCHEMA_VERSION]
+    for engine in engines:
+        engine.dispose()
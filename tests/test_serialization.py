@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import parse_obj_as
+
+from data_collection import serialization
+from data_collection.constants import TableConfigName, TableViewName
+from data_collection.models import RenderedTableView, Row, RowIds, TableConfig, TableView, User
+from data_collection.serialization import dumps, EntityResponse
+
+
+def fastapi_body(model, content) -> bytes:
+    # what a handler with response_model=model sends today
+    return JSONResponse(jsonable_encoder(parse_obj_as(model, content))).body
+
+
+ENTITIES = [
+    User(id=1, name="Zoë \"quoted\" \\ \n\t\x01 ☃"),
+    TableConfig(
+        id=2,
+        created_at=datetime(2023, 7, 1, 12, 30),
+        name=TableConfigName.FARMING_PRACTICE_CONFIG,
+        config_fields={"columns": {"tillage_depth": {"type": "float", "ge": 0, "lt": 1e-05}}},
+    ),
+    TableView(
+        id=3,
+        created_at=datetime(2023, 7, 1, 12, 30, 0, 5),
+        name=TableViewName.FARMING_PRACTICE_TYPICAL_VIEW,
+        table_config_id=2,
+        view_fields={"num_rows": 5, "columns": {}},
+    ),
+    RenderedTableView(table_view_id=3, table_config_id=2, columns=[{"name": "year"}]),
+    RowIds(ids=[1, 2, 3]),
+    Row(id=4, table_config_id=2, data={}),
+    Row(
+        id=5,
+        table_config_id=2,
+        data={"x": 0.1, "big": 1e16, "tiny": 1.5e-300, "neg": -0.0, "int": 2 ** 63 - 1, "none": None},
+    ),
+    Row(id=6, table_config_id=2, data={"huge": 2 ** 70, "note": "1e5 acres"}),
+]
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+@pytest.mark.parametrize("entity", ENTITIES, ids=lambda entity: type(entity).__name__)
+def test_matches_fastapi_output(monkeypatch, use_orjson, entity):
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(serialization, "orjson", None)
+    model = type(entity)
+    assert dumps(entity) == fastapi_body(model, entity)
+    assert dumps([entity, entity]) == fastapi_body(list[model], [entity, entity])
+    assert EntityResponse([entity]).body == fastapi_body(list[model], [entity])
@@ -0,0 +1,86 @@
+from sqlalchemy import text
+
+from config import Settings
+from data_collection import migrations
+from data_collection.cache import CatalogWatch, EntityCache
+from data_collection.constants import TableConfigName, TableViewName
+from data_collection.models import TableConfig, TableView
+from data_collection.unit_of_work import create_db_engine, SqlModelUnitOfWork
+from data_collection.validation import RowValidatorCache
+
+CONFIG_FIELDS = {"columns": {"year": {"type": "int"}, "crop_type": {"type": "str"}}}
+
+
+def test_sqlite_pragmas(tmp_path):
+    settings = Settings(
+        db_path=str(tmp_path / "test.db"),
+        db_busy_timeout_ms=1234,
+        db_cache_size_kib=2048,
+        db_pool_size=2,
+    )
+    engine = create_db_engine(settings)
+    with engine.connect() as connection:
+
+        def pragma(name: str):
+            return connection.execute(text(f"PRAGMA {name}")).scalar()
+
+        assert pragma("journal_mode") == "wal"
+        assert pragma("synchronous") == 1  # NORMAL
+        assert pragma("busy_timeout") == 1234
+        assert pragma("cache_size") == -2048
+    assert engine.pool.size() == 2
+    assert not engine.echo
+    engine.dispose()
+
+
+def test_caches_follow_other_workers(tmp_path):
+    settings = Settings(db_path=str(tmp_path / "test.db"))
+    engine = create_db_engine(settings)
+    migrations.migrate(engine)
+
+    def worker():
+        # each worker process has caches and an engine of its own
+        table_configs, table_views = EntityCache(), EntityCache()
+        row_validators = RowValidatorCache()
+        catalog = CatalogWatch([table_configs, table_views, row_validators])
+        uow = SqlModelUnitOfWork(create_db_engine(settings), table_configs, table_views, catalog=catalog)
+        return uow, row_validators
+
+    first, first_validators = worker()
+    second, second_validators = worker()
+    with first as context:
+        table_config = context.table_configs.add(
+            TableConfig(name=TableConfigName.FARMING_PRACTICE_CONFIG, config_fields=CONFIG_FIELDS)
+        )
+        context.commit()
+    with second as context:
+        assert second_validators.get(context, table_config.id).errors({"crop_type": "x"}) == []
+    # a view adding a regex, then the config deleted and its id reused
+    with first as context:
+        context.table_views.add(
+            TableView(
+                name=TableViewName.FARMING_PRACTICE_TYPICAL_VIEW,
+                table_config_id=table_config.id,
+                view_fields={"columns": {"crop_type": {"validation_regex": "[a-z]{3,}"}}},
+            )
+        )
+        context.commit()
+    with second as context:
+        assert second_validators.get(context, table_config.id).errors({"crop_type": "x"}) != []
+    with first as context:
+        context.table_views.delete_by_table_config_id(table_config.id)
+        context.table_configs.delete(table_config.id)
+        reused = context.table_configs.add(
+            TableConfig(
+                name=TableConfigName.FARMING_PRACTICE_CONFIG,
+                config_fields={"columns": {"year": {"type": "int"}}},
+            )
+        )
+        context.commit()
+    assert reused.id == table_config.id
+    with second as context:
+        assert list(context.table_configs.get_by_id(reused.id).config_fields["columns"]) == ["year"]
+        assert second_validators.get(context, reused.id).names == {"year"}
+    for uow in (first, second):
+        uow.engine.dispose()
+    engine.dispose()